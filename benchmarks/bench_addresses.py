@@ -0,0 +1,92 @@
+"""
+Addresses: generating them from public keys, and decoding and validating them.
+
+Times, on --count public keys (points derived from random scalars with
+bitcoin/utils/secp256k1.py, so the setup stays quick):
+  - generate, old path: SHA-256, RIPEMD-160 and the checksum one key at a
+    time, encoded by the base58 package (generate_address as it was),
+  - generate_address: the same hashes, with the Base58 encoder of
+    bitcoin/utils/utils.py (two digits per big-integer division),
+  - generate_addresses: the batch API, on the PEM keys of this chain and on
+    compressed SEC1 keys (the standard Bitcoin addresses of the same keys),
+  - compressed_public_key: PEM keys converted to 33-byte points,
+  - validate: base58.b58decode_check one address at a time against
+    validate_addresses.
+
+Run from the repository root:
+    python -m benchmarks.bench_addresses [--count 100000]
+"""
+import argparse
+import hashlib
+import os
+import time
+
+import base58
+
+from bitcoin.utils.secp256k1 import N, encode_point, pem_public_key, points_multiply
+from bitcoin.utils.utils import compressed_public_key, generate_address, generate_addresses, validate_addresses
+
+
+def old_generate_address(public_key):
+    """generate_address as it was."""
+    sha256_hash = hashlib.sha256(public_key).digest()
+    ripemd160 = hashlib.new('ripemd160')
+    ripemd160.update(sha256_hash)
+    versioned_key = b'\x00' + ripemd160.digest()
+    checksum = hashlib.sha256(hashlib.sha256(versioned_key).digest()).digest()[:4]
+    return base58.b58encode(versioned_key + checksum).decode('utf-8')
+
+
+def old_validate(address):
+    try:
+        return len(base58.b58decode_check(address)) == 21
+    except ValueError:
+        return False
+
+
+def per_second(count, function):
+    start = time.perf_counter()
+    result = function()
+    return count / (time.perf_counter() - start), result
+
+
+def run(count=100_000):
+    points = points_multiply([int.from_bytes(os.urandom(32), 'big') % (N - 1) + 1 for _ in range(count)])
+    pem_keys = [pem_public_key(point) for point in points]
+    sec1_keys = [encode_point(point) for point in points]
+    results = {'count': count}
+    results['old'], expected = per_second(count, lambda: [old_generate_address(key) for key in pem_keys])
+    results['single'], addresses = per_second(count, lambda: [generate_address(key) for key in pem_keys])
+    results['batch'], batch = per_second(count, lambda: generate_addresses(pem_keys))
+    results['batch_compressed'], _ = per_second(count, lambda: generate_addresses(sec1_keys))
+    results['compress'], compressed = per_second(count, lambda: [compressed_public_key(key) for key in pem_keys])
+    if addresses != expected or batch != expected or compressed != sec1_keys:
+        raise AssertionError("Address generation does not match the old path")
+    # Half of them corrupted in their last character.
+    mixed = [address if i % 2 else address[:-1] + ('2' if address[-1] != '2' else '3')
+             for i, address in enumerate(addresses)]
+    results['validate_old'], expected = per_second(count, lambda: [old_validate(address) for address in mixed])
+    results['validate'], valid = per_second(count, lambda: validate_addresses(mixed))
+    if valid != expected:
+        raise AssertionError("Address validation does not match base58.b58decode_check")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Address generation and validation benchmark")
+    parser.add_argument("--count", type=int, default=100_000, help="Public keys and addresses")
+    args = parser.parse_args()
+
+    r = run(args.count)
+    print(f"{r['count']:,} public keys:")
+    print(f"  generate, old path (base58 package): {r['old']:10,.0f} addresses/s")
+    print(f"  generate_address:                    {r['single']:10,.0f} addresses/s")
+    print(f"  generate_addresses (PEM keys):       {r['batch']:10,.0f} addresses/s")
+    print(f"  generate_addresses (compressed):     {r['batch_compressed']:10,.0f} addresses/s")
+    print(f"  compressed_public_key from PEM:      {r['compress']:10,.0f} keys/s")
+    print(f"  validate, base58.b58decode_check:    {r['validate_old']:10,.0f} addresses/s")
+    print(f"  validate_addresses:                  {r['validate']:10,.0f} addresses/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-nonce hashing cost of the binary block header versus the old string header.
+
+The string header hashed str(index, prev_hash, transactions, timestamp, nonce,
+difficulty) on every attempt, so its cost grew with the number of transactions.
+The binary header hashes a fixed 80 bytes and the mining loop only feeds the
+nonce into a copy of the prefix hash state. CBlock.calculate_hash, which
+serializes the whole header for each hash, is timed as well.
+
+Run from the repository root:
+    python -m benchmarks.bench_block_hash
+"""
+import argparse
+import time
+from hashlib import sha256
+
+from bitcoin.core.blockchain import CBlock, NONCE
+from bitcoin.core.consensus import MAINNET
+from bitcoin.core.transaction import CTransaction
+
+BLOCK_SIZES = (1, 100, 1_000, 10_000)
+
+
+def string_header_hash(block, nonce):
+    """The block hash as CBlock.calculate_hash computed it before the binary header."""
+    block_header = f"{block.index}{block.prev_hash}{block.transactions}{block.timestamp}{nonce}{block.bits}"
+    return sha256(block_header.encode('utf-8')).hexdigest()
+
+
+def sample_block(transactions):
+    txs = [CTransaction(f"sender-{i}", f"receiver-{i}", 1.0, 0.0001, i) for i in range(transactions)]
+    return CBlock(1, "0" * 64, txs, int(time.time()), 0, MAINNET.genesis_bits)
+
+
+def hashes_per_second(hash_nonce, attempts):
+    start = time.perf_counter()
+    for nonce in range(attempts):
+        hash_nonce(nonce)
+    return attempts / (time.perf_counter() - start)
+
+
+def run(block_sizes=BLOCK_SIZES, attempts=20_000):
+    results = {}
+    for size in block_sizes:
+        block = sample_block(size)
+        midstate = sha256(block.header_prefix())
+
+        def midstate_hash(nonce):
+            h = midstate.copy()
+            h.update(NONCE.pack(nonce))
+            return h.hexdigest()
+
+        def calculate_hash(nonce):
+            block.nonce = nonce
+            return block.calculate_hash()
+
+        # The string header slows down so much on big blocks that fewer attempts suffice.
+        string_attempts = max(100, attempts // max(1, size // 10))
+        results[size] = {
+            'string_header_hashes_per_s': hashes_per_second(lambda n: string_header_hash(block, n), string_attempts),
+            'binary_midstate_hashes_per_s': hashes_per_second(midstate_hash, attempts),
+            'calculate_hash_per_s': hashes_per_second(calculate_hash, attempts),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block header hashing benchmark")
+    parser.add_argument("--attempts", type=int, default=20_000, help="Nonces hashed per block size")
+    args = parser.parse_args()
+
+    for size, result in run(attempts=args.attempts).items():
+        print(f"{size:>6} txs: string header {result['string_header_hashes_per_s']:12,.0f} H/s, "
+              f"binary midstate {result['binary_midstate_hashes_per_s']:12,.0f} H/s, "
+              f"calculate_hash {result['calculate_hash_per_s']:12,.0f} H/s")
+
+
+if __name__ == "__main__":
+    main()
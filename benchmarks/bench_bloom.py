@@ -0,0 +1,123 @@
+"""
+Bloom filters: memory per item, adds and lookups per second, false positives.
+
+Compares the bit-packed BloomFilter of bitcoin/utils/utils.py with the filter
+it replaced (a list of ints, one per bit, and two hashes: SHA-256 and MD5
+through hex strings), both sized for --items items at --fp-rate:
+  - memory: bytes of the bit storage per item,
+  - add: --items 32-byte hashes added one at a time, and with add_many,
+  - contains: lookups of the items added, and of as many absent ones,
+  - false positives: measured on the absent items, against the target,
+and the rolling filter against the LimitedSet it replaced for the node's
+seen inventory (SEEN_INVENTORY hashes).
+
+Run from the repository root:
+    python -m benchmarks.bench_bloom [--items 100000] [--fp-rate 0.01]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from bitcoin.network.p2p import INVENTORY_FP_RATE, SEEN_INVENTORY
+from bitcoin.utils.utils import BloomFilter, LimitedSet, RollingBloomFilter
+
+
+class ListBloomFilter:
+    """The Bloom filter as it was: a list of ints and two hashes through hex strings."""
+    def __init__(self, size=1000):
+        self.size = size
+        self.bit_array = [0] * size
+
+    def _hashes(self, item):
+        hash1 = int(hashlib.sha256(item).hexdigest(), 16) % self.size
+        hash2 = int(hashlib.md5(item).hexdigest(), 16) % self.size
+        return hash1, hash2
+
+    def add(self, item):
+        hash1, hash2 = self._hashes(item)
+        self.bit_array[hash1] = 1
+        self.bit_array[hash2] = 1
+
+    def contains(self, item):
+        hash1, hash2 = self._hashes(item)
+        return self.bit_array[hash1] and self.bit_array[hash2]
+
+
+def per_second(count, function):
+    start = time.perf_counter()
+    result = function()
+    return count / (time.perf_counter() - start), result
+
+
+def container_size(entries):
+    """Bytes held by a LimitedSet: its OrderedDict and the keys in it."""
+    return sys.getsizeof(entries._entries) + sum(sys.getsizeof(key) for key in entries._entries)
+
+
+def measure(bloom, items, absent):
+    result = {}
+    result['add_per_s'], _ = per_second(len(items), lambda: [bloom.add(item) for item in items])
+    result['contains_per_s'], found = per_second(len(items), lambda: [bloom.contains(item) for item in items])
+    result['absent_per_s'], false = per_second(len(absent), lambda: [bloom.contains(item) for item in absent])
+    result['missed'] = len(items) - sum(map(bool, found))
+    result['fp_rate'] = sum(map(bool, false)) / len(absent)
+    return result
+
+
+def run(items=100_000, fp_rate=0.01):
+    added = [os.urandom(32) for _ in range(items)]
+    absent = [os.urandom(32) for _ in range(items)]
+    results = {'items': items, 'target_fp_rate': fp_rate}
+
+    bloom = BloomFilter(items, fp_rate)
+    results['bytearray'] = measure(bloom, added, absent)
+    results['bytearray']['bytes_per_item'] = sys.getsizeof(bloom.bits) / items
+    results['bytearray']['num_hashes'] = bloom.num_hashes
+    batch = BloomFilter(items, fp_rate)
+    results['bytearray']['add_many_per_s'], _ = per_second(items, lambda: batch.add_many(added))
+    results['bytearray']['contains_many_per_s'], _ = per_second(items, lambda: batch.contains_many(absent))
+    results['bytearray']['serialized_bytes'] = len(bloom.serialize())
+
+    # The old class took a size in bits: give it as many as the new filter uses.
+    old = ListBloomFilter(bloom.size)
+    results['list'] = measure(old, added, absent)
+    results['list']['bytes_per_item'] = sys.getsizeof(old.bit_array) / items
+
+    inventory = [os.urandom(32) for _ in range(SEEN_INVENTORY)]
+    limited = LimitedSet(SEEN_INVENTORY)
+    rolling = RollingBloomFilter(SEEN_INVENTORY, INVENTORY_FP_RATE)
+    for name, entries in (('limited_set', limited), ('rolling', rolling)):
+        rate, _ = per_second(len(inventory), lambda: [entries.add(key) for key in inventory])
+        lookups, _ = per_second(len(absent), lambda: [key in entries for key in absent])
+        results[name] = {'add_per_s': rate, 'absent_per_s': lookups}
+    results['limited_set']['bytes'] = container_size(limited)
+    results['rolling']['bytes'] = sys.getsizeof(rolling._current.bits) + sys.getsizeof(rolling._previous.bits)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bloom filter benchmark")
+    parser.add_argument("--items", type=int, default=100_000, help="Items added to the filters")
+    parser.add_argument("--fp-rate", type=float, default=0.01, help="Target false-positive rate")
+    args = parser.parse_args()
+
+    results = run(args.items, args.fp_rate)
+    print(f"{results['items']:,} items, target false-positive rate {results['target_fp_rate']}")
+    for name, label in (('list', 'list of ints'), ('bytearray', 'bytearray')):
+        r = results[name]
+        print(f"{label:>12}: {r['bytes_per_item']:7.2f} bytes/item, add {r['add_per_s']:9,.0f}/s, "
+              f"contains {r['contains_per_s']:9,.0f}/s, absent {r['absent_per_s']:9,.0f}/s, "
+              f"false positives {r['fp_rate']:.4%}, missed {r['missed']}")
+    r = results['bytearray']
+    print(f"{'':>12}  {r['num_hashes']} hashes, add_many {r['add_many_per_s']:,.0f}/s, "
+          f"contains_many {r['contains_many_per_s']:,.0f}/s, serialized {r['serialized_bytes']:,} bytes")
+    print(f"seen inventory ({SEEN_INVENTORY:,} hashes):")
+    for name in ('limited_set', 'rolling'):
+        r = results[name]
+        print(f"{name:>12}: {r['bytes']:10,} bytes, add {r['add_per_s']:9,.0f}/s, absent {r['absent_per_s']:9,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
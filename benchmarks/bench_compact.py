@@ -0,0 +1,110 @@
+"""
+Compact block relay: propagation time and bytes sent, against full blocks.
+
+Starts --nodes P2PNodes in one process on loopback, connected in a random
+mesh as in bench_relay. Every node but the first has the block's transactions
+in its pool already, as it would after they were relayed, except a --missing
+fraction of them. The first node then mines the block, and the time until
+every node has connected it and the bytes all nodes sent meanwhile are
+measured for:
+  - full: inv, getdata and the whole block, once per node,
+  - compact: the header and 6-byte short ids (cmpctblock), rebuilt from the
+    pool, with getblocktxn/blocktxn for the transactions a pool lacks,
+at each block size of --transactions.
+
+Run from the repository root:
+    python -m benchmarks.bench_compact [--nodes 8] [--degree 4] [--transactions 1000 5000 10000] [--missing 0.01]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_relay import bytes_sent, mesh, signed_block, wait_until
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import REGTEST, bits_to_target
+from bitcoin.core.mining import search_nonces
+from bitcoin.network.p2p import P2PNode
+
+
+def simulate(block, nodes, degree, missing, compact_blocks, tmp):
+    chains = [Blockchain(data_dir=os.path.join(tmp, f"{compact_blocks}-{len(block.transactions)}-{i}"),
+                         params=REGTEST) for i in range(nodes)]
+    network = [P2PNode(host='127.0.0.1', port=0, bootstrap_ip=None, blockchain=chain,
+                       compact_blocks=compact_blocks) for chain in chains]
+    rng = random.Random(1)
+    for node in network[1:]:
+        for tx in block.transactions[1:]:
+            if rng.random() >= missing:
+                node.transaction_pool.add_transaction(tx)
+    try:
+        for node in network:
+            node.start_node(fetch_public_ip=False)
+        edges = mesh(nodes, degree)
+        for a, b in edges:
+            network[a].connect_to_peer('127.0.0.1', network[b].port).result()
+        wait_until(lambda: sum(len(node.peers) for node in network) == 2 * len(edges))
+        # Let the sendcmpct handshakes land before the block does.
+        time.sleep(0.2)
+
+        before = bytes_sent(network)
+        start = time.perf_counter()
+        chains[0].add_block(block)
+        wait_until(lambda: all(chain.get_last_block().hash == block.hash for chain in chains), timeout=300)
+        elapsed = time.perf_counter() - start
+        # Let trailing announcements drain before counting.
+        time.sleep(0.2)
+        return {'bytes_sent': bytes_sent(network) - before, 'propagation_s': elapsed, 'links': len(edges)}
+    finally:
+        for node in network:
+            node.stop_node()
+        for chain in chains:
+            chain.close()
+
+
+def run(nodes=8, degree=4, transactions=(1000, 5000, 10000), missing=0.01):
+    with tempfile.TemporaryDirectory() as tmp:
+        genesis = Blockchain(data_dir=os.path.join(tmp, 'genesis'), params=REGTEST)
+        parent = genesis.get_last_block().hash
+        genesis.close()
+        # Signing dominates the setup: sign the largest block once and take the others from it.
+        largest = signed_block(parent, max(transactions), REGTEST.genesis_bits)
+        results = {'nodes': nodes, 'missing': missing, 'blocks': []}
+        for count in transactions:
+            block = CBlock(1, parent, largest.transactions[:count + 1], largest.timestamp, 0, REGTEST.genesis_bits)
+            block.nonce = search_nonces(block.header_prefix(), bits_to_target(block.bits), 0, 1, lambda: False)
+            block.hash = block.calculate_hash()
+            result = {'transactions': count, 'block_size': len(block.serialize())}
+            # Every node logs its connections; keep those lines out of the results.
+            with contextlib.redirect_stdout(io.StringIO()):
+                result['full'] = simulate(block, nodes, degree, missing, False, tmp)
+                result['compact'] = simulate(block, nodes, degree, missing, True, tmp)
+            results['blocks'].append(result)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact block relay simulation")
+    parser.add_argument("--nodes", type=int, default=8, help="Nodes in the mesh")
+    parser.add_argument("--degree", type=int, default=4, help="Average connections per node")
+    parser.add_argument("--transactions", type=int, nargs='+', default=[1000, 5000, 10000],
+                        help="Transactions per relayed block")
+    parser.add_argument("--missing", type=float, default=0.01,
+                        help="Fraction of the block's transactions missing from each pool")
+    args = parser.parse_args()
+
+    results = run(args.nodes, args.degree, args.transactions, args.missing)
+    print(f"{results['nodes']} nodes, {results['missing']:.0%} of the transactions missing from each pool")
+    for block in results['blocks']:
+        print(f"{block['transactions']:,} transactions ({block['block_size']:,} bytes):")
+        for mode in ('full', 'compact'):
+            sent = block[mode]['bytes_sent']
+            print(f"  {mode:>8}: {sent:12,} bytes sent ({sent / block['block_size']:5.2f}x block size), "
+                  f"propagated in {block[mode]['propagation_s'] * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
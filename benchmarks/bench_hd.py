@@ -0,0 +1,81 @@
+"""
+HD wallet: deriving addresses from a seed.
+
+Times --count addresses made each way:
+  - random: a new random key from the cryptography library per address, the
+    way the wallet made keys before it had a seed,
+  - full path: every address derived from the seed down m/44'/0'/0'/0/i,
+    with the cryptography library computing each public key,
+  - cached chain: the node m/44'/0'/0'/0 kept, one child derived at a time
+    with the fixed-base table of bitcoin/utils/secp256k1.py,
+  - batch: derive_range, the public keys of the whole range converted to
+    affine coordinates with a single field inversion,
+and the time to restore a wallet from its seed with the lookahead pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_hd [--count 2000]
+"""
+import argparse
+import os
+import time
+
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from bitcoin.utils.secp256k1 import _generator_table, point_multiply
+from bitcoin.utils.utils import generate_address, generate_private_key, public_key_bytes
+from bitcoin.wallet.hd import ACCOUNT_PATH, EXTERNAL, ExtendedPrivateKey, HDKeyChain, address_of
+
+
+def per_second(count, function):
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def run(count=2000):
+    seed = os.urandom(32)
+    _generator_table()  # built once per process, on first use
+    master = ExtendedPrivateKey.from_seed(seed)
+    chain = master.derive(ACCOUNT_PATH + (EXTERNAL,))
+
+    def random_keys():
+        for _ in range(count):
+            generate_address(generate_private_key()[1])
+
+    def full_path():
+        for i in range(count):
+            key = master.derive(ACCOUNT_PATH + (EXTERNAL, i)).key
+            generate_address(public_key_bytes(ec.derive_private_key(key, ec.SECP256K1())))
+
+    def cached_chain():
+        for i in range(count):
+            address_of(point_multiply(chain.child_keys(i, 1)[0]))
+
+    keychain = HDKeyChain(seed, gap_limit=0)
+    results = {
+        'count': count,
+        'random': per_second(count, random_keys),
+        'full_path': per_second(count, full_path),
+        'cached_chain': per_second(count, cached_chain),
+        'batch': per_second(count, lambda: keychain.derive_range(EXTERNAL, 0, count)),
+    }
+    start = time.perf_counter()
+    HDKeyChain(seed)
+    results['restore_ms'] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HD address derivation benchmark")
+    parser.add_argument("--count", type=int, default=2000, help="Addresses derived each way")
+    args = parser.parse_args()
+
+    results = run(args.count)
+    print(f"{results['count']:,} addresses:")
+    for mode in ('random', 'full_path', 'cached_chain', 'batch'):
+        print(f"{mode:>14}: {results[mode]:8,.0f} addresses/s")
+    print(f"opening a seed with its lookahead pool: {results['restore_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
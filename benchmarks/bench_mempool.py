@@ -0,0 +1,96 @@
+"""
+Transaction pool throughput at 100k+ pending transactions: adding, removing
+the transactions confirmed by a block, and selecting the best-paying ones for
+a block template. The list-based pool it replaced is timed on the same block
+removal for comparison.
+
+Run from the repository root:
+    python -m benchmarks.bench_mempool [--transactions 100000]
+"""
+import argparse
+import random
+import time
+
+from bitcoin.core.transaction import CTransaction, TransactionPool
+from bitcoin.utils.utils import generate_address, generate_private_key, signature_cache
+
+BLOCK_TRANSACTIONS = 2_000
+TEMPLATE_SIZES = (100, 2_000, 10_000)
+
+
+def make_transactions(count):
+    """
+    Transactions from one real key whose signatures are seeded into the signature
+    cache instead of being computed, so the timings cover the pool itself rather
+    than ECDSA (see bench_signatures for that).
+    """
+    rng = random.Random(1)
+    _, public_key = generate_private_key()
+    sender = generate_address(public_key)
+    signature_cache.max_size = max(signature_cache.max_size, count)
+    transactions = []
+    for i in range(count):
+        tx = CTransaction(sender, f"receiver-{i}", 1.0, rng.uniform(0.00001, 0.001), i)
+        tx.signature = f"{i + 1:x}:1"
+        tx.public_key = public_key
+        signature_cache.add(public_key, tx.signature_hash(), tx.signature)
+        transactions.append(tx)
+    return transactions
+
+
+def legacy_remove_block(transactions, txids):
+    """What clearing a block cost with the list-based pool: one list rebuild per txid."""
+    for txid in txids:
+        transactions = [tx for tx in transactions if tx.txid != txid]
+    return transactions
+
+
+def run(count=100_000, legacy_removals=50):
+    transactions = make_transactions(count)
+    pool = TransactionPool()
+
+    start = time.perf_counter()
+    for tx in transactions:
+        pool.add_transaction(tx)
+    add = time.perf_counter() - start
+
+    results = {'transactions': count, 'add_per_s': count / add, 'select_ms': {}}
+    for size in TEMPLATE_SIZES:
+        start = time.perf_counter()
+        pool.select(max_count=size)
+        results['select_ms'][size] = (time.perf_counter() - start) * 1e3
+
+    block_txids = [tx.txid for tx in random.Random(2).sample(transactions, BLOCK_TRANSACTIONS)]
+    start = time.perf_counter()
+    pool.remove_transactions(block_txids)
+    results['remove_block_ms'] = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    legacy_remove_block(transactions, block_txids[:legacy_removals])
+    per_txid = (time.perf_counter() - start) / legacy_removals
+    results['legacy_remove_block_ms'] = per_txid * BLOCK_TRANSACTIONS * 1e3
+
+    capped = TransactionPool(max_size=pool.size // 2)
+    start = time.perf_counter()
+    for tx in transactions:
+        capped.add_transaction(tx)
+    results['add_with_eviction_per_s'] = count / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transaction pool benchmark")
+    parser.add_argument("--transactions", type=int, default=100_000, help="Pending transactions to fill the pool with")
+    args = parser.parse_args()
+
+    results = run(args.transactions)
+    print(f"add:                 {results['add_per_s']:12,.0f} tx/s")
+    print(f"add (evicting):      {results['add_with_eviction_per_s']:12,.0f} tx/s")
+    for size, elapsed in results['select_ms'].items():
+        print(f"select top {size:>6}: {elapsed:12.2f} ms")
+    print(f"remove {BLOCK_TRANSACTIONS}-tx block: {results['remove_block_ms']:10.2f} ms "
+          f"(list-based pool: ~{results['legacy_remove_block_ms']:,.0f} ms, extrapolated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Cost of adding one transaction to a block template: incremental merkle
+append versus recomputing the root from all leaves.
+
+Run from the repository root:
+    python -m benchmarks.bench_merkle
+"""
+import argparse
+import os
+import time
+
+from bitcoin.core.merkle import MerkleTree, merkle_root
+
+TEMPLATE_SIZES = (1_000, 10_000, 100_000)
+ADDED = 100
+
+
+def run(sizes=TEMPLATE_SIZES, added=ADDED):
+    results = {}
+    for size in sizes:
+        leaves = [os.urandom(32) for _ in range(size + added)]
+        tree = MerkleTree(leaves[:size])
+
+        start = time.perf_counter()
+        for leaf in leaves[size:]:
+            tree.append(leaf)
+        incremental = (time.perf_counter() - start) / added
+
+        rebuilds = max(1, added // 10)
+        start = time.perf_counter()
+        for i in range(rebuilds):
+            merkle_root(leaves[:size + i + 1])
+        rebuild = (time.perf_counter() - start) / rebuilds
+
+        assert tree.root == merkle_root(leaves)
+        results[size] = {'incremental_us': incremental * 1e6, 'rebuild_us': rebuild * 1e6}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merkle template refresh benchmark")
+    parser.parse_args()
+    for size, result in run().items():
+        print(f"{size:>7} txs: append {result['incremental_us']:10.1f} us/tx, "
+              f"full rebuild {result['rebuild_us']:12.1f} us/tx")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Metrics and profiler: cost of the instrumentation on the hot paths.
+
+Measures:
+  - the time of each instrumentation call the node makes per message or
+    block: a counter increment, a histogram observation, a timed block, a
+    profiler section while the profiler is stopped and while it runs, and a
+    debug log call while debug logging is off,
+  - the P2P load test of bench_p2p (--peers peers pinging the node), with
+    the profiler stopped and then sampling the event loop, and the latency
+    histogram of the ping messages the node handled.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics [--peers 500] [--calls 200000]
+"""
+import argparse
+import logging
+import time
+
+from benchmarks import bench_p2p
+from bitcoin.network.p2p import MESSAGE_SECONDS
+from bitcoin.utils.metrics import Counter, Histogram, profiler
+
+
+def per_call(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+def micro(calls):
+    counter = Counter('bench_total', "Benchmark counter")
+    histogram = Histogram('bench_seconds', "Benchmark histogram")
+    logger = logging.getLogger('benchmarks.bench_metrics')
+    logger.setLevel(logging.INFO)
+
+    def timed():
+        with histogram.time():
+            pass
+
+    def section():
+        with profiler.section('bench'):
+            pass
+
+    results = {
+        'empty loop': per_call(lambda: None, calls),
+        'counter inc': per_call(counter.inc, calls),
+        'histogram observe': per_call(lambda: histogram.observe(0.001), calls),
+        'histogram time()': per_call(timed, calls),
+        'section, profiler stopped': per_call(section, calls),
+        'debug log, level INFO': per_call(lambda: logger.debug("message %s", 1), calls),
+    }
+    profiler.start()
+    try:
+        results['section, profiler running'] = per_call(section, calls)
+    finally:
+        profiler.stop()
+        profiler.reset()
+    return {name: seconds * 1e9 for name, seconds in results.items()}
+
+
+def load(peers, pings):
+    ping = MESSAGE_SECONDS.labels(command='ping')
+    results = {}
+    for mode in ('stopped', 'running'):
+        if mode == 'running':
+            profiler.start()
+        count, total = ping.count, ping.sum
+        try:
+            run = bench_p2p.run(peers=peers, messages=5, pings=pings)
+        finally:
+            profiler.stop()
+        handled = ping.count - count
+        results[mode] = {
+            'ping_round_trips_per_s': run['ping_round_trips_per_s'],
+            'ping_mean_us': (ping.sum - total) / max(handled, 1) * 1e6,
+            'samples': profiler.samples,
+        }
+        results[mode]['top'] = profiler.top(5)
+        profiler.reset()
+    return results
+
+
+def run(peers=500, pings=20, calls=200_000):
+    return {'micro_ns': micro(calls), 'load': load(peers, pings), 'peers': peers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics and profiler overhead")
+    parser.add_argument("--peers", type=int, default=500, help="Peers of the P2P load test")
+    parser.add_argument("--pings", type=int, default=20, help="Pings sent by every peer")
+    parser.add_argument("--calls", type=int, default=200_000, help="Calls timed per instrumentation call")
+    args = parser.parse_args()
+
+    results = run(args.peers, args.pings, args.calls)
+    for name, ns in results['micro_ns'].items():
+        print(f"{name:>26}: {ns:7.0f} ns")
+    for mode, result in results['load'].items():
+        print(f"profiler {mode:>7}, {results['peers']} peers: {result['ping_round_trips_per_s']:9,.0f} round trips/s, "
+              f"ping handled in {result['ping_mean_us']:5.1f} us on average, {result['samples']} samples")
+        for section, function, count in result['top']:
+            print(f"{'':10}{count:6} samples  {section}  {function}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Proof-of-work hash rate with 1, 2, 4 and N mining processes.
+
+Each run searches an unreachable target for a fixed duration and counts
+the hashes done. The single-process figure is the in-thread search used by
+Miner with workers=1.
+
+Run from the repository root:
+    python -m benchmarks.bench_mining [--duration 5]
+"""
+import argparse
+import os
+import time
+
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.consensus import bits_to_target
+from bitcoin.core.mining import MiningPool, search_nonces
+from bitcoin.core.transaction import CTransaction
+
+# Compact target 1: only a hash of 255 zero bits and a one would do.
+UNREACHABLE_BITS = 0x03000001
+
+
+def sample_block(transactions=100):
+    txs = [CTransaction(f"sender-{i}", f"receiver-{i}", 1.0, 0.0001, i) for i in range(transactions)]
+    return CBlock(1, "0" * 64, txs, int(time.time()), 0, UNREACHABLE_BITS)
+
+
+def deadline(duration):
+    end = time.perf_counter() + duration
+    return lambda: time.perf_counter() >= end
+
+
+def bench_in_thread(block, duration):
+    hashes = 0
+
+    def count(batch):
+        nonlocal hashes
+        hashes += batch
+
+    prefix = block.header_prefix()
+    start = time.perf_counter()
+    search_nonces(prefix, bits_to_target(block.bits), 0, 1, deadline(duration), count)
+    return hashes / (time.perf_counter() - start)
+
+
+def bench_pool(block, workers, duration):
+    pool = MiningPool(workers)
+    try:
+        prefix = block.header_prefix()
+        # Let the workers finish starting up before timing.
+        pool.search(prefix, bits_to_target(block.bits), deadline(1.0))
+        before = pool.hashes
+        start = time.perf_counter()
+        pool.search(prefix, bits_to_target(block.bits), deadline(duration))
+        elapsed = time.perf_counter() - start
+        return (pool.hashes - before) / elapsed
+    finally:
+        pool.close()
+
+
+def run(duration=5.0, worker_counts=None):
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    block = sample_block()
+    results = {'in_thread_hashes_per_s': bench_in_thread(block, duration), 'pool_hashes_per_s': {}}
+    for workers in worker_counts:
+        results['pool_hashes_per_s'][workers] = bench_pool(block, workers, duration)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mining hash rate benchmark")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to hash per configuration")
+    parser.add_argument("--workers", type=int, nargs="*", help="Worker counts to try (default: 1 2 4 N)")
+    args = parser.parse_args()
+
+    results = run(args.duration, args.workers)
+    print(f"in-thread:   {results['in_thread_hashes_per_s']:12,.0f} H/s")
+    for workers, rate in results['pool_hashes_per_s'].items():
+        print(f"{workers:3d} workers: {rate:12,.0f} H/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Loopback load test of the asyncio P2PNode.
+
+Opens thousands of client connections to one node in the same process, then
+measures:
+  - how long it takes until the node has accepted every peer,
+  - broadcast throughput: messages fanned out to every peer until all of them
+    have received every message,
+  - request/response throughput: every peer sending pings concurrently and
+    waiting for the pongs.
+
+Run from the repository root:
+    python -m benchmarks.bench_p2p [--peers 2000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import resource
+import tempfile
+import time
+
+from bitcoin.core.blockchain import Blockchain
+from bitcoin.network.p2p import P2PNode
+from bitcoin.network.protocol import encode_message, read_message
+
+
+def raise_fd_limit(peers):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * peers + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    return min(wanted, hard) >= wanted
+
+
+async def wait_until(predicate, timeout=60):
+    end = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > end:
+            raise TimeoutError("load test timed out")
+        await asyncio.sleep(0.01)
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.received = 0
+        self.task = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                await read_message(self.reader)
+                self.received += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+async def load_test(node, peers, messages, payload_size, pings):
+    results = {'peers': peers}
+    connect_limit = asyncio.Semaphore(256)
+
+    async def connect():
+        async with connect_limit:
+            return Client(*await asyncio.open_connection('127.0.0.1', node.port))
+
+    start = time.perf_counter()
+    clients = await asyncio.gather(*(connect() for _ in range(peers)))
+    await wait_until(lambda: len(node.peers) >= peers)
+    results['connect_s'] = time.perf_counter() - start
+
+    payload = os.urandom(payload_size)
+    start = time.perf_counter()
+    for _ in range(messages):
+        node.broadcast('block', payload)
+    await wait_until(lambda: all(client.received >= messages for client in clients))
+    elapsed = time.perf_counter() - start
+    results['broadcast_deliveries_per_s'] = messages * peers / elapsed
+    results['broadcast_mb_per_s'] = messages * peers * payload_size / elapsed / 1e6
+
+    ping = encode_message('ping', b'12345678')
+    baseline = [client.received for client in clients]
+    start = time.perf_counter()
+    for client in clients:
+        client.writer.write(ping * pings)
+    await wait_until(lambda: all(c.received - b >= pings for c, b in zip(clients, baseline)))
+    results['ping_round_trips_per_s'] = peers * pings / (time.perf_counter() - start)
+
+    for client in clients:
+        client.writer.close()
+        client.task.cancel()
+    return results
+
+
+def run(peers=2_000, messages=20, payload_size=1_000, pings=10):
+    if not raise_fd_limit(peers):
+        raise RuntimeError(f"the open file limit is too low for {peers} peers")
+    with tempfile.TemporaryDirectory() as tmp:
+        blockchain = Blockchain(data_dir=os.path.join(tmp, 'blocks'))
+        node = P2PNode(host='127.0.0.1', port=0, bootstrap_ip=None, blockchain=blockchain)
+        # The node logs every connection; keep thousands of those lines out of the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            node.start_node(fetch_public_ip=False)
+            try:
+                return asyncio.run(load_test(node, peers, messages, payload_size, pings))
+            finally:
+                node.stop_node()
+                blockchain.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="P2P loopback load test")
+    parser.add_argument("--peers", type=int, default=2_000, help="Concurrent peer connections")
+    parser.add_argument("--messages", type=int, default=20, help="Messages broadcast to every peer")
+    parser.add_argument("--payload", type=int, default=1_000, help="Broadcast payload size in bytes")
+    parser.add_argument("--pings", type=int, default=10, help="Pings sent by every peer")
+    args = parser.parse_args()
+
+    results = run(args.peers, args.messages, args.payload, args.pings)
+    print(f"{results['peers']} peers connected in {results['connect_s']:.2f} s")
+    print(f"broadcast: {results['broadcast_deliveries_per_s']:,.0f} deliveries/s "
+          f"({results['broadcast_mb_per_s']:.1f} MB/s)")
+    print(f"ping/pong: {results['ping_round_trips_per_s']:,.0f} round trips/s")
+
+
+if __name__ == "__main__":
+    main()
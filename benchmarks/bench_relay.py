@@ -0,0 +1,138 @@
+"""
+Bandwidth of block relay across a small mesh of nodes on loopback.
+
+Starts several P2PNodes in one process, connects them in a random mesh, mines
+one block with signed transactions at the first node and waits until every
+node has it. Bytes sent by all nodes are compared between:
+  - inv/getdata relay (P2PNode): hashes are announced on every connection,
+    the body is fetched once per node,
+  - flooding: every node pushes the full block to every neighbor that did
+    not send it, as the node did before inventory relay.
+Both relay full blocks; compact blocks are measured by bench_compact.
+
+Run from the repository root:
+    python -m benchmarks.bench_relay [--nodes 8] [--degree 4] [--transactions 200]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import bits_to_target
+from bitcoin.core.merkle import MerkleTree, transaction_leaves
+from bitcoin.core.mining import search_nonces
+from bitcoin.core.transaction import COINBASE, CTransaction
+from bitcoin.network.p2p import P2PNode
+from bitcoin.utils.utils import generate_address, generate_private_key
+
+
+class FloodNode(P2PNode):
+    """Pushes whole objects to every neighbor instead of announcing them."""
+    async def announce(self, kind, key, command, payload, compact=None):
+        self.seen_inventory.add(key)
+        for peer in list(self.peers):
+            if key not in peer.known_inventory:
+                peer.known_inventory.add(key)
+                await peer.send(command, payload)
+
+
+def signed_block(prev_hash, transactions, bits):
+    private_key, public_key = generate_private_key()
+    sender = generate_address(public_key)
+    txs = [CTransaction(COINBASE, sender, 50, 0, int(time.time()))]
+    for i in range(transactions):
+        tx = CTransaction(sender, f"receiver-{i}", 1.0, 0.0001, i)
+        tx.sign_transaction(private_key)
+        txs.append(tx)
+    block = CBlock(1, prev_hash, txs, int(time.time()), 0, bits,
+                   merkle_root=MerkleTree(transaction_leaves(txs)).root)
+    block.nonce = search_nonces(block.header_prefix(), bits_to_target(bits), 0, 1, lambda: False)
+    block.hash = block.calculate_hash()
+    return block
+
+
+def mesh(nodes, degree, seed=1):
+    """A ring, so the mesh is connected, plus random extra links up to about degree per node."""
+    rng = random.Random(seed)
+    edges = {(i, (i + 1) % nodes) for i in range(nodes)} if nodes > 1 else set()
+    while len(edges) < min(nodes * degree // 2, nodes * (nodes - 1) // 2):
+        a, b = rng.sample(range(nodes), 2)
+        if (b, a) not in edges:
+            edges.add((a, b))
+    return sorted(edges)
+
+
+def wait_until(predicate, timeout=60):
+    end = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > end:
+            raise TimeoutError("relay simulation timed out")
+        time.sleep(0.01)
+
+
+def bytes_sent(nodes):
+    return sum(peer.bytes_sent for node in nodes for peer in list(node.peers))
+
+
+def simulate(node_class, block, nodes, degree, tmp):
+    chains = [Blockchain(data_dir=os.path.join(tmp, f"{node_class.__name__}-{i}")) for i in range(nodes)]
+    network = [node_class(host='127.0.0.1', port=0, bootstrap_ip=None, blockchain=chain, compact_blocks=False)
+               for chain in chains]
+    try:
+        for node in network:
+            node.start_node(fetch_public_ip=False)
+        edges = mesh(nodes, degree)
+        for a, b in edges:
+            network[a].connect_to_peer('127.0.0.1', network[b].port).result()
+        wait_until(lambda: sum(len(node.peers) for node in network) == 2 * len(edges))
+
+        before = bytes_sent(network)
+        start = time.perf_counter()
+        chains[0].add_block(block)
+        wait_until(lambda: all(chain.get_last_block().hash == block.hash for chain in chains))
+        elapsed = time.perf_counter() - start
+        # Let trailing announcements drain before counting.
+        time.sleep(0.2)
+        return {'bytes_sent': bytes_sent(network) - before, 'propagation_s': elapsed, 'links': len(edges)}
+    finally:
+        for node in network:
+            node.stop_node()
+        for chain in chains:
+            chain.close()
+
+
+def run(nodes=8, degree=4, transactions=200):
+    with tempfile.TemporaryDirectory() as tmp:
+        genesis = Blockchain(data_dir=os.path.join(tmp, 'genesis'))
+        block = signed_block(genesis.get_last_block().hash, transactions, genesis.next_bits(genesis.tip))
+        genesis.close()
+        results = {'nodes': nodes, 'block_size': len(block.serialize())}
+        # Every node logs its connections; keep those lines out of the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['inventory'] = simulate(P2PNode, block, nodes, degree, tmp)
+            results['flood'] = simulate(FloodNode, block, nodes, degree, tmp)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block relay bandwidth simulation")
+    parser.add_argument("--nodes", type=int, default=8, help="Nodes in the mesh")
+    parser.add_argument("--degree", type=int, default=4, help="Average connections per node")
+    parser.add_argument("--transactions", type=int, default=200, help="Signed transactions in the relayed block")
+    args = parser.parse_args()
+
+    results = run(args.nodes, args.degree, args.transactions)
+    size = results['block_size']
+    print(f"block of {size:,} bytes relayed to {results['nodes']} nodes over {results['flood']['links']} links")
+    for mode in ('flood', 'inventory'):
+        sent = results[mode]['bytes_sent']
+        print(f"{mode:>9}: {sent:12,} bytes sent ({sent / size:5.1f}x block size), "
+              f"propagated in {results[mode]['propagation_s'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
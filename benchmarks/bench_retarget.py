@@ -0,0 +1,74 @@
+"""
+Difficulty retargeting: simulated mining at changing hash rates.
+
+Mines a chain on a simulated clock with the consensus rules of
+bitcoin/core/consensus.py (MAINNET unless --block-time or --interval say
+otherwise). The time to find each block is drawn from an exponential
+distribution with mean hashes per block / hash rate, as for a real Poisson
+mining process, and the next target comes from next_bits. The hash rate
+starts at --hashrate and is multiplied by each factor of --schedule in turn,
+for --periods retarget periods each (more mining processes joining, then
+leaving). For every period, prints the hash rate, the target's hashes per
+block and the mean block interval, which should return to the wanted block
+time within a period or two of each change.
+
+Run from the repository root:
+    python -m benchmarks.bench_retarget [--hashrate 20000] [--schedule 1,8,8,0.5] [--periods 3]
+"""
+import argparse
+import random
+
+from bitcoin.core.consensus import MAINNET, block_work, next_bits
+
+
+def run(hashrate=20_000, schedule=(1, 8, 8, 0.5), periods=3, params=MAINNET, seed=1):
+    rng = random.Random(seed)
+    interval = params.retarget_interval
+    bits = [params.genesis_bits]
+    timestamps = [0]
+    clock = 0.0
+    height = 1
+    results = []
+    for factor in schedule:
+        rate = hashrate * factor
+        for _ in range(periods):
+            # One period: up to the next height where the target may change.
+            end = (height // interval + 1) * interval
+            start, start_clock = height, clock
+            for height in range(start, end):
+                required = next_bits(params, height, bits[-1], timestamps[-1], timestamps.__getitem__)
+                clock += rng.expovariate(rate / block_work(required))
+                bits.append(required)
+                timestamps.append(int(clock))
+            results.append({
+                'hashrate': rate,
+                'hashes_per_block': block_work(bits[-1]),
+                'blocks': end - start,
+                'mean_interval': (clock - start_clock) / (end - start),
+            })
+            height = end
+    return {'block_time': params.block_time, 'retarget_interval': interval, 'periods': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Difficulty retargeting simulation")
+    parser.add_argument("--hashrate", type=float, default=20_000, help="Hashes per second at the start")
+    parser.add_argument("--schedule", type=str, default="1,8,8,0.5",
+                        help="Comma-separated hash rate factors, applied one after the other")
+    parser.add_argument("--periods", type=int, default=3, help="Retarget periods mined at each factor")
+    parser.add_argument("--block-time", type=int, default=MAINNET.block_time, help="Seconds wanted between blocks")
+    parser.add_argument("--interval", type=int, default=MAINNET.retarget_interval, help="Blocks between retargets")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the simulated mining")
+    args = parser.parse_args()
+
+    params = MAINNET._replace(block_time=args.block_time, retarget_interval=args.interval)
+    schedule = [float(factor) for factor in args.schedule.split(',')]
+    results = run(args.hashrate, schedule, args.periods, params, args.seed)
+    print(f"wanted: one block every {results['block_time']} s, retarget every {results['retarget_interval']} blocks")
+    for i, period in enumerate(results['periods']):
+        print(f"period {i:2}: {period['hashrate']:10,.0f} H/s, {period['hashes_per_block']:12,} hashes/block, "
+              f"mean interval {period['mean_interval']:6.2f} s over {period['blocks']} blocks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Binary block encoding versus pickle: encode/decode throughput and bytes per
+transaction for a full block.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialize [--transactions 2000]
+"""
+import argparse
+import pickle
+import time
+
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.consensus import MAINNET
+from bitcoin.core.transaction import COINBASE, CTransaction
+from bitcoin.utils.utils import generate_address, generate_private_key
+
+ROUNDS = 20
+
+
+def sample_block(count):
+    private_key, public_key = generate_private_key()
+    sender = generate_address(public_key)
+    transactions = [CTransaction(COINBASE, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", 50, 0, 0)]
+    for i in range(count - 1):
+        tx = CTransaction(sender, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", 0.5 + i, 0.0001, i)
+        tx.sign_transaction(private_key)
+        transactions.append(tx)
+    return CBlock(1, "00" * 32, transactions, 1234567890, 0, MAINNET.genesis_bits)
+
+
+def measure(encode, decode, count):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        data = encode()
+    encode_time = (time.perf_counter() - start) / ROUNDS
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        decode(data)
+    decode_time = (time.perf_counter() - start) / ROUNDS
+    megabytes = len(data) / 1e6
+    return {
+        'bytes_per_tx': len(data) / count,
+        'encode_mb_per_s': megabytes / encode_time,
+        'decode_mb_per_s': megabytes / decode_time,
+        'decode_tx_per_s': count / decode_time,
+    }
+
+
+def run(count=2_000):
+    block = sample_block(count)
+
+    def encode_binary():
+        # Drop the cached unsigned encodings so every round really encodes.
+        for tx in block.transactions:
+            object.__setattr__(tx, '_unsigned', None)
+        return block.serialize()
+
+    return {
+        'binary': measure(encode_binary, lambda data: CBlock.deserialize(data), count),
+        'pickle': measure(lambda: pickle.dumps(block), pickle.loads, count),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block serialization benchmark")
+    parser.add_argument("--transactions", type=int, default=2_000, help="Transactions in the sample block")
+    args = parser.parse_args()
+
+    for name, result in run(args.transactions).items():
+        print(f"{name:6}: {result['bytes_per_tx']:6.1f} B/tx, encode {result['encode_mb_per_s']:7.1f} MB/s, "
+              f"decode {result['decode_mb_per_s']:7.1f} MB/s ({result['decode_tx_per_s']:,.0f} tx/s)")
+
+
+if __name__ == "__main__":
+    main()
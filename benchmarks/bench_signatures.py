@@ -0,0 +1,75 @@
+"""
+Signature throughput: signing with sign_data, verification one
+verify_signature call at a time, SignatureVerifier batches across 1, 2, 4
+and N processes, and re-verifying a batch whose signatures are already in
+the signature cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_signatures [--signatures 2000]
+"""
+import argparse
+import os
+import time
+
+from bitcoin.utils.utils import (
+    SignatureCache, SignatureVerifier, generate_private_key, load_private_key, public_key_bytes,
+    sign_data, verify_signature,
+)
+
+
+def make_items(count):
+    private_key = load_private_key(generate_private_key()[0])
+    public_key = public_key_bytes(private_key)
+    items = []
+    for i in range(count):
+        message = f"transaction-{i}"
+        items.append((public_key, message, sign_data(private_key, message)))
+    return items
+
+
+def rate(count, func):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def run(count=2_000, worker_counts=None):
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    start = time.perf_counter()
+    items = make_items(count)
+
+    results = {
+        'sign_per_s': count / (time.perf_counter() - start),
+        'sequential_per_s': rate(count, lambda: [verify_signature(*item) for item in items]),
+        'batch_per_s': {},
+    }
+    for workers in worker_counts:
+        verifier = SignatureVerifier(workers=workers, cache=SignatureCache(max_size=count))
+        try:
+            # Start the worker processes before timing.
+            verifier.verify_batch(items[:verifier.chunk_size * workers])
+            verifier.cache = SignatureCache(max_size=count)
+            results['batch_per_s'][workers] = rate(count, lambda: verifier.verify_batch(items))
+            results['cached_per_s'] = rate(count, lambda: verifier.verify_batch(items))
+        finally:
+            verifier.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signature verification benchmark")
+    parser.add_argument("--signatures", type=int, default=2_000, help="Signatures per batch")
+    parser.add_argument("--workers", type=int, nargs="*", help="Worker counts to try (default: 1 2 4 N)")
+    args = parser.parse_args()
+
+    results = run(args.signatures, args.workers)
+    print(f"sign:          {results['sign_per_s']:12,.0f} sig/s")
+    print(f"one at a time: {results['sequential_per_s']:12,.0f} sig/s")
+    for workers, value in results['batch_per_s'].items():
+        print(f"{workers:3d} workers:   {value:12,.0f} sig/s")
+    print(f"cached:        {results['cached_per_s']:12,.0f} sig/s")
+
+
+if __name__ == "__main__":
+    main()
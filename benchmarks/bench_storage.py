@@ -0,0 +1,134 @@
+"""
+Block append latency and chain startup cost of the append-only block store.
+
+Fills a fresh chain up to the largest checkpoint and times a window of
+Blockchain.add_block calls at every checkpoint height. With the block store
+the per-block cost stays flat; the legacy whole-chain pickle rewrite is
+timed at small heights for comparison.
+
+The filled chain is then reopened to time startup and to measure the memory
+held after walking every block, which is bounded by the block cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_storage [--max-height 1000000]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import REGTEST, bits_to_target
+from bitcoin.core.mining import search_nonces
+from bitcoin.core.transaction import COINBASE, CTransaction
+
+CHECKPOINTS = (1_000, 10_000, 100_000, 1_000_000)
+LEGACY_CHECKPOINTS = (1_000, 5_000)
+WINDOW = 1_000
+LEGACY_WINDOW = 20
+
+
+def next_block(last_block):
+    block = CBlock(
+        index=last_block.index + 1,
+        prev_hash=last_block.hash,
+        transactions=[CTransaction(COINBASE, "miner", 50, 0, last_block.index + 1)],
+        timestamp=last_block.index + 1,
+        nonce=0,
+        bits=REGTEST.genesis_bits,
+    )
+    block.nonce = search_nonces(block.header_prefix(), bits_to_target(block.bits), 0, 1, lambda: False)
+    block.hash = block.calculate_hash()
+    return block
+
+
+def open_chain(directory, **kwargs):
+    return Blockchain(data_dir=os.path.join(directory, 'blocks'), params=REGTEST, **kwargs)
+
+
+def bench_block_store(directory, max_height, window=WINDOW):
+    results = {}
+    blockchain = open_chain(directory)
+    for checkpoint in CHECKPOINTS:
+        if checkpoint > max_height:
+            break
+        while len(blockchain.chain) < checkpoint - window:
+            blockchain.add_block(next_block(blockchain.get_last_block()))
+        blocks = []
+        last_block = blockchain.get_last_block()
+        for _ in range(window):
+            last_block = next_block(last_block)
+            blocks.append(last_block)
+        start = time.perf_counter()
+        for block in blocks:
+            blockchain.add_block(block)
+        elapsed = time.perf_counter() - start
+        results[checkpoint] = elapsed / window * 1e6
+    blockchain.close()
+    return results
+
+
+def bench_startup(directory, cache_size=1024):
+    start = time.perf_counter()
+    blockchain = open_chain(directory, cache_size=cache_size)
+    blockchain.get_last_block()
+    startup = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in blockchain.chain:
+        pass
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    height = len(blockchain.chain)
+    blockchain.close()
+    return {'height': height, 'startup_ms': startup * 1e3, 'memory_after_full_scan_kb': memory / 1024}
+
+
+def bench_legacy_rewrite(window=LEGACY_WINDOW):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'blockchain.dat')
+        chain = [CBlock(0, "0" * 64, [], 0, 0, REGTEST.genesis_bits)]
+        for checkpoint in LEGACY_CHECKPOINTS:
+            while len(chain) < checkpoint - window:
+                chain.append(next_block(chain[-1]))
+            start = time.perf_counter()
+            for _ in range(window):
+                chain.append(next_block(chain[-1]))
+                with open(path, 'wb') as f:
+                    pickle.dump(chain, f)
+            elapsed = time.perf_counter() - start
+            results[checkpoint] = elapsed / window * 1e6
+    return results
+
+
+def run(max_height=CHECKPOINTS[-1], legacy=True):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results['block_store_append_us'] = bench_block_store(tmp, max_height)
+        results['startup'] = bench_startup(tmp)
+    if legacy:
+        results['legacy_rewrite_append_us'] = bench_legacy_rewrite()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block store append latency and startup benchmark")
+    parser.add_argument("--max-height", type=int, default=CHECKPOINTS[-1], help="Largest checkpoint height to fill to")
+    parser.add_argument("--no-legacy", action="store_true", help="Skip the whole-chain pickle rewrite comparison")
+    args = parser.parse_args()
+
+    results = run(args.max_height, legacy=not args.no_legacy)
+    for height, latency in results['block_store_append_us'].items():
+        print(f"block store   height {height:>9,}: {latency:8.1f} us/block")
+    startup = results['startup']
+    print(f"startup at height {startup['height']:,}: {startup['startup_ms']:.1f} ms, "
+          f"{startup['memory_after_full_scan_kb']:.0f} KiB held after reading every block")
+    for height, latency in results.get('legacy_rewrite_append_us', {}).items():
+        print(f"legacy pickle height {height:>9,}: {latency:8.1f} us/block")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Work server: aggregate hash rate of worker processes and job switch latency.
+
+Starts a WorkServer on loopback for a fresh chain whose blocks take 2^20
+hashes on average (no retargeting), then for each count of --workers runs
+that many StratumWorker processes for --duration seconds. For every count it
+reports:
+  - hash rate: the hashes the workers counted, and the hashes their
+    accepted shares stand for (what the server can check),
+  - job switches: for every block found, the time from the block reaching
+    the chain to each worker hashing on the new tip's job.
+With one core per worker the hash rate grows linearly with the workers.
+
+Run from the repository root:
+    python -m benchmarks.bench_stratum [--workers 1 2 4] [--duration 5]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from bitcoin.core.blockchain import Blockchain
+from bitcoin.core.consensus import MAINNET, target_to_bits
+from bitcoin.core.transaction import TransactionPool
+from bitcoin.network.stratum import SHARE_BITS, StratumWorker, WorkServer
+
+PARAMS = MAINNET._replace(genesis_bits=target_to_bits(1 << 236), retargeting=False)
+
+
+def worker_process(port, name, duration, ready, go, results):
+    switches = []
+    worker = StratumWorker('127.0.0.1', port, name, on_job=lambda job: switches.append((job.prev_hash, time.time())))
+    worker.connect()
+    ready.release()
+    go.wait()
+    start = time.perf_counter()
+    worker.run(duration)
+    elapsed = time.perf_counter() - start
+    worker.close()
+    results.put({'hashes': worker.hashes, 'seconds': elapsed, 'accepted': worker.accepted,
+                 'rejected': worker.rejected, 'switches': switches})
+
+
+def measure(server, tip_times, workers, duration):
+    ctx = multiprocessing.get_context("spawn")
+    ready, go, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    processes = [ctx.Process(target=worker_process, args=(server.port, f"worker-{i}", duration, ready, go, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    # Start hashing together, once every process has connected.
+    for _ in processes:
+        ready.acquire()
+    first_block = len(tip_times)
+    go.set()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    share_work = (1 << 256) // (server.share_target + 1)
+    # Only tips found during this run: the workers start on an older tip without switching to it.
+    found = set(list(tip_times)[first_block:])
+    latencies = [at - tip_times[prev_hash] for report in reports for prev_hash, at in report['switches']
+                 if prev_hash in found]
+    return {
+        'workers': workers,
+        'hashrate': sum(r['hashes'] / r['seconds'] for r in reports),
+        'share_hashrate': sum(r['accepted'] * share_work / r['seconds'] for r in reports),
+        'accepted': sum(r['accepted'] for r in reports),
+        'rejected': sum(r['rejected'] for r in reports),
+        'blocks': len(found),
+        'switch_ms': [latency * 1000 for latency in latencies],
+    }
+
+
+def run(workers=(1, 2, 4), duration=5):
+    with tempfile.TemporaryDirectory() as tmp:
+        chain = Blockchain(data_dir=os.path.join(tmp, 'blocks'), params=PARAMS)
+        tip_times = {chain.get_last_block().hash: time.time()}
+        # Subscribed before the server, so the time is taken before the new job is made.
+        chain.subscribe(lambda block: tip_times.setdefault(block.hash, time.time()))
+        server = WorkServer(chain, TransactionPool(), "bench-miner", port=0, share_bits=SHARE_BITS)
+        results = {'block_work': 1 << 20, 'share_work': 1 << 16, 'cpus': os.cpu_count(), 'runs': []}
+        # The server and the chain log every block; keep those lines out of the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.start()
+            try:
+                for count in workers:
+                    results['runs'].append(measure(server, tip_times, count, duration))
+            finally:
+                server.stop()
+                chain.close()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Work server benchmark")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4], help="Worker process counts to run")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds the workers hash at each count")
+    args = parser.parse_args()
+
+    results = run(args.workers, args.duration)
+    print(f"{results['cpus']} CPUs, blocks of {results['block_work']:,} hashes, shares of {results['share_work']:,}")
+    base = results['runs'][0]['hashrate'] / results['runs'][0]['workers']
+    for r in results['runs']:
+        switch = r['switch_ms']
+        latency = (f"job switch median {statistics.median(switch):5.1f} ms, max {max(switch):5.1f} ms"
+                   if switch else "no block found")
+        print(f"{r['workers']:3} workers: {r['hashrate']:11,.0f} H/s ({r['hashrate'] / base:4.1f}x one worker), "
+              f"shares {r['share_hashrate']:11,.0f} H/s, {r['accepted']} accepted, {r['rejected']} rejected, "
+              f"{r['blocks']} blocks, {latency}")
+
+
+if __name__ == "__main__":
+    main()
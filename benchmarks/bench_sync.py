@@ -0,0 +1,102 @@
+"""
+Initial block download time: headers-first parallel download against a naive
+sequential fetch.
+
+Builds a regtest chain of coinbase-only blocks, starts several local
+stand-in peers serving copies of it, then syncs a fresh node from them:
+  - parallel: headers first, then bodies from every peer through the sliding
+    download window (InitialBlockDownload defaults),
+  - sequential: the same header sync, then one block at a time from a single
+    peer, each request waiting for the previous block.
+
+Run from the repository root:
+    python -m benchmarks.bench_sync [--blocks 50000] [--peers 4]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import REGTEST, bits_to_target
+from bitcoin.core.mining import search_nonces
+from bitcoin.core.transaction import COINBASE, CTransaction
+from bitcoin.network.p2p import P2PNode
+
+
+def build_chain(directory, blocks):
+    blockchain = Blockchain(data_dir=directory, params=REGTEST)
+    tip = blockchain.get_last_block()
+    for height in range(1, blocks + 1):
+        coinbase = CTransaction(COINBASE, "miner", 50, 0, height)
+        block = CBlock(height, tip.hash, [coinbase], height, 0, REGTEST.genesis_bits)
+        block.nonce = search_nonces(block.header_prefix(), bits_to_target(block.bits), 0, 1, lambda: False)
+        block.hash = block.calculate_hash()
+        blockchain.add_block(block)
+        tip = block
+    blockchain.close()
+
+
+def sync(source, peers, tmp, name, **options):
+    chains = []
+    nodes = []
+    try:
+        for i in range(peers):
+            directory = os.path.join(tmp, f"{name}-peer-{i}")
+            shutil.copytree(source, directory)
+            chains.append(Blockchain(data_dir=directory, params=REGTEST))
+            nodes.append(P2PNode(host='127.0.0.1', port=0, bootstrap_ip=None, blockchain=chains[-1]))
+            nodes[-1].start_node(fetch_public_ip=False)
+
+        fresh = Blockchain(data_dir=os.path.join(tmp, name), params=REGTEST)
+        chains.append(fresh)
+        node = P2PNode(host='127.0.0.1', port=0, bootstrap_ip=None, blockchain=fresh)
+        nodes.append(node)
+        node.start_node(fetch_public_ip=False)
+        for peer in nodes[:-1]:
+            node.connect_to_peer('127.0.0.1', peer.port).result()
+
+        start = time.perf_counter()
+        connected = node.start_sync(**options).result()
+        elapsed = time.perf_counter() - start
+        assert fresh.get_last_block().hash == chains[0].get_last_block().hash
+        return {'blocks': connected, 'seconds': elapsed, 'blocks_per_s': connected / elapsed}
+    finally:
+        for node in nodes:
+            node.stop_node()
+        for chain in chains:
+            chain.close()
+
+
+def run(blocks=50_000, peers=4):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source')
+        start = time.perf_counter()
+        build_chain(source, blocks)
+        results = {'chain_blocks': blocks, 'peers': peers, 'build_s': time.perf_counter() - start}
+        # Every node logs its connections; keep those lines out of the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['parallel'] = sync(source, peers, tmp, 'parallel')
+            results['sequential'] = sync(source, 1, tmp, 'sequential', window=1, blocks_per_peer=1, max_peers=1)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Initial block download benchmark")
+    parser.add_argument("--blocks", type=int, default=50_000, help="Length of the chain to sync")
+    parser.add_argument("--peers", type=int, default=4, help="Stand-in peers serving the chain")
+    args = parser.parse_args()
+
+    results = run(args.blocks, args.peers)
+    print(f"built a {results['chain_blocks']:,}-block chain in {results['build_s']:.1f} s")
+    for mode in ('sequential', 'parallel'):
+        r = results[mode]
+        print(f"{mode:>10}: {r['blocks']:,} blocks in {r['seconds']:.1f} s ({r['blocks_per_s']:,.0f} blocks/s)")
+    print(f"speedup: {results['sequential']['seconds'] / results['parallel']['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
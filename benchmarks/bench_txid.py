@@ -0,0 +1,40 @@
+"""
+Bulk txid computation throughput: serializing and hashing fresh
+transactions, and reading the cached id back afterwards.
+
+Run from the repository root:
+    python -m benchmarks.bench_txid [--transactions 200000]
+"""
+import argparse
+import time
+
+from bitcoin.core.transaction import CTransaction
+
+
+def run(count=200_000):
+    transactions = [CTransaction(f"sender-{i}", f"receiver-{i}", 1.5, 0.0001, i) for i in range(count)]
+
+    start = time.perf_counter()
+    txids = [tx.txid for tx in transactions]
+    compute = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cached = [tx.txid for tx in transactions]
+    lookup = time.perf_counter() - start
+
+    assert txids == cached
+    return {'transactions': count, 'compute_per_s': count / compute, 'cached_per_s': count / lookup}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Txid computation benchmark")
+    parser.add_argument("--transactions", type=int, default=200_000, help="Transactions to compute ids for")
+    args = parser.parse_args()
+
+    results = run(args.transactions)
+    print(f"compute txid: {results['compute_per_s']:12,.0f} tx/s")
+    print(f"cached txid:  {results['cached_per_s']:12,.0f} tx/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+UTXO set throughput: connecting blocks against a set of millions of coins.
+
+Grows a UTXO set to --coins entries with blocks of transactions that each
+spend one coin and create two. Then, for several cache sizes, connects blocks
+of transactions spending two coins and creating two, which keeps the set the
+same size, and reports blocks and transactions connected per second, cache hit
+rate and how many coins were read from SQLite. The cache starts out holding
+the newest coins, as in a node that has been running. Each spend picks a coin
+either uniformly at random (every coin equally likely: the worst case for the
+cache) or mostly among the newest coins, as real spending does.
+
+Signatures are not part of the UTXO set and are left out: transactions are
+connected unsigned.
+
+Run from the repository root:
+    python -m benchmarks.bench_utxo [--coins 2000000] [--blocks 20]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.transaction import COIN, CTransaction
+from bitcoin.core.utxo import UTXOSet
+
+ADDRESS = "bench"
+TRANSACTIONS_PER_BLOCK = 2000
+# Share of spends taken from the newest tenth of the coins in the "recent" workload.
+RECENT_SHARE = 0.8
+
+
+def spend(coins, timestamp):
+    """A transaction paying coins to ADDRESS in two halves (one output if they are worth a single satoshi)."""
+    value = sum(coin[2] for coin in coins)
+    half = value // 2 or value
+    tx = CTransaction(ADDRESS, ADDRESS, half / COIN, 0, timestamp, inputs=[coin[:2] for coin in coins],
+                      change=(value - half) / COIN)
+    outputs = [(tx.txid, 0, half)]
+    if value > half:
+        outputs.append((tx.txid, 1, value - half))
+    return tx, outputs
+
+
+def make_block(height, coins, pick, transactions, inputs=1):
+    coinbase = CTransaction.coinbase(ADDRESS, 50, height, height)
+    txs = [coinbase]
+    created = [(coinbase.txid, 0, 50 * COIN)]
+    for i in range(transactions):
+        tx, outputs = spend([pick(coins) for _ in range(inputs)], height * TRANSACTIONS_PER_BLOCK + i)
+        txs.append(tx)
+        created.extend(outputs)
+    coins.extend(created)
+    return CBlock(height, "00" * 32, txs, height, 0, 0)
+
+
+def take_random(rng):
+    def pick(coins):
+        i = rng.randrange(len(coins))
+        coins[i], coins[-1] = coins[-1], coins[i]
+        return coins.pop()
+    return pick
+
+
+def take_recent(rng):
+    uniform = take_random(rng)
+
+    def pick(coins):
+        if rng.random() >= RECENT_SHARE:
+            return uniform(coins)
+        i = rng.randrange(len(coins) - len(coins) // 10, len(coins))
+        coins[i], coins[-1] = coins[-1], coins[i]
+        return coins.pop()
+    return pick
+
+
+def grow(path, target):
+    """Build a set of about target coins. Returns (coins, height, seconds spent connecting)."""
+    utxo = UTXOSet(path)
+    coins = []
+    pick = take_random(random.Random(1))
+    height = 0
+    elapsed = 0.0
+    while len(coins) < target:
+        height += 1
+        transactions = min(TRANSACTIONS_PER_BLOCK, max(len(coins) - 1, 0), target - len(coins))
+        block = make_block(height, coins, pick, transactions)
+        start = time.perf_counter()
+        utxo.connect_block(block, height)
+        elapsed += time.perf_counter() - start
+    start = time.perf_counter()
+    utxo.close()
+    return coins, height, elapsed + time.perf_counter() - start
+
+
+def connect(path, coins, height, blocks, cache_size, workload):
+    utxo = UTXOSet(path, cache_size=cache_size)
+    rng = random.Random(2)
+    pick = take_recent(rng) if workload == 'recent' else take_random(rng)
+    for txid, index, _ in coins[-cache_size:]:
+        utxo.get(txid, index)
+    utxo.hits = utxo.misses = 0
+    coins = list(coins)
+    # Build the blocks first: only connecting them is timed.
+    work = [make_block(height + i + 1, coins, pick, TRANSACTIONS_PER_BLOCK, inputs=2) for i in range(blocks)]
+    start = time.perf_counter()
+    for i, block in enumerate(work):
+        utxo.connect_block(block, height + i + 1)
+    utxo.flush()
+    elapsed = time.perf_counter() - start
+    result = {
+        'blocks_per_s': blocks / elapsed,
+        'transactions_per_s': blocks * (TRANSACTIONS_PER_BLOCK + 1) / elapsed,
+        'hit_rate': utxo.hit_rate,
+        'database_reads': utxo.misses,
+    }
+    utxo.close()
+    return result
+
+
+def run(coins=2_000_000, blocks=20, cache_sizes=(100_000, 1_000_000, 4_000_000)):
+    tmp = tempfile.mkdtemp()
+    try:
+        base = os.path.join(tmp, 'grown.sqlite')
+        live, height, seconds = grow(base, coins)
+        results = {'coins': len(live), 'grow_connect_s': seconds, 'grow_coins_per_s': len(live) / seconds,
+                   'runs': []}
+        for workload in ('random', 'recent'):
+            for cache_size in cache_sizes:
+                path = os.path.join(tmp, f"{workload}-{cache_size}.sqlite")
+                shutil.copyfile(base, path)
+                run_result = connect(path, live, height, blocks, cache_size, workload)
+                run_result.update(workload=workload, cache_size=cache_size)
+                results['runs'].append(run_result)
+                os.remove(path)
+        return results
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UTXO set benchmark")
+    parser.add_argument("--coins", type=int, default=2_000_000, help="Size of the UTXO set to grow")
+    parser.add_argument("--blocks", type=int, default=20, help="Blocks connected per configuration")
+    parser.add_argument("--cache-sizes", type=int, nargs="*", default=[100_000, 1_000_000, 4_000_000],
+                        help="Cache sizes to try, in coins")
+    args = parser.parse_args()
+
+    results = run(args.coins, args.blocks, args.cache_sizes)
+    print(f"grew {results['coins']:,} coins, {results['grow_connect_s']:.1f} s connecting blocks "
+          f"({results['grow_coins_per_s']:,.0f} coins/s)")
+    for r in results['runs']:
+        print(f"{r['workload']:>6} spends, cache {r['cache_size']:>9,}: {r['blocks_per_s']:6.1f} blocks/s, "
+              f"{r['transactions_per_s']:8,.0f} tx/s, hit rate {r['hit_rate']:6.1%}, "
+              f"{r['database_reads']:,} database reads")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Block validation: time of each validation stage, and duplicate arrivals.
+
+Signs a block of each size of --transactions on a fresh regtest chain, then
+for each count of --workers signature verifier processes:
+  - cold: adds a copy of the block, decoded from its bytes as a peer's would
+    be, with an empty signature cache, and reports the time of every stage
+    (see bitcoin/core/validation.py),
+  - peers: adds --peers copies of the block at the same time from as many
+    threads, as when several peers send it at once. The validated-block cache
+    and the wait for an ongoing check make this cost about one validation.
+
+Run from the repository root:
+    python -m benchmarks.bench_validation [--transactions 100 1000] [--workers 1 2] [--peers 4]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_relay import signed_block
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import REGTEST
+from bitcoin.core.validation import STAGES
+from bitcoin.utils.utils import SignatureCache, SignatureVerifier
+
+
+def new_chain(tmp, name, workers):
+    # A cache of its own: signatures verified by an earlier run must not be found.
+    verifier = SignatureVerifier(workers=workers, cache=SignatureCache())
+    return Blockchain(data_dir=os.path.join(tmp, name), verifier=verifier, params=REGTEST)
+
+
+def copy(data):
+    return CBlock.deserialize(data)[0]
+
+
+def cold(tmp, name, data, workers):
+    chain = new_chain(tmp, name, workers)
+    try:
+        block = copy(data)
+        chain.add_block(block)
+        report = chain.reports[block.hash]
+        return {'total_ms': report.total * 1000,
+                'stages_ms': {stage: report.timings[stage] * 1000 for stage in STAGES if stage in report.timings}}
+    finally:
+        chain.close()
+
+
+def peers(tmp, name, data, workers, count):
+    chain = new_chain(tmp, name, workers)
+    outcomes = []
+    try:
+        blocks = [copy(data) for _ in range(count)]
+        ready = threading.Barrier(count + 1)
+
+        def receive(block):
+            ready.wait()
+            try:
+                chain.add_block(block)
+                outcomes.append('added')
+            except ValueError as e:
+                outcomes.append(str(e))
+
+        threads = [threading.Thread(target=receive, args=(block,)) for block in blocks]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {'peers': count, 'wall_ms': elapsed * 1000, 'added': outcomes.count('added'),
+                'already_known': outcomes.count("Block already known")}
+    finally:
+        chain.close()
+
+
+def run(transactions=(100, 1000), workers=(1, 2), peer_count=4):
+    with tempfile.TemporaryDirectory() as tmp:
+        genesis = Blockchain(data_dir=os.path.join(tmp, 'genesis'), params=REGTEST)
+        parent = genesis.get_last_block().hash
+        genesis.close()
+        results = {'peers': peer_count, 'cpus': os.cpu_count(), 'blocks': []}
+        for count in transactions:
+            data = signed_block(parent, count, REGTEST.genesis_bits).serialize()
+            for worker_count in workers:
+                name = f"{count}-{worker_count}"
+                results['blocks'].append({
+                    'transactions': count,
+                    'workers': worker_count,
+                    'cold': cold(tmp, f"cold-{name}", data, worker_count),
+                    'peers': peers(tmp, f"peers-{name}", data, worker_count, peer_count),
+                })
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block validation benchmark")
+    parser.add_argument("--transactions", type=int, nargs='+', default=[100, 1000], help="Transactions per block")
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2],
+                        help="Signature verifier process counts to run")
+    parser.add_argument("--peers", type=int, default=4, help="Copies of the block received at the same time")
+    args = parser.parse_args()
+
+    results = run(args.transactions, args.workers, args.peers)
+    print(f"{results['cpus']} CPUs")
+    for block in results['blocks']:
+        cold, peers = block['cold'], block['peers']
+        stages = ", ".join(f"{stage} {ms:.2f}" for stage, ms in cold['stages_ms'].items())
+        print(f"{block['transactions']:6,} transactions, {block['workers']} workers: "
+              f"cold {cold['total_ms']:8.1f} ms ({stages})")
+        print(f"{'':31}{peers['peers']} peers at once: {peers['wall_ms']:8.1f} ms "
+              f"({peers['wall_ms'] / cold['total_ms']:4.2f}x one block), {peers['added']} added, "
+              f"{peers['already_known']} already known")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Wallet index: scanning a chain for a wallet's transactions, and reading its balance.
+
+Builds a chain of blocks of signed transactions between addresses outside the
+wallet (the same ones in every block, so they are only signed and verified
+once). Every --every blocks, one transaction pays the wallet and the next one
+spends that output again. It then indexes the wallet's addresses from genesis:
+  - decode: every block decoded and its transactions matched,
+  - filter: blocks searched for the wallet's addresses first, decoding only
+    those that contain one (WalletIndex default),
+  - parallel: the filtered scan spread over --workers processes,
+and times balance lookups on the resulting index.
+
+Run from the repository root:
+    python -m benchmarks.bench_wallet [--blocks 10000] [--transactions 20] [--every 100]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import REGTEST, bits_to_target
+from bitcoin.core.mining import search_nonces
+from bitcoin.core.transaction import CTransaction
+from bitcoin.utils.utils import generate_address, generate_private_key
+from bitcoin.wallet.index import AddressFilter, WalletIndex
+
+BALANCE_LOOKUPS = 100_000
+
+
+class DecodeEverything(AddressFilter):
+    """Decodes every block instead of searching it for the addresses first."""
+    def may_match(self, data, start=0, end=None):
+        return True
+
+
+def build_chain(directory, blocks, transactions, every):
+    """Build the chain. Returns the wallet's address."""
+    others = [generate_private_key() for _ in range(4)]
+    wallet_key, wallet_public = generate_private_key()
+    wallet_address = generate_address(wallet_public)
+    blockchain = Blockchain(data_dir=directory, params=REGTEST)
+    tip = blockchain.get_last_block()
+    filler = []
+    for i in range(transactions):
+        key, public = others[i % len(others)]
+        tx = CTransaction(generate_address(public), f"shop-{i}", 1, 0.0001, i)
+        tx.sign_transaction(key)
+        filler.append(tx)
+    received = None
+    for height in range(1, blocks + 1):
+        txs = [CTransaction.coinbase("miner", 50, height, height)] + filler
+        if height % every == 0:
+            key, public = others[0]
+            tx = CTransaction(generate_address(public), wallet_address, 2, 0.0001, height)
+            tx.sign_transaction(key)
+            txs.append(tx)
+            received = tx
+        elif height % every == 1 and received is not None:
+            tx = CTransaction(wallet_address, "shop", 1, 0.0001, height, inputs=[(received.txid, 0)],
+                              change=0.9999)
+            tx.sign_transaction(wallet_key)
+            txs.append(tx)
+        block = CBlock(height, tip.hash, txs, height, 0, REGTEST.genesis_bits)
+        block.nonce = search_nonces(block.header_prefix(), bits_to_target(block.bits), 0, 1, lambda: False)
+        block.hash = block.calculate_hash()
+        blockchain.add_block(block)
+        tip = block
+    blockchain.close()
+    return wallet_address
+
+
+def scan(blockchain, path, address, workers=1, address_filter=None):
+    index = WalletIndex(path, [address], workers=workers)
+    if address_filter is not None:
+        index.filter = address_filter
+    start = time.perf_counter()
+    index.attach(blockchain)
+    elapsed = time.perf_counter() - start
+    result = {'seconds': elapsed, 'blocks_per_s': len(blockchain.chain) / elapsed,
+              'balance': index.balance(), 'transactions': len(index.history())}
+    return index, result
+
+
+def run(blocks=10_000, transactions=20, every=100, workers=None):
+    workers = workers or max(os.cpu_count() or 1, 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, 'blocks')
+        start = time.perf_counter()
+        address = build_chain(directory, blocks, transactions, every)
+        results = {'blocks': blocks, 'transactions_per_block': transactions, 'workers': workers,
+                   'build_s': time.perf_counter() - start}
+        blockchain = Blockchain(data_dir=directory, params=REGTEST)
+        try:
+            index, results['decode'] = scan(blockchain, os.path.join(tmp, 'decode.sqlite'), address,
+                                            address_filter=DecodeEverything([address]))
+            index.close()
+            index, results['filter'] = scan(blockchain, os.path.join(tmp, 'filter.sqlite'), address)
+            index.close()
+            index, results['parallel'] = scan(blockchain, os.path.join(tmp, 'parallel.sqlite'), address,
+                                              workers=workers)
+            start = time.perf_counter()
+            for _ in range(BALANCE_LOOKUPS):
+                index.balance(address)
+            results['balance_lookup_us'] = (time.perf_counter() - start) / BALANCE_LOOKUPS * 1e6
+            index.close()
+        finally:
+            blockchain.close()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wallet index scan benchmark")
+    parser.add_argument("--blocks", type=int, default=10_000, help="Blocks in the chain")
+    parser.add_argument("--transactions", type=int, default=20, help="Transactions per block outside the wallet")
+    parser.add_argument("--every", type=int, default=100, help="Blocks between two payments to the wallet")
+    parser.add_argument("--workers", type=int, default=None, help="Processes of the parallel scan")
+    args = parser.parse_args()
+
+    results = run(args.blocks, args.transactions, args.every, args.workers)
+    print(f"chain of {results['blocks']:,} blocks, {results['transactions_per_block']} transactions each "
+          f"(built in {results['build_s']:.1f} s)")
+    for mode in ('decode', 'filter', 'parallel'):
+        r = results[mode]
+        label = f"parallel ({results['workers']} workers)" if mode == 'parallel' else mode
+        print(f"{label:>22}: {r['seconds']:7.2f} s, {r['blocks_per_s']:9,.0f} blocks/s, "
+              f"{r['transactions']} wallet transactions, balance {r['balance']:,} satoshis")
+    print(f"balance lookup: {results['balance_lookup_us']:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Wallet file: creating and saving many keys, and opening a large wallet.
+
+Compares the key store (bitcoin/wallet/keystore.py) with the pickled wallet it
+replaced, which rewrote the whole {address: PEM keys} dict on every new key:
+  - one at a time: --single keys created with create_new_key (one fsync each
+    for the key store, one rewrite of the whole file each for pickle),
+  - batch: --keys keys created with create_new_keys (one write and one fsync),
+  - cold load: opening a wallet of --keys keys and listing its addresses, for
+    the pickle file, the key store and the encrypted key store,
+  - first use: deriving the key and public key of an address after a cold load,
+  - rewrite: what one new key costs the pickled wallet at --keys keys.
+
+Run from the repository root:
+    python -m benchmarks.bench_wallet_store [--keys 100000] [--single 1000]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+from cryptography.hazmat.primitives import serialization
+
+from bitcoin.utils.utils import generate_address, generate_private_key
+from bitcoin.wallet.keystore import KeyStore
+from bitcoin.wallet.wallet import Wallet
+
+PASSPHRASE = "benchmark passphrase"
+
+
+class PickleWallet:
+    """The wallet file as it was: the whole key dict pickled again on every new key."""
+    def __init__(self, wallet_file):
+        self.wallet_file = wallet_file
+        self.keys = {}
+
+    def create_new_key(self):
+        private_key, public_key = generate_private_key()
+        address = generate_address(public_key)
+        self.keys[address] = {'private_key': private_key, 'public_key': public_key}
+        with open(self.wallet_file, "wb") as f:
+            pickle.dump(self.keys, f)
+        return address
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def pickled_copy(store, path):
+    """Write the keys of store as a pickled wallet, the way the old wallet saved them."""
+    keys = {}
+    for address in store:
+        entry = store[address]
+        keys[address] = {
+            'private_key': entry['private_key'].private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption()),
+            'public_key': entry['public_key'],
+        }
+    with open(path, "wb") as f:
+        pickle.dump(keys, f)
+
+
+def run(keys=100_000, single=1000):
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {'keys': keys, 'single': single}
+
+        wallet = PickleWallet(os.path.join(tmp, 'single.pickle'))
+        _, seconds = timed(lambda: [wallet.create_new_key() for _ in range(single)])
+        results['pickle_single_keys_per_s'] = single / seconds
+        wallet = Wallet(os.path.join(tmp, 'single.dat'))
+        _, seconds = timed(lambda: [wallet.create_new_key() for _ in range(single)])
+        results['store_single_keys_per_s'] = single / seconds
+        wallet.close()
+
+        path = os.path.join(tmp, 'wallet.dat')
+        wallet = Wallet(path)
+        _, seconds = timed(lambda: wallet.create_new_keys(keys))
+        results['store_batch_keys_per_s'] = keys / seconds
+        results['file_size'] = os.path.getsize(path)
+        wallet.close()
+        encrypted_path = os.path.join(tmp, 'encrypted.dat')
+        wallet = Wallet(encrypted_path, passphrase=PASSPHRASE)
+        _, seconds = timed(lambda: wallet.create_new_keys(keys))
+        results['encrypted_batch_keys_per_s'] = keys / seconds
+        wallet.close()
+
+        pickle_path = os.path.join(tmp, 'wallet.pickle')
+        store = KeyStore(path)
+        pickled_copy(store, pickle_path)
+        store.close()
+        results['pickle_file_size'] = os.path.getsize(pickle_path)
+
+        def load_pickle():
+            with open(pickle_path, "rb") as f:
+                return list(pickle.load(f))
+
+        _, results['pickle_load_s'] = timed(load_pickle)
+        with open(pickle_path, "rb") as f:
+            loaded = pickle.load(f)
+
+        def rewrite():
+            with open(pickle_path, "wb") as f:
+                pickle.dump(loaded, f)
+
+        _, results['pickle_rewrite_s'] = timed(rewrite)
+        wallet, results['store_load_s'] = timed(lambda: Wallet(path))
+        address = wallet.get_address_list()[-1]
+        _, seconds = timed(lambda: wallet.keys[address])
+        results['first_use_ms'] = seconds * 1000
+        wallet.close()
+        wallet, results['encrypted_load_s'] = timed(lambda: Wallet(encrypted_path, passphrase=PASSPHRASE))
+        wallet.close()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wallet file benchmark")
+    parser.add_argument("--keys", type=int, default=100_000, help="Keys created in one batch and loaded")
+    parser.add_argument("--single", type=int, default=1000, help="Keys created one at a time")
+    args = parser.parse_args()
+
+    r = run(args.keys, args.single)
+    print(f"{r['single']:,} keys one at a time: pickle {r['pickle_single_keys_per_s']:8,.0f} keys/s, "
+          f"key store {r['store_single_keys_per_s']:8,.0f} keys/s")
+    print(f"{r['keys']:,} keys in one batch: {r['store_batch_keys_per_s']:,.0f} keys/s, "
+          f"encrypted {r['encrypted_batch_keys_per_s']:,.0f} keys/s")
+    print(f"file size: key store {r['file_size']:,} bytes, pickle {r['pickle_file_size']:,} bytes")
+    print(f"cold load of {r['keys']:,} keys: pickle {r['pickle_load_s'] * 1000:.0f} ms, "
+          f"key store {r['store_load_s'] * 1000:.0f} ms, encrypted {r['encrypted_load_s'] * 1000:.0f} ms "
+          f"(scrypt included)")
+    print(f"first use of an address after loading: {r['first_use_ms']:.2f} ms")
+    print(f"one new key in a pickled wallet of {r['keys']:,} keys: {r['pickle_rewrite_s'] * 1000:.0f} ms "
+          f"(the key store appends {r['file_size'] // r['keys']} bytes)")
+
+
+if __name__ == "__main__":
+    main()
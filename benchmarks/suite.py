@@ -0,0 +1,269 @@
+"""
+Benchmark suite: runs a fixed set of the benchmarks of this directory, writes
+their figures to a JSON file and compares them with a saved baseline.
+
+Covers the block store (Blockchain.add_block at several heights and
+load_chain on startup), block header hashing (CBlock.calculate_hash and the
+mining loop), the transaction pool (add, remove a block's transactions,
+select a template), sign_data and verify_signature, address generation and
+validation, BloomFilter, and the P2PNode loopback load test. Each benchmark
+runs with the sizes of a profile, --repeat times, and every figure is the
+best of the repeats, as timeit does: the slower runs measure whatever else
+the machine was doing rather than the code.
+Profiles:
+  - quick: sizes that take a minute or two in all, to run before a change,
+  - full: the sizes the benchmarks run with on their own.
+
+--output writes the figures, the raw results and the machine they ran on.
+A file written that way is a baseline: --baseline compares each figure with
+it, and the exit status is 1 when one of them got worse by more than its
+tolerance (--tolerance, or more for figures known to be noisy).
+
+Run from the repository root:
+    python -m benchmarks.suite [--profile quick] [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+FORMAT_VERSION = 1
+DEFAULT_TOLERANCE = 0.15
+
+# A figure taken from a benchmark's results:
+#   path: the keys leading to it in the dict run() returns; figures missing
+#         from the results of a profile are left out,
+#   higher: whether a higher value is better (a rate) or worse (a time),
+#   tolerance: the relative change allowed before it counts as a regression,
+#              DEFAULT_TOLERANCE / --tolerance when None.
+Metric = namedtuple('Metric', 'name path unit higher tolerance', defaults=(None,))
+# A benchmark of the suite: the module of this directory whose run() it
+# calls, with the keyword arguments of each profile.
+Case = namedtuple('Case', 'name module profiles metrics')
+
+CASES = (
+    Case('storage', 'bench_storage', {
+        'quick': {'max_height': 10_000, 'legacy': False},
+        'full': {'max_height': 1_000_000, 'legacy': False},
+    }, (
+        Metric('storage.add_block_us.h1000', ('block_store_append_us', 1_000), 'us', False),
+        Metric('storage.add_block_us.h10000', ('block_store_append_us', 10_000), 'us', False),
+        Metric('storage.add_block_us.h100000', ('block_store_append_us', 100_000), 'us', False),
+        Metric('storage.add_block_us.h1000000', ('block_store_append_us', 1_000_000), 'us', False),
+        # Startup of a few milliseconds varies with the page cache.
+        Metric('storage.load_chain_ms', ('startup', 'startup_ms'), 'ms', False, 0.25),
+    )),
+    Case('block_hash', 'bench_block_hash', {
+        'quick': {'block_sizes': (1, 1_000), 'attempts': 50_000},
+        'full': {'block_sizes': (1, 100, 1_000, 10_000), 'attempts': 200_000},
+    }, (
+        Metric('block_hash.calculate_hash_per_s', (1, 'calculate_hash_per_s'), 'H/s', True),
+        Metric('block_hash.midstate_per_s', (1, 'binary_midstate_hashes_per_s'), 'H/s', True),
+        Metric('block_hash.calculate_hash_per_s.1000tx', (1_000, 'calculate_hash_per_s'), 'H/s', True),
+    )),
+    Case('mining', 'bench_mining', {
+        'quick': {'duration': 1.0, 'worker_counts': []},
+        'full': {'duration': 5.0, 'worker_counts': []},
+    }, (
+        Metric('mining.in_thread_hashes_per_s', ('in_thread_hashes_per_s',), 'H/s', True),
+    )),
+    Case('mempool', 'bench_mempool', {
+        'quick': {'count': 20_000, 'legacy_removals': 10},
+        'full': {'count': 100_000, 'legacy_removals': 50},
+    }, (
+        Metric('mempool.add_per_s', ('add_per_s',), 'tx/s', True),
+        Metric('mempool.add_with_eviction_per_s', ('add_with_eviction_per_s',), 'tx/s', True),
+        Metric('mempool.remove_block_ms', ('remove_block_ms',), 'ms', False),
+        Metric('mempool.select_2000_ms', ('select_ms', 2_000), 'ms', False),
+    )),
+    Case('signatures', 'bench_signatures', {
+        'quick': {'count': 500, 'worker_counts': [1]},
+        'full': {'count': 2_000, 'worker_counts': [1]},
+    }, (
+        Metric('signatures.sign_per_s', ('sign_per_s',), 'sig/s', True),
+        Metric('signatures.verify_per_s', ('sequential_per_s',), 'sig/s', True),
+        Metric('signatures.verify_batch_per_s', ('batch_per_s', 1), 'sig/s', True),
+        Metric('signatures.cached_per_s', ('cached_per_s',), 'sig/s', True),
+    )),
+    Case('addresses', 'bench_addresses', {
+        'quick': {'count': 20_000},
+        'full': {'count': 100_000},
+    }, (
+        Metric('addresses.generate_address_per_s', ('single',), 'addr/s', True),
+        Metric('addresses.generate_addresses_per_s', ('batch',), 'addr/s', True),
+        Metric('addresses.validate_addresses_per_s', ('validate',), 'addr/s', True),
+    )),
+    Case('bloom', 'bench_bloom', {
+        'quick': {'items': 20_000},
+        'full': {'items': 100_000},
+    }, (
+        Metric('bloom.add_per_s', ('bytearray', 'add_per_s'), 'item/s', True),
+        Metric('bloom.add_many_per_s', ('bytearray', 'add_many_per_s'), 'item/s', True),
+        Metric('bloom.contains_per_s', ('bytearray', 'contains_per_s'), 'item/s', True),
+        Metric('bloom.rolling_add_per_s', ('rolling', 'add_per_s'), 'item/s', True),
+    )),
+    # The loopback test shares one core between the node and its peers: it varies by 20% from run to run.
+    Case('p2p', 'bench_p2p', {
+        'quick': {'peers': 500, 'messages': 10, 'pings': 10},
+        'full': {'peers': 2_000, 'messages': 20, 'pings': 10},
+    }, (
+        Metric('p2p.connect_s', ('connect_s',), 's', False, 0.5),
+        Metric('p2p.broadcast_deliveries_per_s', ('broadcast_deliveries_per_s',), 'msg/s', True, 0.25),
+        Metric('p2p.ping_round_trips_per_s', ('ping_round_trips_per_s',), 'msg/s', True, 0.25),
+    )),
+)
+
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def environment(profile, repeat):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'profile': profile,
+        'repeat': repeat,
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run_case(case, profile):
+    module = importlib.import_module(f"benchmarks.{case.module}")
+    # The same inputs on every run, as far as the benchmark draws them from random.
+    random.seed(0)
+    gc.collect()
+    start = time.perf_counter()
+    results = module.run(**case.profiles[profile])
+    return results, time.perf_counter() - start
+
+
+def run(profile='quick', repeat=5, cases=None, log=print):
+    """
+    Run the cases named (all by default) repeat times.
+
+    :return: Dict of the environment, each figure's best value and runs, and the raw results of the last run.
+    """
+    selected = [case for case in CASES if cases is None or case.name in cases]
+    suite = {'format': FORMAT_VERSION, 'environment': environment(profile, repeat), 'metrics': {}, 'cases': {}}
+    for case in selected:
+        runs = {metric.name: [] for metric in case.metrics}
+        seconds = []
+        for attempt in range(repeat):
+            results, elapsed = run_case(case, profile)
+            seconds.append(elapsed)
+            for metric in case.metrics:
+                value = lookup(results, metric.path)
+                if value is not None:
+                    runs[metric.name].append(value)
+            log(f"{case.name:>10} run {attempt + 1}/{repeat}: {elapsed:6.1f} s")
+        suite['cases'][case.name] = {'module': case.module, 'arguments': case.profiles[profile],
+                                     'seconds': seconds, 'results': results}
+        for metric in case.metrics:
+            if runs[metric.name]:
+                suite['metrics'][metric.name] = {
+                    'value': max(runs[metric.name]) if metric.higher else min(runs[metric.name]),
+                    'runs': runs[metric.name],
+                    'unit': metric.unit,
+                    'higher_is_better': metric.higher,
+                    'tolerance': metric.tolerance,
+                }
+    return suite
+
+
+def compare(suite, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the figures of suite with those of baseline, both returned by run().
+
+    :return: List of (name, baseline value, value, relative change, status) for the figures
+        both have, the change positive when the figure got better; status is one of
+        'better', 'worse' (beyond the figure's tolerance) or 'same'.
+    """
+    rows = []
+    for name, metric in suite['metrics'].items():
+        if name not in baseline['metrics']:
+            continue
+        old, new = baseline['metrics'][name]['value'], metric['value']
+        if old == 0:
+            continue
+        change = (new - old) / old if metric['higher_is_better'] else (old - new) / old
+        allowed = metric['tolerance'] if metric['tolerance'] is not None else tolerance
+        status = 'worse' if change < -allowed else 'better' if change > allowed else 'same'
+        rows.append((name, old, new, change, status))
+    return rows
+
+
+def mismatches(suite, baseline):
+    """Environment fields that differ between two runs, which makes their figures less comparable."""
+    fields = ('profile', 'python', 'implementation', 'machine', 'cpus')
+    ours, theirs = suite['environment'], baseline['environment']
+    return [f"{field}: {theirs.get(field)} -> {ours.get(field)}" for field in fields
+            if ours.get(field) != theirs.get(field)]
+
+
+def load(path):
+    with open(path) as f:
+        suite = json.load(f)
+    if suite.get('format') != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a benchmark suite result of format {FORMAT_VERSION}")
+    return suite
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with baseline comparison")
+    parser.add_argument("--profile", choices=('quick', 'full'), default='quick', help="Benchmark sizes to run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each benchmark; figures are the best of them")
+    parser.add_argument("--cases", nargs='+', choices=[case.name for case in CASES], help="Benchmarks to run")
+    parser.add_argument("--output", metavar="PATH", help="Write the results as JSON to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare with the results of an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative change of a figure counted as a regression")
+    args = parser.parse_args()
+
+    baseline = load(args.baseline) if args.baseline else None
+    suite = run(args.profile, args.repeat, args.cases)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(suite, f, indent=2)
+            f.write("\n")
+
+    print()
+    if baseline is None:
+        for name, metric in suite['metrics'].items():
+            print(f"{name:<44} {metric['value']:14,.2f} {metric['unit']}")
+        return
+    for mismatch in mismatches(suite, baseline):
+        print(f"warning: the baseline ran on another setup, {mismatch}")
+    rows = compare(suite, baseline, args.tolerance)
+    for name, old, new, change, status in rows:
+        unit = suite['metrics'][name]['unit']
+        print(f"{name:<44} {old:14,.2f} -> {new:14,.2f} {unit:<6} {change:+7.1%}  {status}")
+    worse = [row for row in rows if row[4] == 'worse']
+    print(f"{len(rows)} figures compared, {len(worse)} worse, {sum(row[4] == 'better' for row in rows)} better")
+    if worse:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,572 @@
-import os
-import pickle
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict
 from hashlib import sha256
+from bitcoin.core.consensus import (
+    MAINNET, MEDIAN_TIME_SPAN, block_work, check_proof_of_work, median_time_past, next_bits,
+)
+from bitcoin.core.merkle import merkle_root, transaction_leaves
+from bitcoin.core.serialize import SerializationError, encode_varint, read_struct, read_varint
+from bitcoin.core.storage import NO_PARENT, ActiveChainFile, BlockIndexFile, BlockStore
+from bitcoin.core.transaction import CTransaction
+from bitcoin.core.validation import STAGES, BlockValidator, format_report
+from bitcoin.utils.metrics import metrics, profiler
+from bitcoin.utils.utils import SignatureVerifier
+
+logger = logging.getLogger(__name__)
+
+# Version 2: the header carries a compact target (bits) instead of a count of leading zero hex digits.
+BLOCK_VERSION = 2
+# version, previous block hash, transactions root, timestamp, compact target, nonce
+BLOCK_HEADER = struct.Struct('<I32s32sIII')
+NONCE = struct.Struct('<I')
+MAX_NONCE = 2 ** 32 - 1
+# Validation reports kept, for the most recently added blocks.
+REPORT_HISTORY = 1000
+
+BLOCKS_ADDED = metrics.counter('chain_blocks_added_total', "Blocks validated and stored, on any branch")
+BLOCK_SECONDS = metrics.histogram('chain_block_seconds', "Time from receiving a block to storing or connecting it")
+STAGE_SECONDS = metrics.histogram('chain_block_stage_seconds', "Time of each validation stage of a block",
+                                  labels=('stage',))
+_STAGE_SECONDS = {stage: STAGE_SECONDS.labels(stage=stage) for stage in STAGES}
+REORGANIZATIONS = metrics.counter('chain_reorganizations_total', "Changes of the active chain that disconnected blocks")
+SAVE_SECONDS = metrics.histogram('chain_save_seconds', "Time to force the block store and chain state to disk")
+LOAD_SECONDS = metrics.histogram('chain_load_seconds', "Time to open the block store and chain state at startup")
+
 
 class CBlock:
-    def __init__(self, index, prev_hash, transactions, timestamp, nonce, difficulty):
+    __slots__ = ('version', 'index', 'prev_hash', 'transactions', 'timestamp', 'nonce', 'bits',
+                 'merkle_root', 'hash')
+
+    def __init__(self, index, prev_hash, transactions, timestamp, nonce, bits, version=BLOCK_VERSION,
+                 merkle_root=None):
+        """
+        :param transactions: List of CTransaction, the coinbase first.
+        :param bits: Compact proof-of-work target, see bitcoin.core.consensus.
+        :param merkle_root: Root of the transaction ids if the caller already has it (e.g. from a MerkleTree).
+        """
+        self.version = version
         self.index = index
         self.prev_hash = prev_hash
         self.transactions = transactions
         self.timestamp = timestamp
         self.nonce = nonce
-        self.difficulty = difficulty
+        self.bits = bits
+        self.merkle_root = merkle_root if merkle_root is not None else self.calculate_merkle_root()
         self.hash = self.calculate_hash()
 
+    def calculate_merkle_root(self):
+        """Merkle root of the block's transaction ids, stored in the header."""
+        return merkle_root(transaction_leaves(self.transactions))
+
+    def header_prefix(self):
+        """
+        The serialized header without its trailing nonce. It is constant while
+        searching nonces, so its hash state only has to be computed once.
+        """
+        return BLOCK_HEADER.pack(
+            self.version, bytes.fromhex(self.prev_hash), self.merkle_root,
+            self.timestamp, self.bits, 0,
+        )[:-NONCE.size]
+
+    def serialize_header(self):
+        """The fixed-size 80-byte header the block hash is computed over."""
+        return self.header_prefix() + NONCE.pack(self.nonce)
+
     def calculate_hash(self):
-        block_header = f"{self.index}{self.prev_hash}{self.transactions}{self.timestamp}{self.nonce}{self.difficulty}"
-        return sha256(block_header.encode('utf-8')).hexdigest()
+        return sha256(self.serialize_header()).hexdigest()
+
+    def serialize(self):
+        """
+        Wire and disk encoding: the 80-byte header, the height as a varint, then
+        the transaction count and every transaction.
+        """
+        parts = [self.serialize_header(), encode_varint(self.index), encode_varint(len(self.transactions))]
+        parts.extend(tx.serialize() for tx in self.transactions)
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize_header(cls, view, offset=0, index=None):
+        """
+        Parse an 80-byte header into a block without transactions, enough to
+        check its link and proof-of-work. Returns (block, offset just past it).
+        """
+        view = memoryview(view)
+        header_start = offset
+        (version, prev_hash, root, timestamp, bits, nonce), offset = read_struct(BLOCK_HEADER, view, offset)
+        if version != BLOCK_VERSION:
+            raise SerializationError(f"unsupported block version {version}")
+
+        block = cls.__new__(cls)
+        block.version = version
+        block.index = index
+        block.prev_hash = prev_hash.hex()
+        block.merkle_root = root
+        block.timestamp = timestamp
+        block.bits = bits
+        block.nonce = nonce
+        block.transactions = []
+        block.hash = sha256(view[header_start:offset]).hexdigest()
+        return block, offset
+
+    @classmethod
+    def deserialize(cls, view, offset=0):
+        """
+        Parse a block from a bytes-like object at offset without copying the
+        buffer. Returns (block, offset just past it).
+        """
+        view = memoryview(view)
+        block, offset = cls.deserialize_header(view, offset)
+        block.index, offset = read_varint(view, offset)
+
+        count, offset = read_varint(view, offset)
+        for _ in range(count):
+            tx, offset = CTransaction.deserialize(view, offset)
+            block.transactions.append(tx)
+        return block, offset
+
+    def is_valid(self, params=MAINNET):
+        """Whether the block hash meets the block's own target, within the limit of the network."""
+        return check_proof_of_work(self.hash, self.bits, params)
+
+
+def genesis_block(params=MAINNET):
+    """The first block of a network: no transactions, and the network's initial target."""
+    return CBlock(0, "0" * 64, [], 0, 0, params.genesis_bits)
+
+
+class BlockIndexEntry:
+    """
+    A block known to the node, on the active chain or on a side branch.
+
+    :param position: Position of the block in the BlockStore.
+    :param work: Total work of the chain ending at this block.
+    :param bits: Compact target of the block, and timestamp its header time: what retargeting needs.
+    """
+    __slots__ = ('hash', 'parent', 'height', 'work', 'position', 'bits', 'timestamp')
+
+    def __init__(self, hash, parent, height, work, position, bits, timestamp):
+        self.hash = hash
+        self.parent = parent
+        self.height = height
+        self.work = work
+        self.position = position
+        self.bits = bits
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"BlockIndexEntry({self.hash}, height={self.height})"
+
+
+class ChainView:
+    """
+    Read-only sequence of the blocks on the active chain, indexed by height.
+
+    Blocks are deserialized on first access and kept in a bounded LRU cache, so
+    memory use depends on cache_size rather than on the chain height. The cache
+    is keyed by store position, so it stays valid across reorganizations. It is
+    shared by the miner, the network loop and the work server: its own lock
+    guards it, and blocks are decoded outside that lock.
+    """
+    def __init__(self, store, entries, cache_size=1024):
+        """
+        :param entries: The BlockIndexEntry of every active block, by height; updated by the Blockchain.
+        """
+        self.store = store
+        self.entries = entries
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        return self.at_position(self.entries[height].position)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def at_position(self, position):
+        """The block stored at a BlockStore position, whichever branch it is on."""
+        with self._lock:
+            block = self._cache.get(position)
+            if block is not None:
+                self._cache.move_to_end(position)
+                return block
+        block, _ = CBlock.deserialize(self.store.read_view(position))
+        self.remember(position, block)
+        return block
+
+    def remember(self, position, block):
+        with self._lock:
+            self._cache[position] = block
+            self._cache.move_to_end(position)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
 
-    def is_valid(self):
-        # Validate block hash based on difficulty
-        return self.hash.startswith('0' * self.difficulty)
 
 class Blockchain:
-    def __init__(self, chain_file='blockchain.dat'):
-        self.chain_file = chain_file
-        self.chain = self.load_chain()
+    """
+    Every valid block received, indexed by hash, and the active chain: the
+    branch with the most total work.
+
+    Blocks on side branches are stored as well, so a branch that overtakes the
+    active chain becomes active by disconnecting the blocks above the fork point
+    and connecting the branch: O(depth of the reorganization), whatever the
+    chain height. Lookups by hash and by height are dictionary and list accesses.
+    """
+    def __init__(self, data_dir='blocks', cache_size=1024, verifier=None, utxo_set=None, params=MAINNET):
+        """
+        :param data_dir: Directory of the append-only block store.
+        :param cache_size: Number of recently used blocks kept in memory.
+        :param verifier: SignatureVerifier checking the transactions of new blocks; verifies in-thread by default.
+        :param utxo_set: UTXOSet checking the spends of every block connected to the active chain.
+            Without one, transactions are not checked against a ledger.
+        :param params: ConsensusParams of the network: genesis block, proof-of-work limit and retargeting.
+        """
+        self.data_dir = data_dir
+        self.params = params
+        self.verifier = verifier or SignatureVerifier(workers=1)
+        self.validator = BlockValidator(params, self.verifier)
+        self.reports = OrderedDict()  # block hash -> ValidationReport of the blocks added last
+        self.utxo_set = utxo_set
+        self.invalid = set()  # hashes of stored blocks whose spends failed to validate
+        self.store = BlockStore(data_dir)
+        if len(self.store):
+            self._check_genesis()
+        self.active_chain = ActiveChainFile(data_dir)
+        self.index_file = BlockIndexFile(data_dir)
+        self.index = {}  # block hash -> BlockIndexEntry, for every stored block
+        self.main_chain = []  # BlockIndexEntry of the active blocks, by height
+        self.chain = ChainView(self.store, self.main_chain, cache_size)
+        self.listeners = []
+        # The miner and the network both add blocks, from different threads.
+        self.lock = threading.RLock()
+        with LOAD_SECONDS.time():
+            self.load_chain()
+
+    def subscribe(self, listener, on_disconnect=None):
+        """
+        Call listener(block) for every block connected to the active chain, in
+        order, and on_disconnect(block) for every block a reorganization takes
+        off it, tip first.
+        """
+        self.listeners.append((listener, on_disconnect))
+
+    def unsubscribe(self, listener):
+        """Stop calling a listener passed to subscribe(), and its on_disconnect."""
+        self.listeners = [pair for pair in self.listeners if pair[0] != listener]
+
+    def _check_genesis(self):
+        stored = bytes(self.store.read_view(0)[:BLOCK_HEADER.size])
+        if sha256(stored).hexdigest() != genesis_block(self.params).hash:
+            if BLOCK_HEADER.unpack_from(stored)[0] != BLOCK_VERSION:
+                raise ValueError(f"{self.data_dir} holds blocks of an older version: "
+                                 f"move it away to download the chain again")
+            raise ValueError(f"{self.data_dir} holds the chain of another network than {self.params.name}")
 
     def create_genesis_block(self):
-        genesis_block = CBlock(0, "0" * 64, "Genesis Block", 0, 0, 4)
-        self.chain = [genesis_block]
+        entry = self._store_block(genesis_block(self.params), None)
+        self.main_chain.append(entry)
+        self.active_chain.replace([entry.position])
         self.save_chain()
 
     def get_last_block(self):
         return self.chain[-1]
 
+    @property
+    def tip(self):
+        """Index entry of the last block of the active chain."""
+        return self.main_chain[-1]
+
+    def get_height(self, block_hash):
+        """Height of the block with the given hash, or None if it is not on the active chain."""
+        entry = self.index.get(block_hash)
+        if entry is None or entry.height >= len(self.main_chain) or self.main_chain[entry.height] is not entry:
+            return None
+        return entry.height
+
+    def get_block(self, block_hash):
+        """The block with the given hash on any branch, or None if it is unknown."""
+        entry = self.index.get(block_hash)
+        return self.chain.at_position(entry.position) if entry is not None else None
+
+    def get_block_data(self, block_hash):
+        """The serialized block with the given hash, as sent to peers, or None if it is unknown."""
+        entry = self.index.get(block_hash)
+        return self.store.read(entry.position) if entry is not None else None
+
+    def header_at(self, height):
+        """The 80-byte header of the active block at height, read without decoding the block."""
+        return bytes(self.store.read_view(self.main_chain[height].position)[:BLOCK_HEADER.size])
+
+    def hash_at(self, height):
+        return self.main_chain[height].hash
+
+    def ancestor(self, entry, height):
+        """The index entry at height on the branch ending at entry."""
+        while entry.height > height and (entry.height >= len(self.main_chain)
+                                         or self.main_chain[entry.height] is not entry):
+            entry = entry.parent
+        # Below the fork point, the branch is the active chain.
+        return entry if entry.height == height else self.main_chain[height]
+
+    def next_bits(self, parent):
+        """The compact target required of a block extending the index entry parent."""
+        with self.lock:
+            return next_bits(self.params, parent.height + 1, parent.bits, parent.timestamp,
+                             lambda height: self.ancestor(parent, height).timestamp)
+
+    def _store_block(self, block, parent):
+        position = self.store.append(block.serialize())
+        self.chain.remember(position, block)
+        self.index_file.append(bytes.fromhex(block.hash), parent.position if parent else NO_PARENT,
+                               block.index, block.bits, block.timestamp)
+        return self._index_block(block.hash, parent, block.index, block.bits, block.timestamp, position)
+
+    def _index_block(self, block_hash, parent, height, bits, timestamp, position):
+        work = (parent.work if parent else 0) + block_work(bits)
+        entry = BlockIndexEntry(block_hash, parent, height, work, position, bits, timestamp)
+        self.index[block_hash] = entry
+        return entry
+
     def add_block(self, new_block):
-        if new_block.prev_hash != self.get_last_block().hash:
+        """
+        Validate and store a block extending any known block. It becomes the tip
+        when its branch has more work than the active chain, reorganizing onto
+        that branch if needed.
+
+        The checks that need only the block run first, outside the lock (see
+        BlockValidator); the contextual ones then run under it, in chain order.
+        The time of every stage is recorded in self.reports.
+
+        :return: True if the block is on the active chain, False if it was kept on a side branch.
+        """
+        with profiler.section('add_block'):
+            return self._add_block(new_block)
+
+    def _add_block(self, new_block):
+        start = time.perf_counter()
+        # Cheap checks first: a known block or an orphan is not worth verifying.
+        if new_block.hash in self.index:
+            raise ValueError("Block already known")
+        if new_block.prev_hash not in self.index:
             raise ValueError("Invalid previous hash")
-        if not new_block.is_valid():
-            raise ValueError("Invalid block hash")
-        self.chain.append(new_block)
-        self.save_chain()
+        report = self.validator.check_block(new_block)
+        timings = report.timings
+        with self.lock:
+            stage = time.perf_counter()
+            if new_block.hash in self.index:
+                raise ValueError("Block already known")
+            parent = self.index[new_block.prev_hash]
+            if parent.hash in self.invalid:
+                raise ValueError("Previous block is invalid")
+            if new_block.index != parent.height + 1:
+                raise ValueError("Invalid block height")
+            if new_block.bits != self.next_bits(parent):
+                raise ValueError("Incorrect proof-of-work target")
+            if new_block.timestamp <= self.median_time_past(parent):
+                raise ValueError("Block timestamp is not after the median time of the previous blocks")
+            timings['context'] = time.perf_counter() - stage
+
+            stage = time.perf_counter()
+            entry = self._store_block(new_block, parent)
+            timings['store'] = time.perf_counter() - stage
+            if entry.work <= self.tip.work:
+                self._record(report, start)
+                return False
+            stage = time.perf_counter()
+            disconnected, connected = self._activate(entry)
+            timings['connect'] = time.perf_counter() - stage
+            self._record(report, start)
+            disconnected = [self.chain.at_position(e.position) for e in disconnected]
+            connected = [self.chain.at_position(e.position) for e in connected]
+
+        for block in disconnected:
+            for _, on_disconnect in self.listeners:
+                if on_disconnect is not None:
+                    on_disconnect(block)
+        for block in connected:
+            for listener, _ in self.listeners:
+                listener(block)
+        return True
+
+    def _record(self, report, start):
+        report = report._replace(total=time.perf_counter() - start)
+        self.reports[report.hash] = report
+        while len(self.reports) > REPORT_HISTORY:
+            self.reports.popitem(last=False)
+        BLOCKS_ADDED.inc()
+        BLOCK_SECONDS.observe(report.total)
+        for stage, seconds in report.timings.items():
+            _STAGE_SECONDS[stage].observe(seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(format_report(report))
+
+    def median_time_past(self, entry):
+        """Median timestamp of the index entry and the blocks before it; a block extending entry must be later."""
+        timestamps = []
+        while entry is not None and len(timestamps) < MEDIAN_TIME_SPAN:
+            timestamps.append(entry.timestamp)
+            entry = entry.parent
+        return median_time_past(timestamps)
+
+    def _activate(self, entry):
+        """
+        Make entry the tip. Returns the entries disconnected (tip first) and connected (in order).
+        """
+        branch = []
+        fork = entry
+        while fork.height >= len(self.main_chain) or self.main_chain[fork.height] is not fork:
+            branch.append(fork)
+            fork = fork.parent
+        branch.reverse()
+        disconnected = self.main_chain[fork.height + 1:]
+        disconnected.reverse()
+        if disconnected:
+            REORGANIZATIONS.inc()
+        if self.utxo_set is not None:
+            self._update_utxo(disconnected, branch)
+        del self.main_chain[fork.height + 1:]
+        self.main_chain.extend(branch)
+        if disconnected:
+            self.active_chain.truncate(fork.height + 1)
+        self.active_chain.extend(e.position for e in branch)
+        return disconnected, branch
+
+    def _update_utxo(self, disconnected, connected):
+        """
+        Apply a change of the active chain to the UTXO set. If a block of the new
+        branch spends outputs it cannot, the set is put back as it was, the rest
+        of the branch is marked invalid and ValueError is raised.
+        """
+        utxo = self.utxo_set
+        for entry in disconnected:
+            utxo.disconnect_block(self.chain.at_position(entry.position))
+        done = 0
+        try:
+            for entry in connected:
+                utxo.connect_block(self.chain.at_position(entry.position), entry.height)
+                done += 1
+        except ValueError:
+            self.invalid.update(entry.hash for entry in connected[done:])
+            for entry in reversed(connected[:done]):
+                utxo.disconnect_block(self.chain.at_position(entry.position))
+            for entry in reversed(disconnected):
+                utxo.connect_block(self.chain.at_position(entry.position), entry.height)
+            raise
+
+    def _sync_utxo(self):
+        """
+        Bring the UTXO set to the active tip. After a crash it only reflects its
+        last flush, which may even be on a branch that was reorganized away since.
+        """
+        utxo = self.utxo_set
+        height = -1
+        if utxo.best_block is not None:
+            entry = self.index.get(utxo.best_block)
+            if entry is None:
+                raise ValueError("The UTXO set does not match the block store")
+            while self.get_height(entry.hash) is None:
+                utxo.disconnect_block(self.chain.at_position(entry.position))
+                entry = entry.parent
+            height = entry.height
+        for height in range(height + 1, len(self.main_chain)):
+            utxo.connect_block(self.chain[height], height)
+
+    def _load_index(self):
+        """
+        Rebuild the block index from the index file. Blocks the file is missing
+        (stored before it existed, or just before a crash) are indexed from their
+        stored headers. Returns the entries by store position.
+        """
+        if len(self.index_file) > len(self.store):
+            self.index_file.truncate(len(self.store))
+        entries = []
+        for block_hash, parent_position, height, bits, timestamp in self.index_file.records():
+            parent = entries[parent_position] if parent_position != NO_PARENT else None
+            entries.append(self._index_block(block_hash.hex(), parent, height, bits, timestamp, len(entries)))
+
+        for position in range(len(entries), len(self.store)):
+            view = self.store.read_view(position)
+            header = view[:BLOCK_HEADER.size]
+            timestamp, bits = BLOCK_HEADER.unpack_from(header)[3:5]
+            height, _ = read_varint(view, BLOCK_HEADER.size)
+            parent = self.index.get(bytes(header[4:36]).hex()) if height else None
+            block_hash = sha256(header).digest()
+            self.index_file.append(block_hash, parent.position if parent else NO_PARENT, height, bits, timestamp)
+            entries.append(self._index_block(block_hash.hex(), parent, height, bits, timestamp, position))
+        return entries
 
     def save_chain(self):
-        with open(self.chain_file, 'wb') as f:
-            pickle.dump(self.chain, f)
+        """Force every block appended so far to disk."""
+        with SAVE_SECONDS.time():
+            self.store.flush()
+            self.index_file.flush()
+            self.active_chain.flush()
+            if self.utxo_set is not None:
+                self.utxo_set.flush()
 
     def load_chain(self):
-        if os.path.exists(self.chain_file):
-            with open(self.chain_file, 'rb') as f:
-                return pickle.load(f)
-        else:
+        """
+        Open the chain, creating the genesis block when the block store is empty.
+
+        The block index is rebuilt from the stored headers without decoding any
+        block, and the active chain is read back from its position file. Stores
+        written before the file existed, or blocks stored just before a crash,
+        are picked up by activating the stored block with the most work.
+        """
+        if not len(self.store):
             self.create_genesis_block()
+            if self.utxo_set is not None:
+                self._sync_utxo()
             return self.chain
+        entries = self._load_index()
+        for height, position in enumerate(self.active_chain.positions):
+            entry = entries[position] if position < len(entries) else None
+            if entry is None or entry.height != height or entry.parent is not (self.tip if height else None):
+                break
+            self.main_chain.append(entry)
+        if len(self.main_chain) != len(self.active_chain):
+            self.active_chain.truncate(len(self.main_chain))
+        if not self.main_chain:
+            self.main_chain.append(entries[0])
+            self.active_chain.replace([entries[0].position])
+        if self.utxo_set is not None:
+            self._sync_utxo()
+        best = max(entries, key=lambda e: e.work)
+        if best.work > self.tip.work:
+            try:
+                self._activate(best)
+            except ValueError as e:
+                logger.warning("Stored branch ending at %s is invalid: %s", best.hash, e)
+        return self.chain
+
+    def close(self):
+        """Flush the block store and mark the shutdown as clean."""
+        if self.utxo_set is not None:
+            self.utxo_set.close()
+        self.active_chain.close()
+        self.index_file.close()
+        self.store.close()
+        self.validator.close()
 
     def display_chain(self):
         for block in self.chain:
             print(f"Index: {block.index}")
             print(f"Previous Hash: {block.prev_hash}")
             print(f"Hash: {block.hash}")
+            print(f"Merkle Root: {block.merkle_root.hex()}")
             print(f"Transactions: {block.transactions}")
             print(f"Timestamp: {block.timestamp}")
             print(f"Nonce: {block.nonce}")
-            print(f"Difficulty: {block.difficulty}")
+            print(f"Bits: {block.bits:#010x}")
             print("-" * 50)
 
 # Example Usage
@@ -73,11 +578,16 @@ if __name__ == "__main__":
     new_block = CBlock(
         index=last_block.index + 1,
         prev_hash=last_block.hash,
-        transactions="Sample Transaction",
-        timestamp=1234567890,
+        transactions=[],
+        timestamp=int(time.time()),
         nonce=0,
-        difficulty=4
+        bits=blockchain.next_bits(blockchain.tip)
     )
+    while not new_block.is_valid(blockchain.params):
+        new_block.nonce += 1
+        new_block.hash = new_block.calculate_hash()
 
     blockchain.add_block(new_block)
+    print(format_report(blockchain.reports[new_block.hash]))
     blockchain.display_chain()
+    blockchain.close()
@@ -0,0 +1,146 @@
+from collections import namedtuple
+
+# Rules of a network:
+#   pow_limit: easiest target a block may have,
+#   genesis_bits: compact target of the genesis block, and of the blocks up to the first retarget,
+#   block_time: seconds wanted between blocks,
+#   retarget_interval: blocks between two target adjustments,
+#   max_adjustment: largest factor the target may move by in one adjustment,
+#   retargeting: False keeps the genesis target forever (regression tests, benchmarks).
+ConsensusParams = namedtuple('ConsensusParams', 'name pow_limit genesis_bits block_time retarget_interval '
+                                                'max_adjustment retargeting')
+
+# Coins a block's coinbase may create, on top of the fees of its transactions.
+BLOCK_REWARD = 50
+# A block's timestamp must be later than the median timestamp of this many blocks before it...
+MEDIAN_TIME_SPAN = 11
+# ...and at most this many seconds ahead of the clock of the node checking it.
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
+
+
+def bits_to_target(bits):
+    """
+    Decode a compact target: a 1-byte exponent and a 3-byte mantissa, the
+    target being mantissa * 256^(exponent - 3), as in Bitcoin's nBits.
+
+    :raises ValueError: For a negative target or one that does not fit in 256 bits.
+    """
+    exponent = bits >> 24
+    mantissa = bits & 0x007FFFFF
+    if bits & 0x00800000 and mantissa:
+        raise ValueError(f"Negative compact target {bits:#010x}")
+    if exponent <= 3:
+        target = mantissa >> 8 * (3 - exponent)
+    else:
+        target = mantissa << 8 * (exponent - 3)
+    if target >> 256:
+        raise ValueError(f"Compact target {bits:#010x} overflows 256 bits")
+    return target
+
+
+def target_to_bits(target):
+    """Encode a target in compact form, rounding it down to its 3 most significant bytes."""
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        mantissa = target << 8 * (3 - size)
+    else:
+        mantissa = target >> 8 * (size - 3)
+    if mantissa & 0x00800000:
+        # The top bit of the mantissa is a sign bit: keep it clear.
+        mantissa >>= 8
+        size += 1
+    return size << 24 | mantissa
+
+
+MAINNET = ConsensusParams(
+    name='main',
+    pow_limit=(1 << 244) - 1,
+    genesis_bits=target_to_bits(1 << 240),  # 4 leading zero hex digits, 65,536 hashes per block
+    block_time=10,
+    retarget_interval=60,
+    max_adjustment=4,
+    retargeting=True,
+)
+REGTEST = ConsensusParams(
+    name='regtest',
+    pow_limit=(1 << 255) - 1,
+    genesis_bits=0x207FFFFF,  # about 2 hashes per block
+    block_time=10,
+    retarget_interval=60,
+    max_adjustment=4,
+    retargeting=False,
+)
+
+
+def block_work(bits):
+    """Expected number of hashes needed to find a block with a compact target."""
+    return (1 << 256) // (bits_to_target(bits) + 1)
+
+
+def check_proof_of_work(block_hash, bits, params=MAINNET):
+    """
+    Whether a block hash meets its compact target, and the target is one the
+    network allows. Hashes compare as 256-bit big-endian integers.
+
+    :param block_hash: Block hash as a hex string, or its 32 bytes.
+    """
+    try:
+        target = bits_to_target(bits)
+    except ValueError:
+        return False
+    if not 0 < target <= params.pow_limit:
+        return False
+    value = int(block_hash, 16) if isinstance(block_hash, str) else int.from_bytes(block_hash, 'big')
+    return value <= target
+
+
+def retarget(bits, timespan, expected, params=MAINNET):
+    """
+    The compact target after blocks took timespan seconds where expected were
+    wanted: the old target scaled by how much slower (easier) or faster
+    (harder) they came, by at most max_adjustment either way.
+    """
+    timespan = min(max(timespan, expected // params.max_adjustment), expected * params.max_adjustment)
+    target = bits_to_target(bits) * timespan // expected
+    return target_to_bits(min(target, params.pow_limit))
+
+
+def next_bits(params, height, parent_bits, parent_timestamp, timestamp_at):
+    """
+    The compact target required of the block at height.
+
+    The target changes on every multiple of retarget_interval, from the time
+    the blocks since the previous change took; in between, blocks keep the
+    target of their parent. The genesis block is left out of the first
+    measure: its timestamp is fixed, not the time the network started.
+
+    :param timestamp_at: Callable returning the timestamp of the ancestor at a given height on the branch.
+    """
+    if not params.retargeting or height % params.retarget_interval:
+        return parent_bits
+    first = max(height - params.retarget_interval, 1)
+    expected = params.block_time * (height - 1 - first)
+    if expected <= 0:
+        return parent_bits
+    return retarget(parent_bits, parent_timestamp - timestamp_at(first), expected, params)
+
+
+def median_time_past(timestamps):
+    """
+    Median of the timestamps of the last MEDIAN_TIME_SPAN blocks of a branch
+    (fewer near the genesis block). The next block must be later: unlike the
+    latest timestamp, the median cannot be pushed around by a single miner.
+    """
+    ordered = sorted(timestamps)
+    return ordered[len(ordered) // 2]
+
+
+# Example Usage
+if __name__ == "__main__":
+    bits = MAINNET.genesis_bits
+    print(f"Genesis bits {bits:#010x}: target {bits_to_target(bits):064x}, {block_work(bits):,} hashes per block")
+    expected = MAINNET.block_time * MAINNET.retarget_interval
+    for timespan in (expected // 8, expected // 2, expected, expected * 3):
+        new_bits = retarget(bits, timespan, expected, MAINNET)
+        print(f"Interval took {timespan:4} s (wanted {expected} s): bits {new_bits:#010x}, "
+              f"{block_work(new_bits):,} hashes per block")
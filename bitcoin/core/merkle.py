@@ -0,0 +1,121 @@
+from hashlib import sha256
+from typing import List
+
+EMPTY_ROOT = bytes(32)
+
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    """Hash two child nodes into their parent (double SHA-256)."""
+    return sha256(sha256(left + right).digest()).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """
+    Compute the merkle root of a list of 32-byte leaf hashes.
+
+    An odd node at the end of a level is paired with itself, and an empty list
+    has an all-zero root.
+    """
+    if not leaves:
+        return EMPTY_ROOT
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def verify_proof(leaf: bytes, index: int, proof: List[bytes], root: bytes) -> bool:
+    """
+    Check that leaf sits at position index of the tree with the given root.
+
+    :param proof: Sibling hashes from the leaf level up, as returned by MerkleTree.proof.
+    """
+    node = leaf
+    for sibling in proof:
+        if index % 2:
+            node = hash_pair(sibling, node)
+        else:
+            node = hash_pair(node, sibling)
+        index //= 2
+    return node == root
+
+
+class MerkleTree:
+    """
+    Merkle tree that keeps every level, so appending or replacing a leaf only
+    rehashes the path from that leaf to the root: O(log n) per change.
+
+    The root is identical to merkle_root() over the same leaves.
+    """
+    def __init__(self, leaves=()):
+        self.levels: List[List[bytes]] = [[]]
+        for leaf in leaves:
+            self.append(leaf)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self) -> bytes:
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def _rehash_path(self, index):
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            left = index - index % 2
+            right = left + 1 if left + 1 < len(nodes) else left
+            parent = hash_pair(nodes[left], nodes[right])
+            index //= 2
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            if index == len(parents):
+                parents.append(parent)
+            else:
+                parents[index] = parent
+            level += 1
+
+    def append(self, leaf: bytes):
+        """Add a leaf at the end of the tree."""
+        self.levels[0].append(leaf)
+        self._rehash_path(len(self.levels[0]) - 1)
+
+    def update(self, index: int, leaf: bytes):
+        """Replace the leaf at position index."""
+        self.levels[0][index] = leaf
+        self._rehash_path(index)
+
+    def proof(self, index: int) -> List[bytes]:
+        """Sibling hashes needed to prove the leaf at position index against the root."""
+        if not 0 <= index < len(self):
+            raise IndexError("leaf index out of range")
+        path = []
+        for nodes in self.levels[:-1]:
+            sibling = index ^ 1
+            path.append(nodes[sibling] if sibling < len(nodes) else nodes[index])
+            index //= 2
+        return path
+
+
+def transaction_leaves(transactions) -> List[bytes]:
+    """Merkle leaves of a block: the transaction ids as raw bytes."""
+    return [bytes.fromhex(tx.txid) for tx in transactions]
+
+
+# Example Usage
+if __name__ == "__main__":
+    leaves = [sha256(f"tx-{i}".encode('utf-8')).digest() for i in range(5)]
+    tree = MerkleTree(leaves[:3])
+    tree.append(leaves[3])
+    tree.append(leaves[4])
+    print(f"Merkle root: {tree.root.hex()}")
+    print(f"Matches full rebuild: {tree.root == merkle_root(leaves)}")
+
+    proof = tree.proof(2)
+    print(f"Proof for leaf 2: {[node.hex() for node in proof]}")
+    print(f"Proof valid: {verify_proof(leaves[2], 2, proof, tree.root)}")
@@ -1,20 +1,239 @@
+import logging
+import queue
 import threading
 import time
 from hashlib import sha256
-from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.blockchain import CBlock, MAX_NONCE, NONCE
+from bitcoin.core.consensus import BLOCK_REWARD, bits_to_target
+from bitcoin.core.merkle import MerkleTree, transaction_leaves
+from bitcoin.core.transaction import COIN, CTransaction, to_satoshis
+from bitcoin.utils.metrics import metrics, profiler
+from bitcoin.utils.utils import process_context
 
-class Miner:
+logger = logging.getLogger(__name__)
+
+# Nonces tried between checks of the stop signal.
+NONCE_BATCH = 4096
+# Bytes of pool transactions put in a block template.
+MAX_BLOCK_SIZE = 1_000_000
+# Seconds between checks for new pool transactions to add to the block being mined.
+TEMPLATE_REFRESH_INTERVAL = 5
+
+HASHES = metrics.counter('mining_hashes_total', "Block header hashes computed by the miner")
+BLOCKS_MINED = metrics.counter('mining_blocks_total', "Blocks found by the miner")
+
+
+def search_nonces(prefix, target, start, step, should_stop, on_batch=None):
+    """
+    Search nonces start, start + step, ... for a block hash at or below target.
+
+    The block hash is sha256(prefix + nonce), see CBlock.header_prefix. The hash
+    state after the constant prefix is computed once and only the 4-byte nonce is
+    hashed per attempt, so the cost per nonce does not depend on the block size.
+    Digests are compared with the target as 32-byte big-endian strings, which
+    orders them as the integers they encode, without converting either.
+
+    :param target: Integer target, see bitcoin.core.consensus.bits_to_target.
+
+    :param should_stop: Callable checked every NONCE_BATCH nonces; the search gives up when it returns True.
+    :param on_batch: Optional callable receiving the number of hashes done after every batch.
+    :return: The winning nonce, or None if the search was stopped or the nonce space is exhausted.
+    """
+    target = target.to_bytes(32, 'big')
+    midstate = sha256(prefix)
+    pack_nonce = NONCE.pack
+    nonce = start
+    while nonce <= MAX_NONCE and not should_stop():
+        batch_end = min(nonce + NONCE_BATCH * step, MAX_NONCE + 1)
+        for nonce in range(nonce, batch_end, step):
+            h = midstate.copy()
+            h.update(pack_nonce(nonce))
+            if h.digest() <= target:
+                return nonce
+        nonce += step
+        if on_batch:
+            on_batch(NONCE_BATCH)
+    return None
+
+
+def _mining_worker(worker_id, jobs, results, current_job, hash_counts):
+    """
+    Entry point of a MiningPool worker process.
+    """
+    def count(hashes):
+        hash_counts[worker_id] += hashes
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, prefix, target, step = job
+        nonce = search_nonces(prefix, target, worker_id, step,
+                              lambda: current_job.value != job_id, count)
+        if nonce is not None or current_job.value == job_id:
+            # Either a winning nonce or None for a worker that ran out of nonces.
+            results.put((job_id, nonce))
+
+
+class MiningPool:
+    """
+    Pool of worker processes sharing the proof-of-work search for one block.
+
+    Worker i of n tries nonces i, i + n, i + 2n, ... Every job gets an id and the
+    id of the current job lives in shared memory; bumping it (cancel) makes every
+    worker drop the job within one nonce batch.
+    """
+    def __init__(self, workers):
+        ctx = process_context()
+        self.workers = workers
+        self.current_job = ctx.RawValue('q', 0)
+        self.hash_counts = ctx.RawArray('Q', workers)
+        self.results = ctx.Queue()
+        self.job_queues = [ctx.Queue() for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=_mining_worker,
+                        args=(i, self.job_queues[i], self.results, self.current_job, self.hash_counts),
+                        daemon=True)
+            for i in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+    @property
+    def hashes(self):
+        """Total number of hashes computed by all workers so far."""
+        return sum(self.hash_counts)
+
+    def cancel(self):
+        """Abort the job the workers are currently searching."""
+        self.current_job.value += 1
+
+    def search(self, prefix, target, should_stop):
+        """
+        Search for a winning nonce with all workers.
+
+        :param should_stop: Callable polled while waiting; returning True cancels the job.
+        :return: The winning nonce, or None if the job was cancelled or no nonce qualifies.
+        """
+        self.cancel()
+        job_id = self.current_job.value
+        for jobs in self.job_queues:
+            jobs.put((job_id, prefix, target, self.workers))
+        exhausted = 0
+        while self.current_job.value == job_id and exhausted < self.workers:
+            if should_stop():
+                self.cancel()
+                break
+            try:
+                result_job, nonce = self.results.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if result_job != job_id:
+                continue
+            if nonce is None:
+                exhausted += 1
+                continue
+            self.cancel()
+            return nonce
+        return None
+
+    def close(self):
+        self.cancel()
+        for jobs in self.job_queues:
+            jobs.put(None)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+class BlockTemplate:
+    """
+    The block being mined on the current tip: a coinbase paying the mining
+    address the reward and fees, followed by the best-paying pool transactions.
+    New pool transactions are appended with an O(log n) merkle path update
+    instead of a full rebuild.
+    """
     def __init__(self, blockchain, transaction_pool, mining_address):
+        """
+        :param blockchain: The blockchain whose tip the block extends.
+        :param transaction_pool: The TransactionPool the transactions are selected from.
+        :param mining_address: The address the coinbase pays.
+        """
+        self.transaction_pool = transaction_pool
+        self.tip = blockchain.get_last_block()
+        self.height = self.tip.index + 1
+        self.bits = blockchain.next_bits(blockchain.index[self.tip.hash])
+        # Earliest timestamp the block may have: past the median time of the tip.
+        self.min_timestamp = blockchain.median_time_past(blockchain.index[self.tip.hash]) + 1
+        coinbase = CTransaction.coinbase(mining_address, BLOCK_REWARD, self.height, int(time.time()))
+        self.fees = 0
+        self.transactions = [coinbase]
+        self.txids = {coinbase.txid}
+        self.size = coinbase.size()
+        self.tree = MerkleTree(transaction_leaves(self.transactions))
+        self.pool_size = 0
+        self.update()
+
+    @property
+    def coinbase(self):
+        return self.transactions[0]
+
+    def update(self):
+        """
+        Add the best-paying pool transactions not yet in the template, and
+        raise the coinbase amount by their fees.
+        """
+        for tx in self.transaction_pool.select(max_size=MAX_BLOCK_SIZE):
+            if tx.txid not in self.txids and self.size + tx.size() <= MAX_BLOCK_SIZE:
+                self.size += tx.size()
+                self.transactions.append(tx)
+                self.txids.add(tx.txid)
+                self.tree.append(bytes.fromhex(tx.txid))
+                self.fees += to_satoshis(tx.fee)
+        coinbase = self.coinbase
+        reward = BLOCK_REWARD + self.fees / COIN
+        if coinbase.amount != reward:
+            coinbase.amount = reward
+            self.tree.update(0, bytes.fromhex(coinbase.txid))
+        self.pool_size = len(self.transaction_pool)
+
+    def block(self, timestamp):
+        """
+        The block to search a nonce for, with the transactions of the template
+        so far. The timestamp is raised to min_timestamp if it is earlier.
+        """
+        return CBlock(
+            index=self.height,
+            prev_hash=self.tip.hash,
+            transactions=list(self.transactions),
+            timestamp=max(timestamp, self.min_timestamp),
+            nonce=0,
+            bits=self.bits,
+            merkle_root=self.tree.root,
+        )
+
+
+class Miner:
+    def __init__(self, blockchain, transaction_pool, mining_address, workers=1):
         """
         Initializes the miner.
         :param blockchain: The blockchain instance.
-        :param transaction_pool: The transaction pool for pending transactions.
+        :param transaction_pool: The TransactionPool of pending transactions.
         :param mining_address: The address to receive mining rewards.
+        :param workers: Number of processes searching nonces; 1 mines in the miner thread itself.
         """
         self.blockchain = blockchain
         self.transaction_pool = transaction_pool
         self.mining_address = mining_address
+        self.workers = workers
         self.is_mining = False
+        self.pool = None
+        self.template = None
+        self._tip_changed = threading.Event()
+        self._refresh_at = 0
+        self.hashrate = 0.0  # hashes per second of the last nonce search
+        self.blockchain.subscribe(self.on_new_tip)
 
     def start_mining(self):
         self.is_mining = True
@@ -22,39 +241,111 @@ class Miner:
 
     def stop_mining(self):
         self.is_mining = False
+        if self.pool:
+            self.pool.cancel()
+
+    def on_new_tip(self, block):
+        """
+        Called when a block extends the chain: abandon the block being mined.
+        """
+        self._tip_changed.set()
+        if self.pool:
+            self.pool.cancel()
+
+    def _should_stop(self):
+        return not self.is_mining or self._tip_changed.is_set() or self._template_outdated()
+
+    def find_nonce(self, block):
+        """
+        Run the proof-of-work search for block.
+        :return: The winning nonce, or None if mining was stopped, the tip changed or the nonce space ran out.
+        """
+        prefix = block.header_prefix()
+        target = bits_to_target(block.bits)
+        start = time.perf_counter()
+        with profiler.section('mining'):
+            if self.workers > 1:
+                if self.pool is None:
+                    self.pool = MiningPool(self.workers)
+                before = self.pool.hashes
+                nonce = self.pool.search(prefix, target, self._should_stop)
+                hashes = self.pool.hashes - before
+                HASHES.inc(hashes)
+                self.hashrate = hashes / max(time.perf_counter() - start, 1e-9)
+                return nonce
+
+            counted = [0]
+
+            def count(batch):
+                # Counted as the search goes: a block may take minutes to find.
+                counted[0] += batch
+                HASHES.inc(batch)
+                self.hashrate = counted[0] / max(time.perf_counter() - start, 1e-9)
+
+            nonce = search_nonces(prefix, target, 0, 1, self._should_stop, count)
+            if nonce is not None:
+                # The batch the nonce was found in was cut short: count the hashes it took.
+                HASHES.inc(nonce + 1 - counted[0])
+            return nonce
+
+    def create_template(self):
+        """
+        Start a new block template on the current tip.
+        """
+        self._tip_changed.clear()
+        self.template = BlockTemplate(self.blockchain, self.transaction_pool, self.mining_address)
+        self._refresh_at = time.time() + TEMPLATE_REFRESH_INTERVAL
+
+    def update_template(self):
+        """
+        Add the pool transactions that arrived since the template was made.
+        """
+        self.template.update()
+        self._refresh_at = time.time() + TEMPLATE_REFRESH_INTERVAL
+
+    def _template_outdated(self):
+        return time.time() >= self._refresh_at and len(self.transaction_pool) != self.template.pool_size
 
     def mine(self):
-        print("Mining started...")
-        while self.is_mining:
-            last_block = self.blockchain.get_last_block()
-
-            # Gather transactions from the transaction pool
-            transactions = self.transaction_pool[:]
-            reward_transaction = f"Reward Transaction to {self.mining_address}"
-            transactions.append(reward_transaction)
-
-            # Create a new block
-            new_block = CBlock(
-                index=last_block.index + 1,
-                prev_hash=last_block.hash,
-                transactions=transactions,
-                timestamp=int(time.time()),
-                nonce=0,
-                difficulty=4,  # Adjust difficulty as needed
-            )
-
-            # Proof-of-work
-            while not new_block.is_valid():
-                new_block.nonce += 1
-                new_block.hash = new_block.calculate_hash()
+        logger.info("Mining started...")
+        try:
+            self.create_template()
+            while self.is_mining:
+                new_block = self.template.block(int(time.time()))
 
-                if not self.is_mining:
-                    print("Mining stopped.")
-                    return
+                # Proof-of-work
+                nonce = self.find_nonce(new_block)
+                if nonce is None:
+                    if not self.is_mining:
+                        logger.info("Mining stopped.")
+                        return
+                    if self._tip_changed.is_set():
+                        # Another block extended the chain: start over on the new tip.
+                        self.create_template()
+                    else:
+                        # New pool transactions or every nonce failed: refresh the
+                        # template and retry with a new timestamp.
+                        self.update_template()
+                    continue
+                new_block.nonce = nonce
+                new_block.hash = new_block.calculate_hash()
 
-            print(f"Block mined: {new_block.hash}")
-            self.blockchain.add_block(new_block)
+                BLOCKS_MINED.inc()
+                logger.info("Block mined: %s", new_block.hash)
+                try:
+                    self.blockchain.add_block(new_block)
+                except ValueError as e:
+                    # Keep mining, without the transactions that may have made the block invalid.
+                    logger.warning("Mined block %s rejected: %s", new_block.hash, e)
+                    self.transaction_pool.remove_transactions(tx.txid for tx in new_block.transactions[1:])
+                    self.create_template()
+                    continue
 
-            # Clear the transaction pool for the next block
-            self.transaction_pool.clear()
-            time.sleep(1)  # Simulate delay for realistic mining
+                # Drop the transactions confirmed by the block from the pool
+                self.transaction_pool.remove_block(new_block)
+                time.sleep(1)  # Simulate delay for realistic mining
+                self.create_template()
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
@@ -0,0 +1,91 @@
+import struct
+from hashlib import sha256
+
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+
+
+class SerializationError(ValueError):
+    """Raised when binary data is truncated or malformed."""
+
+
+def double_sha256(data) -> bytes:
+    return sha256(sha256(data).digest()).digest()
+
+
+def encode_varint(n: int) -> bytes:
+    """Bitcoin-style variable length integer."""
+    if n < 0xfd:
+        return UINT8.pack(n)
+    if n <= 0xffff:
+        return b'\xfd' + UINT16.pack(n)
+    if n <= 0xffffffff:
+        return b'\xfe' + UINT32.pack(n)
+    return b'\xff' + UINT64.pack(n)
+
+
+def encode_bytes(data: bytes) -> bytes:
+    """Length-prefixed byte string."""
+    return encode_varint(len(data)) + data
+
+
+def read_struct(fmt: struct.Struct, view, offset: int):
+    """Unpack fmt at offset. Returns (values, new offset)."""
+    if offset + fmt.size > len(view):
+        raise SerializationError("unexpected end of data")
+    return fmt.unpack_from(view, offset), offset + fmt.size
+
+
+def read_varint(view, offset: int):
+    """Read a varint at offset. Returns (value, new offset)."""
+    (prefix,), offset = read_struct(UINT8, view, offset)
+    if prefix < 0xfd:
+        return prefix, offset
+    fmt = {0xfd: UINT16, 0xfe: UINT32, 0xff: UINT64}[prefix]
+    (value,), offset = read_struct(fmt, view, offset)
+    return value, offset
+
+
+def read_bytes(view: memoryview, offset: int):
+    """
+    Read a length-prefixed byte string at offset. Returns (memoryview slice, new offset);
+    the slice shares the underlying buffer instead of copying it.
+    """
+    length, offset = read_varint(view, offset)
+    end = offset + length
+    if end > len(view):
+        raise SerializationError("unexpected end of data")
+    return view[offset:end], end
+
+
+def read_string(view: memoryview, offset: int):
+    """Read a length-prefixed UTF-8 string at offset. Returns (str, new offset)."""
+    data, offset = read_bytes(view, offset)
+    try:
+        return str(data, 'utf-8'), offset
+    except UnicodeDecodeError as e:
+        raise SerializationError(f"invalid string: {e}") from None
+
+
+# Example Usage
+if __name__ == "__main__":
+    from bitcoin.core.blockchain import CBlock
+    from bitcoin.core.consensus import MAINNET
+    from bitcoin.core.transaction import COINBASE, CTransaction
+    from bitcoin.utils.utils import generate_address, generate_private_key
+
+    private_key, public_key = generate_private_key()
+    coinbase = CTransaction(COINBASE, "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", 50, 0, 1234567890)
+    tx = CTransaction(generate_address(public_key), "1BoatSLRHtKNngkdXEeobR76b53LETtpyT", 0.5, 0.0001, 1234567890)
+    tx.sign_transaction(private_key)
+    block = CBlock(1, "00" * 32, [coinbase, tx], 1234567890, 42, MAINNET.genesis_bits)
+
+    data = block.serialize()
+    decoded, end = CBlock.deserialize(memoryview(data))
+    print(f"Block: {len(data)} bytes, round trip ok: {end == len(data) and decoded.serialize() == data}")
+    print(f"Hash preserved: {decoded.hash == block.hash}")
+    print(f"Txids preserved: {[t.txid for t in decoded.transactions] == [t.txid for t in block.transactions]}")
+    print(f"Signature preserved: {decoded.transactions[1].signature == tx.signature}")
+    print(f"Signature valid after decoding: {decoded.transactions[1].verify_signature()}")
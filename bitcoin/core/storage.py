@@ -0,0 +1,333 @@
+import mmap
+import os
+import struct
+from array import array
+from hashlib import sha256
+
+RECORD_MAGIC = b'BPYB'
+# magic, payload length, first 4 bytes of sha256(payload)
+RECORD_HEADER = struct.Struct('<4sI4s')
+# segment file number, offset of the record header, payload length
+INDEX_ENTRY = struct.Struct('<IQI')
+
+INDEX_FILE = 'index.dat'
+ACTIVE_CHAIN_FILE = 'active.dat'
+BLOCK_INDEX_FILE = 'blockindex.dat'
+# block hash, store position of the parent block, height, compact target, timestamp
+BLOCK_INDEX_RECORD = struct.Struct('<32sIIII')
+NO_PARENT = 0xFFFFFFFF
+CLEAN_SHUTDOWN_FILE = 'shutdown.ok'
+MAX_FILE_SIZE = 128 * 1024 * 1024
+
+
+def segment_name(file_no):
+    return f"blk{file_no:05d}.dat"
+
+
+def record_checksum(payload):
+    return sha256(payload).digest()[:4]
+
+
+class BlockStore:
+    """
+    Append-only block storage.
+
+    Block payloads are appended to segment files (blk00000.dat, blk00001.dat, ...)
+    that roll over once they reach max_file_size, and every block gets one
+    fixed-size entry in index.dat pointing at its record. Appending a block
+    writes only that block and its index entry, whatever the chain height.
+
+    Segment files are read through read-only memory maps, so reading a block
+    touches only the pages holding its record.
+
+    A clean close leaves a shutdown marker behind. When the store is opened
+    without one, the tail of the index and the last segment are checked and any
+    torn record left behind by a crash is truncated away.
+    """
+
+    def __init__(self, directory='blocks', max_file_size=MAX_FILE_SIZE, fsync=False):
+        """
+        :param directory: Directory holding the segment files and the index.
+        :param max_file_size: Size at which a new segment file is started.
+        :param fsync: fsync data and index after every append instead of only on flush/close.
+        """
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.marker_path = os.path.join(directory, CLEAN_SHUTDOWN_FILE)
+
+        if os.path.exists(self.marker_path):
+            os.remove(self.marker_path)
+        else:
+            self.recover()
+
+        with open(self.index_path, 'ab+') as f:
+            f.seek(0)
+            self._index = bytearray(f.read())
+
+        self._maps = {}
+        self._index_file = open(self.index_path, 'ab')
+        self._data_file = None
+        self._file_no = 0
+        if len(self):
+            self._file_no = self._entry(len(self) - 1)[0]
+        self._open_segment(self._file_no)
+
+    def __len__(self):
+        return len(self._index) // INDEX_ENTRY.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _entry(self, position):
+        return INDEX_ENTRY.unpack_from(self._index, position * INDEX_ENTRY.size)
+
+    def _segment_path(self, file_no):
+        return os.path.join(self.directory, segment_name(file_no))
+
+    def _open_segment(self, file_no):
+        if self._data_file:
+            self._data_file.close()
+        self._file_no = file_no
+        self._data_file = open(self._segment_path(file_no), 'ab')
+
+    def _mapping(self, file_no, end):
+        """
+        Return a memory map of the segment covering at least the first end bytes.
+        """
+        mapping = self._maps.get(file_no)
+        if mapping is None or len(mapping) < end:
+            # The segment grew past the old mapping (or was never mapped): map it again.
+            # The old mapping is left to close itself once no view into it is alive.
+            with open(self._segment_path(file_no), 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[file_no] = mapping
+        return mapping
+
+    def append(self, payload):
+        """
+        Append a block payload and return its position in the store.
+        """
+        record_size = RECORD_HEADER.size + len(payload)
+        offset = self._data_file.tell()
+        if offset and offset + record_size > self.max_file_size:
+            self._open_segment(self._file_no + 1)
+            offset = 0
+
+        self._data_file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(payload), record_checksum(payload)))
+        self._data_file.write(payload)
+        self._data_file.flush()
+
+        # The index entry is only written once the record it points to is complete,
+        # so an entry never references a record that is missing on disk.
+        entry = INDEX_ENTRY.pack(self._file_no, offset, len(payload))
+        self._index_file.write(entry)
+        self._index_file.flush()
+        if self.fsync:
+            os.fsync(self._data_file.fileno())
+            os.fsync(self._index_file.fileno())
+
+        self._index += entry
+        return len(self) - 1
+
+    def read_view(self, position):
+        """
+        Return a memoryview of the payload stored at the given position, straight
+        from the segment's memory map. Negative positions count from the tip.
+        """
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("block position out of range")
+        file_no, offset, length = self._entry(position)
+        start = offset + RECORD_HEADER.size
+        return memoryview(self._mapping(file_no, start + length))[start:start + length]
+
+    def locate(self, position):
+        """
+        Return (segment file path, payload offset, payload length) of the block at
+        the given position, for readers in other processes that map the segment
+        themselves.
+        """
+        file_no, offset, length = self._entry(position)
+        return self._segment_path(file_no), offset + RECORD_HEADER.size, length
+
+    def read(self, position):
+        """
+        Return a copy of the payload stored at the given position.
+        """
+        with self.read_view(position) as view:
+            return bytes(view)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.read(position)
+
+    def flush(self):
+        """
+        Force everything appended so far to disk.
+        """
+        self._data_file.flush()
+        os.fsync(self._data_file.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+    def close(self):
+        """
+        Flush and close the store, marking the shutdown as clean.
+        """
+        if self._data_file is None:
+            return
+        self.flush()
+        self._data_file.close()
+        self._index_file.close()
+        for mapping in self._maps.values():
+            try:
+                mapping.close()
+            except BufferError:
+                # A caller still holds a view into the mapping; it is released with that view.
+                pass
+        self._maps.clear()
+        self._data_file = None
+        with open(self.marker_path, 'wb'):
+            pass
+
+    def _record_is_complete(self, file_no, offset, length):
+        path = self._segment_path(file_no)
+        if not os.path.exists(path) or os.path.getsize(path) < offset + RECORD_HEADER.size + length:
+            return False
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            magic, stored_length, checksum = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            if magic != RECORD_MAGIC or stored_length != length:
+                return False
+            return record_checksum(f.read(length)) == checksum
+
+    def recover(self):
+        """
+        Bring the store back to a consistent state after an unclean shutdown.
+
+        Drops a partially written index entry, drops index entries whose records did
+        not make it to disk intact, and truncates segment data past the last indexed record.
+        """
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        count = index_size // INDEX_ENTRY.size
+
+        with open(self.index_path, 'ab+') as f:
+            # Only the tail can be torn: records and entries are written strictly in order.
+            while count:
+                f.seek((count - 1) * INDEX_ENTRY.size)
+                entry = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+                if self._record_is_complete(*entry):
+                    break
+                count -= 1
+            f.truncate(count * INDEX_ENTRY.size)
+
+        if count:
+            last_file, offset, length = entry
+            data_end = offset + RECORD_HEADER.size + length
+        else:
+            last_file, data_end = 0, 0
+
+        with open(self._segment_path(last_file), 'ab') as f:
+            f.truncate(data_end)
+
+        file_no = last_file + 1
+        while os.path.exists(self._segment_path(file_no)):
+            os.remove(self._segment_path(file_no))
+            file_no += 1
+
+
+class ActiveChainFile:
+    """
+    Store positions of the blocks on the active chain, indexed by height.
+
+    Extending the chain appends one 4-byte entry; a reorganization truncates the
+    file back to the fork point and appends the new branch, so both cost the
+    number of blocks changed rather than the chain height.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, ACTIVE_CHAIN_FILE)
+        self._file = open(self.path, 'ab+')
+        self._file.seek(0)
+        data = self._file.read()
+        self.positions = array('I')
+        # A crash may have left a partial entry behind.
+        self.positions.frombytes(data[:len(data) - len(data) % self.positions.itemsize])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def truncate(self, height):
+        """Forget the blocks from height up."""
+        del self.positions[height:]
+        self._file.truncate(height * self.positions.itemsize)
+
+    def extend(self, positions):
+        new = array('I', positions)
+        self.positions.extend(new)
+        self._file.write(new.tobytes())
+        self._file.flush()
+
+    def replace(self, positions):
+        self.truncate(0)
+        self.extend(positions)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class BlockIndexFile:
+    """
+    Summary of every stored block, by store position: its hash, parent and the
+    header fields the block index needs. Loading it rebuilds the index at
+    startup without reading and hashing every block header.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, BLOCK_INDEX_FILE)
+        self._file = open(self.path, 'ab+')
+        size = self._file.seek(0, os.SEEK_END)
+        self._count = size // BLOCK_INDEX_RECORD.size
+        if size % BLOCK_INDEX_RECORD.size:
+            # A crash may have left a partial record behind.
+            self._file.truncate(self._count * BLOCK_INDEX_RECORD.size)
+
+    def __len__(self):
+        return self._count
+
+    def records(self):
+        """Every record, as (hash, parent position, height, bits, timestamp) tuples in position order."""
+        self._file.seek(0)
+        return BLOCK_INDEX_RECORD.iter_unpack(self._file.read(self._count * BLOCK_INDEX_RECORD.size))
+
+    def append(self, block_hash, parent_position, height, bits, timestamp):
+        self._file.write(BLOCK_INDEX_RECORD.pack(block_hash, parent_position, height, bits, timestamp))
+        self._file.flush()
+        self._count += 1
+
+    def truncate(self, count):
+        self._count = min(self._count, count)
+        self._file.truncate(self._count * BLOCK_INDEX_RECORD.size)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
@@ -1,37 +1,225 @@
-import hashlib
-import uuid
-from typing import List
+import heapq
+import itertools
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, List, Tuple
+from bitcoin.core.serialize import (
+    SerializationError, double_sha256, encode_bytes, encode_varint, read_bytes, read_string, read_struct, read_varint,
+)
+from bitcoin.utils.utils import (
+    generate_address, generate_private_key, public_key_bytes, sign_data, signature_cache, verify_signature,
+)
+
+# Sender of the transaction paying the block reward to the miner.
+COINBASE = "coinbase"
+# Default memory cap of the transaction pool, in bytes of transaction data.
+DEFAULT_MEMPOOL_SIZE = 300 * 1024 * 1024
+# Transactions in a row that may fail to fit a block template before selection stops.
+MAX_SELECT_MISSES = 1000
+
+TX_VERSION = 2
+TX_PREFIX = struct.Struct('<B')
+# amount and fee in satoshis, timestamp
+TX_AMOUNTS = struct.Struct('<qqQ')
+# change in satoshis
+TX_CHANGE = struct.Struct('<q')
+# txid, output index
+OUTPOINT = struct.Struct('<32sI')
+COIN = 100_000_000
+# Fields covered by the txid; changing any of them invalidates the cached id.
+TXID_FIELDS = frozenset(('version', 'sender', 'receiver', 'amount', 'fee', 'timestamp', 'inputs', 'change'))
+# Txid of the outpoint a coinbase "spends"; its index is the block height, which keeps coinbase txids unique.
+NULL_TXID = "00" * 32
+
+
+def to_satoshis(value):
+    """Convert an amount in coins to an integer number of satoshis."""
+    return int(round(value * COIN))
+
 
 class CTransaction:
-    def __init__(self, sender: str, receiver: str, amount: float, fee: float, timestamp: int):
-        self.txid = self.generate_txid()
+    """
+    A payment from sender to receiver.
+
+    Version 2 transactions name the outputs they spend (inputs) and pay any
+    excess back to the sender (change): output 0 pays amount to the receiver,
+    output 1, if change is not zero, pays change to the sender. Version 1
+    transactions, from before the UTXO set, have neither.
+    """
+    __slots__ = ('version', 'sender', 'receiver', 'amount', 'fee', 'timestamp', 'inputs', 'change', 'signature',
+                 'public_key', '_unsigned', '_txid')
+
+    def __init__(self, sender: str, receiver: str, amount: float, fee: float, timestamp: int, inputs=None,
+                 change: float = 0):
+        """
+        :param inputs: Outputs spent, as (txid, output index) pairs.
+        :param change: Amount paid back to the sender.
+        """
+        self._unsigned = None
+        self._txid = None
+        self.version = TX_VERSION
         self.sender = sender
         self.receiver = receiver
         self.amount = amount
         self.fee = fee
         self.timestamp = timestamp
-        self.signature = None  # Placeholder for a cryptographic signature
+        self.inputs = list(inputs or [])
+        self.change = change
+        self.signature = None  # ECDSA signature of signature_hash(), "r:s" in hex
+        self.public_key = None  # PEM public key of the sender, checked against the sender address
+
+    @classmethod
+    def coinbase(cls, receiver: str, amount: float, height: int, timestamp: int):
+        """The transaction paying the block reward, marked with the height of its block."""
+        return cls(COINBASE, receiver, amount, 0, timestamp, inputs=[(NULL_TXID, height)])
+
+    def __setattr__(self, name, value):
+        if name in TXID_FIELDS:
+            object.__setattr__(self, '_unsigned', None)
+            object.__setattr__(self, '_txid', None)
+        object.__setattr__(self, name, value)
+
+    def serialize_unsigned(self) -> bytes:
+        """
+        Canonical compact encoding of the fields covered by the txid. Computed
+        once and cached until one of those fields changes.
+        """
+        if self._unsigned is None:
+            parts = [
+                TX_PREFIX.pack(self.version),
+                encode_bytes(self.sender.encode('utf-8')),
+                encode_bytes(self.receiver.encode('utf-8')),
+                TX_AMOUNTS.pack(to_satoshis(self.amount), to_satoshis(self.fee), self.timestamp),
+            ]
+            if self.version >= 2:
+                parts.append(TX_CHANGE.pack(to_satoshis(self.change)))
+                parts.append(encode_varint(len(self.inputs)))
+                parts.extend(OUTPOINT.pack(bytes.fromhex(txid), index) for txid, index in self.inputs)
+            self._unsigned = b''.join(parts)
+        return self._unsigned
+
+    def _witness_bytes(self):
+        return encode_bytes((self.signature or '').encode('utf-8')) + encode_bytes(self.public_key or b'')
+
+    def serialize(self) -> bytes:
+        """Wire and disk encoding: the unsigned encoding followed by the signature and public key."""
+        return self.serialize_unsigned() + self._witness_bytes()
+
+    @classmethod
+    def deserialize(cls, view, offset=0):
+        """
+        Parse a transaction from a bytes-like object at offset without copying
+        the buffer. Returns (transaction, offset just past it).
+        """
+        view = memoryview(view)
+        start = offset
+        (version,), offset = read_struct(TX_PREFIX, view, offset)
+        if not 1 <= version <= TX_VERSION:
+            raise SerializationError(f"unsupported transaction version {version}")
+        sender, offset = read_string(view, offset)
+        receiver, offset = read_string(view, offset)
+        (amount, fee, timestamp), offset = read_struct(TX_AMOUNTS, view, offset)
+        change = 0
+        inputs = []
+        if version >= 2:
+            (change,), offset = read_struct(TX_CHANGE, view, offset)
+            count, offset = read_varint(view, offset)
+            for _ in range(count):
+                (txid, index), offset = read_struct(OUTPOINT, view, offset)
+                inputs.append((txid.hex(), index))
+        unsigned_end = offset
+        signature, offset = read_string(view, offset)
+        public_key, offset = read_bytes(view, offset)
+
+        # Fill the slots directly: nothing needs re-encoding or invalidating here.
+        tx = cls.__new__(cls)
+        init = object.__setattr__
+        init(tx, 'version', version)
+        init(tx, 'sender', sender)
+        init(tx, 'receiver', receiver)
+        init(tx, 'amount', amount / COIN)
+        init(tx, 'fee', fee / COIN)
+        init(tx, 'timestamp', timestamp)
+        init(tx, 'inputs', inputs)
+        init(tx, 'change', change / COIN)
+        init(tx, 'signature', signature or None)
+        init(tx, 'public_key', bytes(public_key) or None)
+        # Keep the exact bytes the txid is computed from; the id itself is hashed on first use.
+        init(tx, '_unsigned', bytes(view[start:unsigned_end]))
+        init(tx, '_txid', None)
+        return tx, offset
+
+    @property
+    def txid(self):
+        """
+        Content-addressed transaction id: double SHA-256 of the unsigned
+        encoding. The signature is not covered, so signing keeps the id.
+        """
+        if self._txid is None:
+            self._txid = double_sha256(self.serialize_unsigned()).hex()
+        return self._txid
 
     def generate_txid(self):
-        """Generate a unique transaction ID based on transaction data."""
-        tx_string = f"{uuid.uuid4()}"
-        return hashlib.sha256(tx_string.encode('utf-8')).hexdigest()
+        """Generate the transaction ID from the transaction data."""
+        return double_sha256(self.serialize_unsigned()).hex()
+
+    def signature_hash(self):
+        """The message a signature commits to: the txid."""
+        return self.txid
+
+    @property
+    def wtxid(self):
+        """Hash of the transaction including its signature and public key."""
+        return double_sha256(self.serialize()).hex()
 
     def sign_transaction(self, private_key):
-        """Sign the transaction using the sender's private key."""
+        """Sign the transaction using the sender's private key (key object or PEM bytes)."""
         if not private_key:
             raise ValueError("Private key is required to sign the transaction")
-        # Placeholder for signing logic
-        self.signature = f"signed({self.txid})"
+        self.signature = sign_data(private_key, self.signature_hash())
+        self.public_key = public_key_bytes(private_key)
+
+    def verify_signature(self, cache=signature_cache):
+        """
+        Check the signature against the public key, and the public key against the
+        sender address. Valid signatures are remembered in cache.
+        """
+        if not self.signature or not self.public_key:
+            return False
+        message = self.signature_hash()
+        # Only signatures whose key matched the sender are cached, and the txid commits to the sender.
+        if cache.contains(self.public_key, message, self.signature):
+            return True
+        if generate_address(self.public_key) != self.sender:
+            return False
+        if not verify_signature(self.public_key, message, self.signature):
+            return False
+        cache.add(self.public_key, message, self.signature)
+        return True
+
+    def size(self):
+        """Size of the serialized transaction in bytes, signature included."""
+        return len(self.serialize_unsigned()) + len(self._witness_bytes())
+
+    def fee_rate(self):
+        """Fee paid per byte of transaction data."""
+        return self.fee / self.size()
+
+    def is_coinbase(self):
+        return self.sender == COINBASE
+
+    def outputs(self):
+        """The outputs created, as (address, value in satoshis), by output index."""
+        outputs = [(self.receiver, to_satoshis(self.amount))]
+        if self.change:
+            outputs.append((self.sender, to_satoshis(self.change)))
+        return outputs
 
     def is_valid(self):
         """Check if the transaction is valid."""
         if self.amount <= 0:
             return False
-        if not self.signature:
-            return False
-        # Add more checks like signature verification if implemented
-        return True
+        return self.verify_signature()
 
     def __repr__(self):
         return (
@@ -40,39 +228,224 @@ class CTransaction:
         )
 
 class TransactionPool:
-    def __init__(self):
-        self.transactions: List[CTransaction] = []
+    """
+    Pending transactions indexed by txid and ordered by fee rate.
+
+    Two heaps reference the pool entries: a max-heap on fee rate for building
+    block templates best-first, and a min-heap for evicting the cheapest
+    transactions once the pool grows past max_size bytes. Removed transactions
+    are left in the heaps and skipped lazily; the heaps are rebuilt once stale
+    entries outnumber live ones.
+
+    The outputs spent by pooled transactions are indexed too, so a second
+    transaction spending the same output is refused instead of ending up in
+    the same block template.
+    """
+    def __init__(self, max_size: int = DEFAULT_MEMPOOL_SIZE, utxo_set=None):
+        """
+        :param max_size: Memory cap in bytes of transaction data; the lowest fee-rate transactions are evicted above it.
+        :param utxo_set: UTXOSet the inputs of new transactions must be unspent in. Without one, inputs are not checked.
+        """
+        self.transactions: Dict[str, CTransaction] = {}
+        self.utxo_set = utxo_set
+        self.spends: Dict[Tuple[str, int], str] = {}  # outpoint -> txid of the pooled transaction spending it
+        self.max_size = max_size
+        self.size = 0
+        self._entries: Dict[str, Tuple[int, int]] = {}  # txid -> (sequence, size)
+        self._best_first = []   # (-fee rate, sequence, txid)
+        self._worst_first = []  # (fee rate, sequence, txid)
+        self._counter = itertools.count()
+        # The network thread adds transactions while the miner selects them.
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, txid):
+        return txid in self.transactions
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def _is_live(self, entry):
+        live = self._entries.get(entry[2])
+        return live is not None and live[0] == entry[1]
 
     def add_transaction(self, transaction: CTransaction):
-        """Add a transaction to the pool after validation."""
-        if transaction.is_valid():
-            self.transactions.append(transaction)
-        else:
+        """
+        Add a transaction to the pool after validation.
+
+        :return: False if the transaction was already in the pool or was evicted right away for paying too little.
+        """
+        if not transaction.is_valid():
             raise ValueError("Invalid transaction")
+        with self.lock:
+            if transaction.txid in self.transactions:
+                return False
+            if any(outpoint in self.spends for outpoint in transaction.inputs):
+                raise ValueError("Transaction spends an output already spent by a pooled transaction")
+            if self.utxo_set is not None:
+                self._check_inputs(transaction)
+
+            sequence = next(self._counter)
+            size = transaction.size()
+            fee_rate = transaction.fee / size
+            self.transactions[transaction.txid] = transaction
+            for outpoint in transaction.inputs:
+                self.spends[outpoint] = transaction.txid
+            self._entries[transaction.txid] = (sequence, size)
+            self.size += size
+            heapq.heappush(self._best_first, (-fee_rate, sequence, transaction.txid))
+            heapq.heappush(self._worst_first, (fee_rate, sequence, transaction.txid))
+
+            self._evict()
+            return transaction.txid in self.transactions
+
+    def _evict(self):
+        while self.size > self.max_size and self._worst_first:
+            entry = heapq.heappop(self._worst_first)
+            if self._is_live(entry):
+                self._discard(entry[2])
+
+    def _check_inputs(self, transaction):
+        """Check the inputs of a transaction against the confirmed outputs of the UTXO set."""
+        if not transaction.inputs:
+            raise ValueError("Transaction spends nothing")
+        total = 0
+        for txid, index in transaction.inputs:
+            coin = self.utxo_set.get(txid, index)
+            if coin is None:
+                raise ValueError(f"Transaction spends missing output {txid}:{index}")
+            if coin.address != transaction.sender:
+                raise ValueError("Transaction spends an output of another address")
+            total += coin.value
+        paid = to_satoshis(transaction.amount) + to_satoshis(transaction.change) + to_satoshis(transaction.fee)
+        if total != paid or transaction.change < 0 or transaction.fee < 0:
+            raise ValueError("Transaction inputs and outputs do not add up")
+
+    def _discard(self, txid):
+        transaction = self.transactions.pop(txid, None)
+        if transaction is None:
+            return False
+        for outpoint in transaction.inputs:
+            if self.spends.get(outpoint) == txid:
+                del self.spends[outpoint]
+        self.size -= self._entries.pop(txid)[1]
+        return True
+
+    def _compact(self):
+        if len(self._best_first) + len(self._worst_first) <= 4 * len(self.transactions) + 64:
+            return
+        self._best_first = [entry for entry in self._best_first if self._is_live(entry)]
+        self._worst_first = [entry for entry in self._worst_first if self._is_live(entry)]
+        heapq.heapify(self._best_first)
+        heapq.heapify(self._worst_first)
 
     def remove_transaction(self, txid: str):
         """Remove a transaction from the pool by its transaction ID."""
-        self.transactions = [tx for tx in self.transactions if tx.txid != txid]
+        with self.lock:
+            self._discard(txid)
+            self._compact()
+
+    def remove_transactions(self, txids: Iterable[str]):
+        """Remove a batch of transactions, e.g. all those confirmed by a block."""
+        with self.lock:
+            removed = sum(1 for txid in txids if self._discard(txid))
+            self._compact()
+            return removed
+
+    def remove_block(self, block):
+        """
+        Remove every transaction confirmed by block, and those spending an
+        output the block spent: they can no longer be confirmed.
+        """
+        with self.lock:
+            conflicts = [self.spends[outpoint] for tx in block.transactions for outpoint in tx.inputs
+                         if outpoint in self.spends]
+            return self.remove_transactions([tx.txid for tx in block.transactions] + conflicts)
+
+    def revalidate(self):
+        """
+        Check every pooled transaction against the UTXO set again and remove
+        those that no longer pass, e.g. after a reorganization took off the
+        active chain the outputs they spend.
+
+        :return: The number of transactions removed.
+        """
+        if self.utxo_set is None:
+            return 0
+        with self.lock:
+            invalid = []
+            for transaction in self.transactions.values():
+                try:
+                    self._check_inputs(transaction)
+                except ValueError:
+                    invalid.append(transaction.txid)
+            return self.remove_transactions(invalid)
+
+    def iter_by_fee_rate(self) -> Iterator[CTransaction]:
+        """
+        Yield the pooled transactions from the highest fee rate down.
+
+        Walks the max-heap in order without popping it: taking the first k
+        transactions costs O(k log k) however large the pool is. The pool must
+        not be modified while iterating.
+        """
+        heap = self._best_first
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            entry, position = heapq.heappop(frontier)
+            if self._is_live(entry):
+                yield self.transactions[entry[2]]
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def select(self, max_count=None, max_size=None) -> List[CTransaction]:
+        """
+        Pick the highest fee-rate transactions for a block template.
+
+        :param max_count: Maximum number of transactions to return.
+        :param max_size: Maximum total size in bytes of the returned transactions.
+        """
+        selected = []
+        total_size = 0
+        misses = 0
+        with self.lock:
+            for transaction in self.iter_by_fee_rate():
+                if max_count is not None and len(selected) >= max_count:
+                    break
+                size = self._entries[transaction.txid][1]
+                if max_size is not None and total_size + size > max_size:
+                    # The template is about full: give up after a run of transactions that do not fit.
+                    misses += 1
+                    if misses >= MAX_SELECT_MISSES:
+                        break
+                    continue
+                selected.append(transaction)
+                total_size += size
+        return selected
 
     def get_transactions(self):
         """Return all transactions in the pool."""
-        return self.transactions
+        return list(self.transactions.values())
 
 # Example Usage
 if __name__ == "__main__":
     transaction_pool = TransactionPool()
 
-    # Create a transaction
+    # Create a transaction from a fresh key
+    private_key, public_key = generate_private_key()
     tx1 = CTransaction(
-        sender="1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa",
+        sender=generate_address(public_key),
         receiver="1BoatSLRHtKNngkdXEeobR76b53LETtpyT",
         amount=0.5,
         fee=0.0001,
         timestamp=1234567890
     )
 
-    # Sign the transaction (placeholder logic)
-    tx1.sign_transaction(private_key="example_private_key")
+    # Sign the transaction
+    tx1.sign_transaction(private_key)
 
     # Add the transaction to the pool
     transaction_pool.add_transaction(tx1)
@@ -0,0 +1,260 @@
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+from itertools import islice
+from bitcoin.core.consensus import BLOCK_REWARD
+from bitcoin.core.serialize import encode_bytes, encode_varint, read_string, read_struct, read_varint
+from bitcoin.core.transaction import NULL_TXID, OUTPOINT, to_satoshis
+
+# Coins kept in memory before the cache is flushed and trimmed.
+DEFAULT_CACHE_SIZE = 1_000_000
+# value in satoshis, height, coinbase flag
+COIN_FIELDS = struct.Struct('<qIB')
+
+# An unspent output: who it pays, how much, and the block that created it.
+Coin = namedtuple('Coin', 'address value height coinbase')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS coins (outpoint BLOB PRIMARY KEY, address TEXT, value INTEGER, height INTEGER,
+                                  coinbase INTEGER) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS undo (block_hash TEXT PRIMARY KEY, data BLOB) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+def outpoint_key(txid, index):
+    """Database key of an output: the raw txid followed by the output index."""
+    return OUTPOINT.pack(bytes.fromhex(txid), index)
+
+
+def encode_undo(spent):
+    """Serialize the coins a block spent, as (outpoint key, Coin) pairs."""
+    parts = [encode_varint(len(spent))]
+    for key, coin in spent:
+        parts.append(key)
+        parts.append(encode_bytes(coin.address.encode('utf-8')))
+        parts.append(COIN_FIELDS.pack(coin.value, coin.height, coin.coinbase))
+    return b''.join(parts)
+
+
+def decode_undo(data):
+    view = memoryview(data)
+    count, offset = read_varint(view, 0)
+    spent = []
+    for _ in range(count):
+        key = bytes(view[offset:offset + OUTPOINT.size])
+        address, offset = read_string(view, offset + OUTPOINT.size)
+        (value, height, coinbase), offset = read_struct(COIN_FIELDS, view, offset)
+        spent.append((key, Coin(address, value, height, bool(coinbase))))
+    return spent
+
+
+class UTXOSet:
+    """
+    The unspent transaction outputs of the active chain, in a SQLite database
+    behind a write-back cache.
+
+    Connecting a block reads the coins it spends through the cache and only
+    changes the cache. Dirty coins are written in one transaction once the cache
+    holds more than cache_size coins, or on flush(). Coins created and spent
+    between two flushes never reach the database at all.
+
+    Each connected block leaves undo data (the coins it spent), so a
+    reorganization can disconnect it again. The database records the block its
+    contents match, written in the same transaction as the coins.
+    """
+    def __init__(self, path='chainstate.sqlite', cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param path: SQLite database file.
+        :param cache_size: Coins held in memory before dirty ones are flushed and the oldest dropped.
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'best_block'").fetchone()
+        self.best_block = row[0] if row else None
+        self.cache = {}  # outpoint key -> Coin, or None for a spent coin still to delete
+        self.dirty = set()
+        self.fresh = set()  # created since the last flush, so not in the database
+        self.undo = {}  # block hash -> undo data not flushed yet
+        self.undo_deleted = set()
+        self.hits = 0
+        self.misses = 0
+        # The chain connects blocks while the transaction pool looks coins up.
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        """Coins in the database; unflushed changes are not counted."""
+        return self.db.execute("SELECT COUNT(*) FROM coins").fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _fetch(self, key):
+        coin = self.cache.get(key, False)
+        if coin is not False:
+            self.hits += 1
+            return coin
+        self.misses += 1
+        row = self.db.execute("SELECT address, value, height, coinbase FROM coins WHERE outpoint = ?",
+                              (key,)).fetchone()
+        coin = Coin(row[0], row[1], row[2], bool(row[3])) if row else None
+        if coin is not None:
+            self.cache[key] = coin
+        return coin
+
+    def get(self, txid, index):
+        """The unspent output (txid, index), or None if it does not exist or was spent."""
+        with self.lock:
+            return self._fetch(outpoint_key(txid, index))
+
+    def _add(self, key, coin, fresh):
+        self.cache[key] = coin
+        self.dirty.add(key)
+        if fresh:
+            self.fresh.add(key)
+
+    def _remove(self, key):
+        if key in self.fresh:
+            # Never written: forget it instead of deleting it later.
+            self.fresh.discard(key)
+            self.dirty.discard(key)
+            del self.cache[key]
+        else:
+            self.cache[key] = None
+            self.dirty.add(key)
+
+    def connect_block(self, block, height):
+        """
+        Spend the inputs and add the outputs of every transaction of block.
+
+        Raises ValueError, leaving the set unchanged, if a transaction spends a
+        missing or already spent output or one that does not belong to its
+        sender, or if its values do not add up: inputs must equal outputs plus
+        fee, and the coinbase may pay at most the block reward plus the fees.
+        """
+        with self.lock:
+            created = {}  # outputs of this block: key -> Coin
+            spent = {}  # outputs this block spends: key -> Coin
+            fees = 0
+            reward = 0  # paid by the coinbase
+            for position, tx in enumerate(block.transactions):
+                txid = tx.txid
+                coinbase = tx.is_coinbase()
+                if coinbase != (position == 0):
+                    raise ValueError("The coinbase must be the first transaction, and only that one")
+                if coinbase:
+                    if tx.inputs and tx.inputs != [(NULL_TXID, height)]:
+                        raise ValueError("Coinbase does not commit to the block height")
+                    reward = sum(value for _, value in tx.outputs())
+                else:
+                    if tx.amount <= 0 or tx.change < 0 or tx.fee < 0:
+                        raise ValueError(f"Transaction {txid} has a negative value")
+                    if not tx.inputs:
+                        raise ValueError(f"Transaction {txid} spends nothing")
+                    total = 0
+                    for input_txid, index in tx.inputs:
+                        key = outpoint_key(input_txid, index)
+                        if key in spent:
+                            raise ValueError(f"Transaction {txid} double spends {input_txid}:{index}")
+                        coin = created.get(key) or self._fetch(key)
+                        if coin is None:
+                            raise ValueError(f"Transaction {txid} spends missing output {input_txid}:{index}")
+                        if coin.address != tx.sender:
+                            raise ValueError(f"Transaction {txid} spends an output of another address")
+                        spent[key] = coin
+                        total += coin.value
+                    fee = to_satoshis(tx.fee)
+                    paid = to_satoshis(tx.amount) + to_satoshis(tx.change) + fee
+                    if total != paid:
+                        raise ValueError(f"Transaction {txid} spends {total} but pays out {paid}")
+                    fees += fee
+                raw_txid = bytes.fromhex(txid)
+                for index, (address, value) in enumerate(tx.outputs()):
+                    key = OUTPOINT.pack(raw_txid, index)
+                    if key in created or (not tx.inputs and self._fetch(key) is not None):
+                        raise ValueError(f"Transaction {txid} already exists")
+                    created[key] = Coin(address, value, height, coinbase)
+            if reward > to_satoshis(BLOCK_REWARD) + fees:
+                raise ValueError(f"Coinbase pays {reward}, more than the block reward and fees of "
+                                 f"{to_satoshis(BLOCK_REWARD) + fees}")
+            # Valid: apply it to the cache.
+            undo = []
+            for key, coin in spent.items():
+                if key in created:
+                    del created[key]
+                else:
+                    undo.append((key, coin))
+                    self._remove(key)
+            for key, coin in created.items():
+                self._add(key, coin, fresh=True)
+            self.undo[block.hash] = encode_undo(undo)
+            self.undo_deleted.discard(block.hash)
+            self.best_block = block.hash
+            if len(self.cache) > self.cache_size:
+                self.flush()
+
+    def disconnect_block(self, block):
+        """
+        Undo connect_block(block) for the block at the tip of the set: remove its
+        outputs and restore the coins it spent.
+        """
+        with self.lock:
+            if block.hash != self.best_block:
+                raise ValueError("Only the last connected block can be disconnected")
+            data = self.undo.pop(block.hash, None)
+            if data is None:
+                row = self.db.execute("SELECT data FROM undo WHERE block_hash = ?", (block.hash,)).fetchone()
+                if row is None:
+                    raise ValueError(f"No undo data for block {block.hash}")
+                data = row[0]
+            for tx in reversed(block.transactions):
+                for index in range(len(tx.outputs())):
+                    self._remove(outpoint_key(tx.txid, index))
+            for key, coin in decode_undo(data):
+                self._add(key, coin, fresh=False)
+            self.undo_deleted.add(block.hash)
+            self.best_block = block.prev_hash
+            if len(self.cache) > self.cache_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the dirty coins, undo data and best block in one transaction,
+        then trim the cache to half its size, oldest coins first.
+        """
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO coins VALUES (?, ?, ?, ?, ?)",
+                    ((key, *coin) for key in self.dirty if (coin := self.cache[key]) is not None))
+                self.db.executemany("DELETE FROM coins WHERE outpoint = ?",
+                                    ((key,) for key in self.dirty if self.cache[key] is None))
+                self.db.executemany("INSERT OR REPLACE INTO undo VALUES (?, ?)", self.undo.items())
+                self.db.executemany("DELETE FROM undo WHERE block_hash = ?", ((h,) for h in self.undo_deleted))
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('best_block', ?)", (self.best_block,))
+            for key in self.dirty:
+                if self.cache[key] is None:
+                    del self.cache[key]
+            self.dirty.clear()
+            self.fresh.clear()
+            self.undo.clear()
+            self.undo_deleted.clear()
+            if len(self.cache) > self.cache_size // 2:
+                # Dicts keep insertion order: the first keys are the coins cached longest ago.
+                excess = len(self.cache) - self.cache_size // 2
+                for key in list(islice(self.cache, excess)):
+                    del self.cache[key]
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from bitcoin.core.consensus import MAINNET, MAX_FUTURE_BLOCK_TIME
+from bitcoin.core.transaction import NULL_TXID
+from bitcoin.utils.utils import SignatureVerifier
+
+# Blocks whose stateless checks passed, remembered so that a block received
+# again (from another peer, or after a contextual rejection) is not re-verified.
+DEFAULT_VALIDATED_CACHE_SIZE = 1024
+# Stages of the validation of a block, in the order they run. The first ones
+# only look at the block itself ('cache' includes waiting for another thread
+# checking the same block); context, store and connect run under the chain lock.
+STAGES = ('cache', 'header', 'structure', 'syntax', 'signatures', 'context', 'store', 'connect')
+
+# Outcome of validating one block:
+#   cached: the stateless stages were skipped, the block having passed them before,
+#   timings: seconds spent in each stage that ran, by stage name (see STAGES),
+#   total: seconds from the start of the validation to the block being stored or connected.
+ValidationReport = namedtuple('ValidationReport', 'hash height cached timings total')
+
+
+def check_transaction(tx, height):
+    """
+    Context-free checks of a transaction of the block at height: fields and
+    values no valid transaction can have. Spends are checked against the UTXO
+    set, and signatures by a SignatureVerifier, separately.
+
+    :raises ValueError: For the first problem found.
+    """
+    txid = tx.txid
+    if not tx.sender or not tx.receiver:
+        raise ValueError(f"Transaction {txid} has no sender or receiver")
+    if tx.is_coinbase():
+        if tx.amount < 0 or tx.fee or tx.change:
+            raise ValueError(f"Coinbase {txid} has a fee, change or a negative amount")
+        if tx.inputs and tx.inputs != [(NULL_TXID, height)]:
+            raise ValueError("Coinbase does not commit to the block height")
+        return
+    if tx.amount <= 0 or tx.change < 0 or tx.fee < 0:
+        raise ValueError(f"Transaction {txid} has a negative value")
+    if len(set(tx.inputs)) != len(tx.inputs):
+        raise ValueError(f"Transaction {txid} spends an output twice")
+    if any(input_txid == NULL_TXID for input_txid, _ in tx.inputs):
+        raise ValueError(f"Transaction {txid} spends the null output")
+    if not tx.signature or not tx.public_key:
+        raise ValueError(f"Transaction {txid} is not signed")
+
+
+def check_transactions(block):
+    """Run check_transaction on every transaction of block. Returns the seconds it took."""
+    start = time.perf_counter()
+    for tx in block.transactions:
+        check_transaction(tx, block.index)
+    return time.perf_counter() - start
+
+
+def block_digest(block):
+    """
+    Digest of the block's transactions, signatures included. The block hash
+    only commits to the txids, which leave the signatures out: a cached hash
+    alone would let a peer resend a valid block with forged signatures.
+    """
+    return sha256(b''.join(tx.serialize() for tx in block.transactions)).digest()
+
+
+class BlockValidator:
+    """
+    The stateless stages of block validation: everything that can be checked
+    from the block alone, without the chain lock, so blocks arriving from
+    different peers are verified at the same time.
+
+      - header: the proof-of-work and the timestamp against the local clock,
+      - structure: coinbase position, duplicate transactions and merkle root,
+      - syntax: per-transaction field checks, on a thread,
+      - signatures: in the SignatureVerifier's process pool, meanwhile.
+
+    Blocks that pass are remembered in a bounded LRU cache, keyed by hash and
+    checked against block_digest(), and skip these stages when seen again.
+    The contextual stages (parent, height, target, median time, spends) are
+    left to Blockchain.add_block, which runs them in chain order.
+    """
+    def __init__(self, params=MAINNET, verifier=None, cache_size=DEFAULT_VALIDATED_CACHE_SIZE):
+        """
+        :param params: ConsensusParams the proof-of-work is checked against.
+        :param verifier: SignatureVerifier of the signature stage; verifies in-thread by default.
+        :param cache_size: Validated blocks remembered.
+        """
+        self.params = params
+        self.verifier = verifier or SignatureVerifier(workers=1)
+        self.cache_size = cache_size
+        self._validated = OrderedDict()  # block hash -> block_digest
+        self._pending = {}  # (block hash, block_digest) -> Event set once its check is over
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _threads(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='block-syntax')
+        return self._executor
+
+    def is_validated(self, block, digest=None):
+        """Whether block, with these very transactions, passed check_block() already."""
+        digest = digest or block_digest(block)
+        with self._lock:
+            return self._lookup(block.hash, digest)
+
+    def _lookup(self, block_hash, digest):
+        if self._validated.get(block_hash) != digest:
+            return False
+        self._validated.move_to_end(block_hash)
+        return True
+
+    def _remember(self, block_hash, digest):
+        with self._lock:
+            self._validated[block_hash] = digest
+            self._validated.move_to_end(block_hash)
+            while len(self._validated) > self.cache_size:
+                self._validated.popitem(last=False)
+
+    def check_block(self, block):
+        """
+        Run the stateless stages on block, unless it passed them before. When
+        another thread is checking the same block, e.g. received from a second
+        peer meanwhile, wait for its outcome instead of verifying it twice.
+
+        :return: ValidationReport with the timing of each stage run; total is left for the caller.
+        :raises ValueError: When the block is invalid, naming the check that failed.
+        """
+        timings = {}
+        start = time.perf_counter()
+        digest = block_digest(block)
+        key = (block.hash, digest)
+        owner = False
+        with self._lock:
+            cached = self._lookup(block.hash, digest)
+            pending = self._pending.get(key) if not cached else None
+            if not cached and pending is None:
+                self._pending[key] = threading.Event()
+                owner = True
+        if pending is not None:
+            pending.wait()
+            # Checked again here if it failed, to raise the reason.
+            cached = self.is_validated(block, digest)
+        timings['cache'] = time.perf_counter() - start
+        if cached:
+            return ValidationReport(block.hash, block.index, True, timings, None)
+        try:
+            return self._check_stateless(block, digest, timings)
+        finally:
+            if owner:
+                with self._lock:
+                    self._pending.pop(key).set()
+
+    def _check_stateless(self, block, digest, timings):
+        start = time.perf_counter()
+        if not block.is_valid(self.params):
+            raise ValueError("Invalid block hash")
+        if block.timestamp > time.time() + MAX_FUTURE_BLOCK_TIME:
+            raise ValueError("Block timestamp too far in the future")
+        timings['header'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        transactions = block.transactions
+        if any(tx.is_coinbase() != (position == 0) for position, tx in enumerate(transactions)):
+            raise ValueError("The coinbase must be the first transaction, and only that one")
+        if len({tx.txid for tx in transactions}) != len(transactions):
+            raise ValueError("Block contains a transaction twice")
+        if block.calculate_merkle_root() != block.merkle_root:
+            raise ValueError("Invalid merkle root")
+        timings['structure'] = time.perf_counter() - start
+
+        # The syntax checks are cheap next to the signatures: they run on a
+        # thread while this one waits for the verifier's worker processes.
+        syntax = self._threads().submit(check_transactions, block)
+        start = time.perf_counter()
+        signatures_valid = self.verifier.verify_transactions(transactions)
+        timings['signatures'] = time.perf_counter() - start
+        timings['syntax'] = syntax.result()
+        if not signatures_valid:
+            raise ValueError("Invalid transaction signature")
+
+        self._remember(block.hash, digest)
+        return ValidationReport(block.hash, block.index, False, timings, None)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.verifier.close()
+
+
+def format_report(report):
+    """One line with the time of every stage of a ValidationReport, in milliseconds."""
+    stages = ", ".join(f"{stage} {report.timings[stage] * 1000:.2f}" for stage in STAGES if stage in report.timings)
+    cached = " (cached)" if report.cached else ""
+    total = f"{report.total * 1000:.2f} ms" if report.total is not None else "-"
+    return f"Block {report.hash[:16]} at height {report.height} validated in {total}{cached}: {stages}"
+
+
+# Example Usage
+if __name__ == "__main__":
+    from bitcoin.core.blockchain import CBlock
+    from bitcoin.core.consensus import REGTEST
+    from bitcoin.core.transaction import CTransaction
+    from bitcoin.utils.utils import generate_address, generate_private_key
+
+    private_key, public_key = generate_private_key()
+    sender = generate_address(public_key)
+    txs = [CTransaction.coinbase(sender, 50, 1, int(time.time()))]
+    for i in range(50):
+        tx = CTransaction(sender, f"receiver-{i}", 1.0, 0.0001, i)
+        tx.sign_transaction(private_key)
+        txs.append(tx)
+    block = CBlock(1, "00" * 32, txs, int(time.time()), 0, REGTEST.genesis_bits)
+    while not block.is_valid(REGTEST):
+        block.nonce += 1
+        block.hash = block.calculate_hash()
+
+    validator = BlockValidator(REGTEST)
+    report = validator.check_block(block)
+    print(format_report(report._replace(total=sum(report.timings.values()))))
+    # Received again, e.g. from a second peer: only the cache lookup runs.
+    report = validator.check_block(block)
+    print(format_report(report._replace(total=sum(report.timings.values()))))
+
+    # The same block with a forged signature is not taken from the cache.
+    forged, _ = CBlock.deserialize(block.serialize())
+    forged.transactions[1].signature = txs[2].signature
+    try:
+        validator.check_block(forged)
+    except ValueError as e:
+        print(f"Forged block rejected: {e}")
+    validator.close()
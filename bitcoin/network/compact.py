@@ -0,0 +1,264 @@
+import os
+from hashlib import blake2b, sha256
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.serialize import UINT64, SerializationError, encode_varint, read_struct, read_varint
+from bitcoin.core.transaction import CTransaction
+from bitcoin.network.protocol import HASH, HEADER_SIZE, ProtocolError
+
+# Bytes of a short transaction id. A 10,000-transaction block matched against a
+# 100,000-transaction pool has about a one in 280,000 chance of a collision; the
+# merkle root catches it and the whole block is fetched instead.
+SHORT_ID_SIZE = 6
+# Most transactions a compact block or a blocktxn message may list.
+MAX_BLOCK_TRANSACTIONS = 1_000_000
+
+
+def short_id_key(header, nonce):
+    """
+    Key of the short ids of one block, from its header and the sender's random
+    nonce: nobody can make two transactions collide in every block ahead of time.
+    """
+    return sha256(header + UINT64.pack(nonce)).digest()[:16]
+
+
+def short_id(key, txid):
+    """Short id of a transaction: its 32-byte txid hashed with the block's key."""
+    return blake2b(txid, digest_size=SHORT_ID_SIZE, key=key).digest()
+
+
+def _read_count(view, offset, item_size=1):
+    count, offset = read_varint(view, offset)
+    if count > MAX_BLOCK_TRANSACTIONS or offset + count * item_size > len(view):
+        raise ProtocolError(f"list of {count} items does not fit the message")
+    return count, offset
+
+
+def encode_indexes(indexes):
+    """Ascending transaction positions, each sent as its distance from the previous one."""
+    parts = [encode_varint(len(indexes))]
+    previous = -1
+    for index in indexes:
+        parts.append(encode_varint(index - previous - 1))
+        previous = index
+    return b''.join(parts)
+
+
+def read_indexes(view, offset):
+    """Read positions written by encode_indexes. Returns (list of positions, new offset)."""
+    count, offset = _read_count(view, offset)
+    indexes = []
+    previous = -1
+    for _ in range(count):
+        gap, offset = read_varint(view, offset)
+        previous += gap + 1
+        indexes.append(previous)
+    return indexes, offset
+
+
+class CompactBlock:
+    """
+    A block announced as its header and a short id per transaction, after the
+    cmpctblock message of BIP 152. Receivers already hold most of the
+    transactions in their pool: they rebuild the block from it and only fetch
+    the few they miss, instead of receiving every transaction again.
+
+    Transactions the receiver cannot have, the coinbase first, are sent whole
+    ("prefilled").
+    """
+    def __init__(self, header, height, nonce, short_ids, prefilled):
+        """
+        :param header: The 80-byte block header.
+        :param nonce: Random salt of the short ids, see short_id_key.
+        :param short_ids: Short ids of the transactions not prefilled, in block order.
+        :param prefilled: List of (position in the block, CTransaction), ascending.
+        """
+        self.header = header
+        self.height = height
+        self.nonce = nonce
+        self.short_ids = short_ids
+        self.prefilled = prefilled
+        self.hash = sha256(header).hexdigest()
+
+    @property
+    def transaction_count(self):
+        return len(self.short_ids) + len(self.prefilled)
+
+    @classmethod
+    def from_block(cls, block, nonce=None):
+        nonce = nonce if nonce is not None else int.from_bytes(os.urandom(8), 'little')
+        header = block.serialize_header()
+        key = short_id_key(header, nonce)
+        ids = [short_id(key, bytes.fromhex(tx.txid)) for tx in block.transactions[1:]]
+        prefilled = [(0, block.transactions[0])] if block.transactions else []
+        return cls(header, block.index, nonce, ids, prefilled)
+
+    def serialize(self):
+        """
+        Payload of cmpctblock: the header, the height, the nonce, the short ids,
+        then the prefilled transactions with their positions.
+        """
+        parts = [self.header, encode_varint(self.height), UINT64.pack(self.nonce),
+                 encode_varint(len(self.short_ids)), b''.join(self.short_ids),
+                 encode_indexes([index for index, _ in self.prefilled])]
+        parts.extend(tx.serialize() for _, tx in self.prefilled)
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, payload):
+        view = memoryview(payload)
+        try:
+            header = bytes(view[:HEADER_SIZE])
+            if len(header) != HEADER_SIZE:
+                raise SerializationError("unexpected end of data")
+            height, offset = read_varint(view, HEADER_SIZE)
+            (nonce,), offset = read_struct(UINT64, view, offset)
+            count, offset = _read_count(view, offset, SHORT_ID_SIZE)
+            end = offset + count * SHORT_ID_SIZE
+            ids = [bytes(view[start:start + SHORT_ID_SIZE]) for start in range(offset, end, SHORT_ID_SIZE)]
+            indexes, offset = read_indexes(view, end)
+            prefilled = []
+            for index in indexes:
+                tx, offset = CTransaction.deserialize(view, offset)
+                prefilled.append((index, tx))
+        except SerializationError as e:
+            raise ProtocolError(f"bad compact block: {e}") from None
+        if offset != len(view):
+            raise ProtocolError("compact block has trailing data")
+        compact = cls(header, height, nonce, ids, prefilled)
+        if indexes and indexes[-1] >= compact.transaction_count:
+            raise ProtocolError("prefilled transaction past the end of the block")
+        return compact
+
+    def header_block(self):
+        """The block without its transactions, to check its link and proof-of-work before rebuilding it."""
+        try:
+            return CBlock.deserialize_header(self.header, index=self.height)[0]
+        except SerializationError as e:
+            raise ProtocolError(f"bad compact block: {e}") from None
+
+
+class PartialBlock:
+    """
+    A compact block being rebuilt: the transactions found so far, by position.
+    """
+    def __init__(self, compact):
+        self.compact = compact
+        self.transactions = [None] * compact.transaction_count
+        for index, tx in compact.prefilled:
+            self.transactions[index] = tx
+        self._positions = [index for index, tx in enumerate(self.transactions) if tx is None]
+
+    def fill_from(self, transactions):
+        """
+        Place the transactions whose short id the block lists, typically the
+        whole pool. A short id matched by two of them is left for the sender
+        to fill in. Returns the positions still missing.
+        """
+        key = short_id_key(self.compact.header, self.compact.nonce)
+        wanted = dict(zip(self.compact.short_ids, self._positions))
+        if len(wanted) != len(self._positions):
+            # Two transactions of the block share a short id: no pool lookup can tell them apart.
+            return self.missing
+        ambiguous = set()
+        for tx in transactions:
+            position = wanted.get(short_id(key, bytes.fromhex(tx.txid)))
+            if position is None:
+                continue
+            if self.transactions[position] is not None:
+                ambiguous.add(position)
+            self.transactions[position] = tx
+        for position in ambiguous:
+            self.transactions[position] = None
+        return self.missing
+
+    @property
+    def missing(self):
+        return [index for index, tx in enumerate(self.transactions) if tx is None]
+
+    def fill(self, indexes, transactions):
+        """
+        Place the transactions a blocktxn reply sent for the given positions.
+
+        :raises ProtocolError: When the reply does not answer the request.
+        """
+        if len(indexes) != len(transactions):
+            raise ProtocolError("blocktxn does not match the transactions requested")
+        for index, tx in zip(indexes, transactions):
+            self.transactions[index] = tx
+
+    def block(self):
+        """
+        The rebuilt block, or None when its transactions do not match the
+        header's merkle root (a short id collision): the block must then be
+        fetched whole.
+        """
+        block = self.compact.header_block()
+        block.transactions = list(self.transactions)
+        if None in block.transactions or block.calculate_merkle_root() != block.merkle_root:
+            return None
+        return block
+
+
+def encode_getblocktxn(block_hash, indexes):
+    """Payload of getblocktxn: the block hash and the positions of the transactions wanted."""
+    return block_hash + encode_indexes(indexes)
+
+
+def decode_getblocktxn(payload):
+    """Parse a getblocktxn payload into (block hash, positions)."""
+    view = memoryview(payload)
+    try:
+        (block_hash,), offset = read_struct(HASH, view, 0)
+        indexes, offset = read_indexes(view, offset)
+    except SerializationError as e:
+        raise ProtocolError(f"bad getblocktxn: {e}") from None
+    return block_hash, indexes
+
+
+def encode_blocktxn(block_hash, transactions):
+    """Payload of blocktxn: the block hash and the transactions asked for, in the order asked."""
+    return b''.join([block_hash, encode_varint(len(transactions))] + [tx.serialize() for tx in transactions])
+
+
+def decode_blocktxn(payload):
+    """Parse a blocktxn payload into (block hash, list of CTransaction)."""
+    view = memoryview(payload)
+    try:
+        (block_hash,), offset = read_struct(HASH, view, 0)
+        count, offset = _read_count(view, offset)
+        transactions = []
+        for _ in range(count):
+            tx, offset = CTransaction.deserialize(view, offset)
+            transactions.append(tx)
+    except SerializationError as e:
+        raise ProtocolError(f"bad blocktxn: {e}") from None
+    return block_hash, transactions
+
+
+# Example Usage
+if __name__ == "__main__":
+    from bitcoin.core.consensus import REGTEST
+    from bitcoin.core.transaction import COINBASE
+    from bitcoin.utils.utils import generate_address, generate_private_key
+
+    private_key, public_key = generate_private_key()
+    sender = generate_address(public_key)
+    txs = [CTransaction(COINBASE, sender, 50, 0, 1)]
+    for i in range(100):
+        tx = CTransaction(sender, f"receiver-{i}", 1.0, 0.0001, i)
+        tx.sign_transaction(private_key)
+        txs.append(tx)
+    block = CBlock(1, "00" * 32, txs, 1234567890, 0, REGTEST.genesis_bits)
+
+    payload = CompactBlock.from_block(block).serialize()
+    print(f"Full block: {len(block.serialize()):,} bytes, compact block: {len(payload):,} bytes")
+
+    # The receiver's pool lacks three of the transactions: it asks for those alone.
+    partial = PartialBlock(CompactBlock.deserialize(payload))
+    missing = partial.fill_from(tx for tx in txs[1:] if tx not in txs[10:13])
+    print(f"Missing after the pool lookup: {missing}")
+    block_hash, indexes = decode_getblocktxn(encode_getblocktxn(bytes.fromhex(block.hash), missing))
+    _, sent = decode_blocktxn(encode_blocktxn(block_hash, [block.transactions[i] for i in indexes]))
+    partial.fill(indexes, sent)
+    rebuilt = partial.block()
+    print(f"Rebuilt block matches: {rebuilt is not None and rebuilt.serialize() == block.serialize()}")
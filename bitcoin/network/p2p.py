@@ -1,21 +1,198 @@
-import socket
+import asyncio
+import logging
 import threading
 import requests
 import time
-from bitcoin.core.blockchain import Blockchain
+from collections import OrderedDict
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.serialize import SerializationError
+from bitcoin.core.transaction import CTransaction, TransactionPool
+from bitcoin.network.compact import (
+    CompactBlock, PartialBlock, decode_blocktxn, decode_getblocktxn, encode_blocktxn, encode_getblocktxn,
+)
+from bitcoin.network.protocol import (
+    INV_BLOCK, INV_COMPACT_BLOCK, INV_TX, MAX_HEADERS, MESSAGE_HEADER, ProtocolError, decode_getheaders, decode_inventory,
+    encode_headers, encode_inventory, encode_message, read_message,
+)
+from bitcoin.network.sync import InitialBlockDownload
+from bitcoin.utils.metrics import metrics, profiler
+from bitcoin.utils.utils import RollingBloomFilter
+
+logger = logging.getLogger(__name__)
+
+# Framed messages a peer may have queued before senders have to wait.
+SEND_QUEUE_SIZE = 256
+# Seconds a broadcast waits for room in a peer's send queue before dropping the peer.
+SEND_TIMEOUT = 10
+CONNECT_TIMEOUT = 10
+# Inventory hashes remembered per peer (known to the peer) and per node (already seen).
+PEER_KNOWN_INVENTORY = 5000
+SEEN_INVENTORY = 50_000
+# False positives of those filters: an object wrongly taken as known is not announced or fetched.
+INVENTORY_FP_RATE = 0.000001
+# Recently relayed objects kept serialized to answer getdata.
+RELAY_CACHE_SIZE = 1000
+# Seconds before an object requested from one peer may be requested from another.
+REQUEST_TIMEOUT = 30
+# Peers asked to push new blocks as cmpctblock, without an inv first (BIP 152 high-bandwidth mode).
+HIGH_BANDWIDTH_PEERS = 3
+# Recent blocks kept as cmpctblock payloads to answer getdata.
+COMPACT_CACHE_SIZE = 16
+
+BYTES_SENT = metrics.counter('p2p_bytes_sent_total', "Bytes sent to peers, message headers included")
+BYTES_RECEIVED = metrics.counter('p2p_bytes_received_total', "Bytes received from peers, message headers included")
+MESSAGE_SECONDS = metrics.histogram('p2p_message_seconds', "Time to handle a message received from a peer",
+                                    labels=('command',))
+PEERS_CONNECTED = metrics.counter('p2p_peers_connected_total', "Peer connections opened, inbound and outbound")
+BLOCKS_REJECTED = metrics.counter('p2p_blocks_rejected_total', "Blocks received from peers that failed validation")
+
+
+class Peer:
+    """
+    One connection to another node.
+
+    Outgoing messages go through a bounded queue drained by a writer task, so a
+    slow peer only ever holds up senders to that peer, never the whole node.
+    """
+    def __init__(self, node, reader, writer, outbound=False, send_queue_size=SEND_QUEUE_SIZE):
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.outbound = outbound
+        self.address = writer.get_extra_info('peername')
+        self.queue = asyncio.Queue(maxsize=send_queue_size)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Inventory this peer announced or was sent: never announce it to them again.
+        self.known_inventory = RollingBloomFilter(PEER_KNOWN_INVENTORY, INVENTORY_FP_RATE)
+        # Set by the peer's sendcmpct: it wants blocks as cmpctblock, pushed without an inv if compact_push.
+        self.compact = False
+        self.compact_push = False
+        self.pushes_compact = False  # whether we asked this peer to push us its new blocks
+        self.closed = False
+        self._tasks = []
+
+    def __repr__(self):
+        return f"Peer({self.address})"
+
+    def start(self):
+        self._tasks = [
+            asyncio.ensure_future(self._write_loop()),
+            asyncio.ensure_future(self._read_loop()),
+        ]
+
+    async def send(self, command, payload=b''):
+        """
+        Queue a message for this peer, waiting while its send queue is full.
+        """
+        if not self.closed:
+            await self.queue.put(encode_message(command, payload))
+
+    def send_nowait(self, command, payload=b''):
+        """
+        Queue a message without waiting. Returns False if the send queue is full.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(encode_message(command, payload))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                self.writer.write(data)
+                self.bytes_sent += len(data)
+                BYTES_SENT.inc(len(data))
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                command, payload = await read_message(self.reader)
+                size = MESSAGE_HEADER.size + len(payload)
+                self.bytes_received += size
+                BYTES_RECEIVED.inc(size)
+                await self.node.process_message(self, command, payload)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except (ProtocolError, SerializationError, ValueError) as e:
+            # A message that does not frame or decode, or that its handler rejected.
+            logger.warning("Dropping peer %s: %s", self.address, e)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self.writer.close()
+        self.node.remove_peer(self)
 
 
 class P2PNode:
-    def __init__(self, host="0.0.0.0", port=8333, bootstrap_ip="5.178.148.11", bootstrap_port=8333, blockchain=None):
+    """
+    Relays blocks and transactions by inventory: new objects are announced by
+    hash with inv, and a peer fetches the body with getdata only if it has not
+    seen it yet, from the first peer that announced it. Each body crosses each
+    node once instead of once per connection.
+
+    With compact_blocks, blocks go to peers that support them as cmpctblock
+    messages: the header and a short id per transaction. The receiver rebuilds
+    the block from its transaction pool and only asks for the transactions it
+    lacks (getblocktxn), so a block's transactions, already relayed on their
+    own, are not sent a second time. The first HIGH_BANDWIDTH_PEERS peers push
+    new blocks straight away; the others announce them with an inv first.
+    """
+    def __init__(self, host="0.0.0.0", port=8333, bootstrap_ip="5.178.148.11", bootstrap_port=8333, blockchain=None,
+                 send_queue_size=SEND_QUEUE_SIZE, transaction_pool=None, compact_blocks=True):
         self.host = host
         self.port = port
         self.bootstrap_ip = bootstrap_ip
         self.bootstrap_port = bootstrap_port
         self.blockchain = blockchain or Blockchain()
+        self.transaction_pool = transaction_pool if transaction_pool is not None else TransactionPool()
+        self.send_queue_size = send_queue_size
         self.peers = []
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.miner = None
+        self.loop = None
+        self.server = None
+        self._thread = None
+        self.seen_inventory = RollingBloomFilter(SEEN_INVENTORY, INVENTORY_FP_RATE)
+        self.relay_cache = OrderedDict()  # hash -> (command, payload)
+        self.in_flight = {}  # hash -> (peer, time requested)
+        self.compact_blocks = compact_blocks
+        self.compact_cache = OrderedDict()  # block hash -> cmpctblock payload
+        self.partial_blocks = {}  # block hash -> (peer, PartialBlock, positions requested or None)
+        self.sync = None  # the running InitialBlockDownload
+        self.handlers = {
+            'ping': self.handle_ping,
+            'pong': self.handle_pong,
+            'inv': self.handle_inv,
+            'getdata': self.handle_getdata,
+            'notfound': self.handle_notfound,
+            'block': self.handle_block,
+            'tx': self.handle_tx,
+            'getheaders': self.handle_getheaders,
+            'headers': self.handle_headers,
+            'sendcmpct': self.handle_sendcmpct,
+            'cmpctblock': self.handle_cmpctblock,
+            'getblocktxn': self.handle_getblocktxn,
+            'blocktxn': self.handle_blocktxn,
+        }
+        # Latency histogram of each handled command, looked up once rather than per message.
+        self._message_seconds = {command: MESSAGE_SECONDS.labels(command=command) for command in self.handlers}
+        self.blockchain.subscribe(self.on_block_added, self.on_block_removed)
 
     def set_miner(self, miner):
         """
@@ -29,108 +206,464 @@ class P2PNode:
         """
         try:
             public_ip = requests.get("https://api64.ipify.org").text
-            print(f"Public IP: {public_ip}")
+            logger.info("Public IP: %s", public_ip)
             return public_ip
         except Exception as e:
-            print(f"Error fetching public IP: {e}")
+            logger.warning("Error fetching public IP: %s", e)
             return None
 
-    def start_node(self):
+    def start_node(self, fetch_public_ip=True):
         """
-        Start the P2P node and attempt to connect to the bootstrap node.
+        Start the P2P node on its own event loop thread and attempt to connect to the bootstrap node.
         """
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            print(f"Node started at {self.host}:{self.port}")
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+            logger.info("Node started at %s:%s", self.host, self.port)
 
             # Get public IP
-            public_ip = self.get_public_ip()
-            if public_ip:
-                print(f"Publicly accessible at {public_ip}:{self.port}")
+            if fetch_public_ip:
+                public_ip = self.get_public_ip()
+                if public_ip:
+                    logger.info("Publicly accessible at %s:%s", public_ip, self.port)
 
-            # Try to connect to bootstrap node
+            # Try to connect to bootstrap node and catch up with its chain before mining
             if self.bootstrap_ip and self.bootstrap_port:
-                self.connect_to_peer(self.bootstrap_ip, self.bootstrap_port)
-
-            # Start listening for peers
-            threading.Thread(target=self.listen_for_peers, daemon=True).start()
+                peer = self.connect_to_peer(self.bootstrap_ip, self.bootstrap_port).result()
+                if peer:
+                    try:
+                        connected = self.start_sync(peer).result()
+                        logger.info("Initial block download: %d blocks", connected)
+                    except (TimeoutError, ConnectionError, ValueError) as e:
+                        logger.warning("Initial block download failed: %s", e or type(e).__name__)
 
             # Start mining if a miner is set
-            if self.miner:
-                threading.Thread(target=self.miner.start_mining, daemon=True).start()
+            if self.miner and not self.miner.is_mining:
+                self.miner.start_mining()
 
         except Exception as e:
-            print(f"Failed to start node: {e}")
+            logger.error("Failed to start node: %s", e)
+
+    def _run_loop(self):
+        # Everything on the loop thread is network handling: profile it as one hot path.
+        with profiler.section('p2p'):
+            self.loop.run_forever()
 
-    def listen_for_peers(self):
+    async def start(self):
         """
-        Listen for incoming connections from peers.
+        Start listening for peers on the running event loop.
         """
-        while True:
-            try:
-                client_socket, address = self.server_socket.accept()
-                print(f"Connected to peer: {address}")
-                self.peers.append(client_socket)
-                threading.Thread(target=self.handle_peer, args=(client_socket,)).start()
-            except Exception as e:
-                print(f"Error accepting connection: {e}")
+        self.server = await asyncio.start_server(self._accept_peer, self.host, self.port, backlog=1024)
+        # Port 0 asks the OS for a free port: report the one actually bound.
+        self.port = self.server.sockets[0].getsockname()[1]
 
-    def handle_peer(self, peer_socket):
+    def stop_node(self):
         """
-        Handle communication with a peer.
+        Disconnect every peer and stop the event loop thread.
         """
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        for peer in list(self.peers):
+            peer.close()
+        if self.server:
+            await self.server.wait_closed()
+
+    def _add_peer(self, reader, writer, outbound):
+        peer = Peer(self, reader, writer, outbound, self.send_queue_size)
+        self.peers.append(peer)
+        PEERS_CONNECTED.inc()
+        peer.start()
+        if self.compact_blocks:
+            peer.pushes_compact = sum(p.pushes_compact for p in self.peers) < HIGH_BANDWIDTH_PEERS
+            peer.send_nowait('sendcmpct', bytes([peer.pushes_compact]))
+        return peer
+
+    async def _accept_peer(self, reader, writer):
+        peer = self._add_peer(reader, writer, outbound=False)
+        logger.info("Connected to peer: %s", peer.address)
+
+    def remove_peer(self, peer):
+        if peer in self.peers:
+            self.peers.remove(peer)
+        # Let another announcer serve what this peer still owed us.
+        for key in [key for key, (owner, _) in self.in_flight.items() if owner is peer]:
+            del self.in_flight[key]
+        for key in [key for key, (owner, _, _) in self.partial_blocks.items() if owner is peer]:
+            del self.partial_blocks[key]
+
+    async def process_message(self, peer, command, payload):
+        """
+        Process a message received from a peer by dispatching it to the handler for its command.
+        """
+        handler = self.handlers.get(command)
+        if handler is None:
+            logger.debug("Ignoring unknown command %r from %s", command, peer.address)
+            return
+        start = time.perf_counter()
         try:
-            while True:
-                data = peer_socket.recv(1024)
-                if not data:
-                    break
-                message = data.decode()
-                print(f"Received from peer: {message}")
-                self.process_message(message)
-        except Exception as e:
-            print(f"Error handling peer: {e}")
+            await handler(peer, payload)
         finally:
-            peer_socket.close()
-            if peer_socket in self.peers:
-                self.peers.remove(peer_socket)
+            self._message_seconds[command].observe(time.perf_counter() - start)
+
+    async def handle_ping(self, peer, payload):
+        await peer.send('pong', payload)
+
+    async def handle_pong(self, peer, payload):
+        pass
+
+    def has_inventory(self, kind, key):
+        """
+        Whether the object was seen already: no need to fetch it again.
+        """
+        if key in self.seen_inventory or key in self.relay_cache:
+            return True
+        return kind == INV_TX and key.hex() in self.transaction_pool
+
+    async def handle_inv(self, peer, payload):
+        """
+        Request the announced objects we have not seen and nobody else is sending us.
+        """
+        now = time.monotonic()
+        wanted = []
+        for kind, key in decode_inventory(payload):
+            peer.known_inventory.add(key)
+            if kind not in (INV_BLOCK, INV_TX) or self.has_inventory(kind, key):
+                continue
+            request = self.in_flight.get(key)
+            if request is not None and now - request[1] < REQUEST_TIMEOUT:
+                continue
+            self.in_flight[key] = (peer, now)
+            if kind == INV_BLOCK and self.compact_blocks and peer.compact:
+                kind = INV_COMPACT_BLOCK
+            wanted.append((kind, key))
+        if wanted:
+            await peer.send('getdata', encode_inventory(wanted))
+
+    async def handle_getdata(self, peer, payload):
+        missing = []
+        for kind, key in decode_inventory(payload):
+            if kind == INV_COMPACT_BLOCK:
+                entry = self._compact_block_entry(key)
+            else:
+                entry = self.relay_cache.get(key)
+            if entry is None and kind == INV_TX:
+                tx = self.transaction_pool.transactions.get(key.hex())
+                entry = ('tx', tx.serialize()) if tx is not None else None
+            elif entry is None and kind == INV_BLOCK:
+                data = self.blockchain.get_block_data(key.hex())
+                entry = ('block', data) if data is not None else None
+            if entry is None:
+                missing.append((kind, key))
+            else:
+                peer.known_inventory.add(key)
+                await peer.send(*entry)
+        if missing:
+            await peer.send('notfound', encode_inventory(missing))
+
+    def _compact_block_entry(self, key):
+        payload = self.compact_cache.get(key)
+        if payload is None:
+            block = self.blockchain.get_block(key.hex())
+            if block is None:
+                return None
+            payload = CompactBlock.from_block(block).serialize()
+            self._remember_compact(key, payload)
+        return 'cmpctblock', payload
+
+    def _remember_compact(self, key, payload):
+        self.compact_cache[key] = payload
+        self.compact_cache.move_to_end(key)
+        if len(self.compact_cache) > COMPACT_CACHE_SIZE:
+            self.compact_cache.popitem(last=False)
+
+    async def handle_notfound(self, peer, payload):
+        for _, key in decode_inventory(payload):
+            if self.in_flight.get(key, (None,))[0] is peer:
+                del self.in_flight[key]
+            if self.partial_blocks.get(key, (None,))[0] is peer:
+                del self.partial_blocks[key]
 
-    def process_message(self, message):
+    async def handle_block(self, peer, payload):
+        try:
+            block, _ = CBlock.deserialize(memoryview(payload))
+        except SerializationError as e:
+            raise ProtocolError(f"bad block: {e}") from None
+        if self.sync is not None and self.sync.wants(block.hash):
+            self.sync.on_block(peer, block)
+            return
+        await self._accept_block(peer, block)
+
+    async def _accept_block(self, peer, block):
+        key = bytes.fromhex(block.hash)
+        peer.known_inventory.add(key)
+        self.in_flight.pop(key, None)
+        self.partial_blocks.pop(key, None)
+        if key in self.seen_inventory:
+            return
+        self.seen_inventory.add(key)
+        # Signature checks are slow: keep them off the event loop.
+        if block.prev_hash not in self.blockchain.index:
+            # The block builds on a branch we do not have: fetch it headers-first from this peer.
+            if self.sync is None or not self.sync.active:
+                asyncio.ensure_future(self._sync_from(peer))
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.blockchain.add_block, block)
+        except ValueError as e:
+            BLOCKS_REJECTED.inc()
+            logger.warning("Rejected block %s from %s: %s", block.hash, peer.address, e)
+
+    async def handle_sendcmpct(self, peer, payload):
+        peer.compact = True
+        peer.compact_push = payload[:1] == b'\x01'
+
+    async def handle_cmpctblock(self, peer, payload):
+        """
+        Rebuild an announced block from the transaction pool, and ask the peer
+        for the transactions the pool lacks.
+        """
+        compact = CompactBlock.deserialize(payload)
+        key = bytes.fromhex(compact.hash)
+        peer.known_inventory.add(key)
+        if key in self.seen_inventory or key in self.partial_blocks or compact.hash in self.blockchain.index:
+            return
+        header = compact.header_block()
+        if not header.is_valid(self.blockchain.params):
+            raise ProtocolError(f"compact block {compact.hash} has invalid proof-of-work")
+        if header.prev_hash not in self.blockchain.index:
+            self.seen_inventory.add(key)
+            if self.sync is None or not self.sync.active:
+                asyncio.ensure_future(self._sync_from(peer))
+            return
+        self.in_flight[key] = (peer, time.monotonic())
+        partial = PartialBlock(compact)
+        self.partial_blocks[key] = (peer, partial, None)
+        # Hashing the short id of every pooled transaction: keep it off the event loop.
+        missing = await asyncio.get_running_loop().run_in_executor(
+            None, partial.fill_from, list(self.transaction_pool))
+        if self.partial_blocks.get(key, (None,))[0] is not peer:
+            return  # the block arrived another way, or the peer left
+        if missing:
+            self.partial_blocks[key] = (peer, partial, missing)
+            await peer.send('getblocktxn', encode_getblocktxn(key, missing))
+        else:
+            del self.partial_blocks[key]
+            await self._complete_compact(peer, key, partial)
+
+    async def handle_getblocktxn(self, peer, payload):
+        block_hash, indexes = decode_getblocktxn(payload)
+        block = self.blockchain.get_block(block_hash.hex())
+        if block is None:
+            await peer.send('notfound', encode_inventory([(INV_BLOCK, block_hash)]))
+            return
+        if indexes and indexes[-1] >= len(block.transactions):
+            raise ProtocolError("getblocktxn asks for a transaction past the end of the block")
+        await peer.send('blocktxn', encode_blocktxn(block_hash, [block.transactions[i] for i in indexes]))
+
+    async def handle_blocktxn(self, peer, payload):
+        block_hash, transactions = decode_blocktxn(payload)
+        entry = self.partial_blocks.get(block_hash)
+        if entry is None or entry[0] is not peer or entry[2] is None:
+            return
+        del self.partial_blocks[block_hash]
+        _, partial, missing = entry
+        partial.fill(missing, transactions)
+        await self._complete_compact(peer, block_hash, partial)
+
+    async def _complete_compact(self, peer, key, partial):
+        block = await asyncio.get_running_loop().run_in_executor(None, partial.block)
+        if block is None:
+            # A short id collision put the wrong transaction in: fetch the whole block.
+            self.in_flight[key] = (peer, time.monotonic())
+            await peer.send('getdata', encode_inventory([(INV_BLOCK, key)]))
+            return
+        await self._accept_block(peer, block)
+
+    async def _sync_from(self, peer):
+        try:
+            await self.sync_blocks(peer)
+        except (asyncio.TimeoutError, ConnectionError, ValueError) as e:
+            logger.warning("Block download from %s failed: %s", peer.address, e)
+
+    async def handle_tx(self, peer, payload):
+        try:
+            tx, _ = CTransaction.deserialize(memoryview(payload))
+        except SerializationError as e:
+            raise ProtocolError(f"bad transaction: {e}") from None
+        key = bytes.fromhex(tx.txid)
+        peer.known_inventory.add(key)
+        self.in_flight.pop(key, None)
+        if self.has_inventory(INV_TX, key):
+            return
+        self.seen_inventory.add(key)
+        try:
+            added = await asyncio.get_running_loop().run_in_executor(None, self.transaction_pool.add_transaction, tx)
+        except ValueError:
+            return
+        if added:
+            await self.announce(INV_TX, key, 'tx', payload)
+
+    async def announce(self, kind, key, command, payload, compact=None):
+        """
+        Keep a new object ready for getdata and announce its hash to every peer not known to have it.
+
+        :param compact: cmpctblock payload of a block, pushed instead of the inv to peers that asked for it.
+        """
+        self.seen_inventory.add(key)
+        self.relay_cache[key] = (command, payload)
+        self.relay_cache.move_to_end(key)
+        if len(self.relay_cache) > RELAY_CACHE_SIZE:
+            self.relay_cache.popitem(last=False)
+        if compact is not None:
+            self._remember_compact(key, compact)
+        message = encode_inventory([(kind, key)])
+        for peer in list(self.peers):
+            if key not in peer.known_inventory:
+                peer.known_inventory.add(key)
+                if compact is not None and peer.compact_push:
+                    sent = peer.send_nowait('cmpctblock', compact)
+                else:
+                    sent = peer.send_nowait('inv', message)
+                if not sent:
+                    logger.warning("Error announcing to peer %s: send queue full", peer.address)
+
+    def on_block_added(self, block):
+        """
+        Blockchain listener: drop the confirmed transactions and relay the block,
+        whether it was mined here or received from a peer.
+        """
+        self.transaction_pool.remove_block(block)
+        # Peers already have the blocks an initial download fetches.
+        if self.loop and not (self.sync is not None and self.sync.active):
+            key = bytes.fromhex(block.hash)
+            payload = block.serialize()
+            compact = CompactBlock.from_block(block).serialize() if self.compact_blocks else None
+            self.loop.call_soon_threadsafe(
+                lambda: asyncio.ensure_future(self.announce(INV_BLOCK, key, 'block', payload, compact)))
+
+    async def handle_getheaders(self, peer, payload):
+        """
+        Reply with the headers following the first locator hash on our chain.
+        """
+        locator, stop = decode_getheaders(payload)
+        fork = next((height for height in map(self.blockchain.get_height, (h.hex() for h in locator))
+                     if height is not None), 0)
+        headers = []
+        stop_hash = stop.hex()
+        for height in range(fork + 1, min(fork + 1 + MAX_HEADERS, len(self.blockchain.chain))):
+            headers.append(self.blockchain.header_at(height))
+            if self.blockchain.hash_at(height) == stop_hash:
+                break
+        await peer.send('headers', encode_headers(headers))
+
+    async def handle_headers(self, peer, payload):
+        if self.sync is not None:
+            self.sync.on_headers(peer, payload)
+
+    async def sync_blocks(self, peer=None, **options):
         """
-        Process a message received from a peer.
+        Run a headers-first initial block download from the connected peers.
+        Returns the number of blocks connected.
+
+        :param options: Passed on to InitialBlockDownload (window, blocks_per_peer, max_peers).
         """
-        print(f"Processing message: {message}")
-        # Add logic for processing blockchain or mining-related messages
+        if self.sync is not None and self.sync.active:
+            raise RuntimeError("a block download is already running")
+        self.sync = InitialBlockDownload(self, **options)
+        return await self.sync.run(peer)
 
-    def broadcast(self, message, exclude=None):
+    def start_sync(self, peer=None, **options):
         """
-        Broadcast a message to all connected peers, except one.
+        Start an initial block download. Safe to call from any thread; returns a
+        concurrent.futures.Future of the number of blocks connected.
         """
-        for peer in self.peers:
-            if peer is not exclude:
+        return asyncio.run_coroutine_threadsafe(self.sync_blocks(peer, **options), self.loop)
+
+    def on_block_removed(self, block):
+        """
+        Blockchain listener: a reorganization took block off the active chain,
+        so its transactions are pending again, and the pooled transactions
+        spending the outputs it created can no longer be mined.
+        """
+        for tx in block.transactions:
+            if not tx.is_coinbase():
                 try:
-                    peer.sendall(message.encode())
-                except Exception as e:
-                    print(f"Error broadcasting to peer: {e}")
-                    if peer in self.peers:
-                        self.peers.remove(peer)
+                    self.transaction_pool.add_transaction(tx)
+                except ValueError:
+                    pass
+        self.transaction_pool.revalidate()
 
-    def connect_to_peer(self, ip, port):
+    def relay_transaction(self, transaction):
         """
-        Connect to a peer at a given IP and port.
+        Add a transaction to the pool and announce it to peers. Safe to call from any thread.
+        """
+        if self.transaction_pool.add_transaction(transaction) and self.loop:
+            key = bytes.fromhex(transaction.txid)
+            payload = transaction.serialize()
+            asyncio.run_coroutine_threadsafe(self.announce(INV_TX, key, 'tx', payload), self.loop)
+
+    async def broadcast_async(self, command, payload=b'', exclude=None):
+        """
+        Queue a message for every peer except one, concurrently.
+
+        Peers whose send queue stays full for SEND_TIMEOUT seconds are dropped
+        instead of holding up the others.
+        """
+        async def send(peer):
+            try:
+                await asyncio.wait_for(peer.send(command, payload), SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Error broadcasting to peer %s: send queue full", peer.address)
+                peer.close()
+
+        targets = [peer for peer in self.peers if peer is not exclude]
+        # Most peers have room right away: only wait on the ones that do not.
+        waiting = [peer for peer in targets if not peer.send_nowait(command, payload)]
+        if waiting:
+            await asyncio.gather(*(send(peer) for peer in waiting))
+
+    def broadcast(self, command, payload=b'', exclude=None):
+        """
+        Broadcast a message to all connected peers, except one. Safe to call from any thread.
+        """
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(self.broadcast_async(command, payload, exclude), self.loop)
+
+    async def connect(self, ip, port):
+        """
+        Connect to a peer at a given IP and port on the running event loop.
         """
         try:
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect((ip, port))
-            self.peers.append(peer_socket)
-            print(f"Connected to peer at {ip}:{port}")
-            threading.Thread(target=self.handle_peer, args=(peer_socket,)).start()
-        except Exception as e:
-            print(f"Failed to connect to {ip}:{port}: {e}")
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning("Failed to connect to %s:%s: %s", ip, port, e)
+            return None
+        peer = self._add_peer(reader, writer, outbound=True)
+        logger.info("Connected to peer at %s:%s", ip, port)
+        return peer
+
+    def connect_to_peer(self, ip, port):
+        """
+        Connect to a peer at a given IP and port. Safe to call from any thread.
+        """
+        if self.loop:
+            return asyncio.run_coroutine_threadsafe(self.connect(ip, port), self.loop)
 
 
 if __name__ == "__main__":
     # Example usage
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     node = P2PNode(host="0.0.0.0", port=8333, bootstrap_ip="5.178.148.11", bootstrap_port=8333)
     node.start_node()
 
@@ -139,4 +672,5 @@ if __name__ == "__main__":
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Node shutting down...")
+        logger.info("Node shutting down...")
+        node.stop_node()
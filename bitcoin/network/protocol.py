@@ -0,0 +1,141 @@
+import struct
+from bitcoin.core.serialize import (
+    SerializationError, double_sha256, encode_varint, read_struct, read_varint,
+)
+
+NETWORK_MAGIC = b'BPY\x01'
+# magic, command (NUL padded), payload length, first 4 bytes of double_sha256(payload)
+MESSAGE_HEADER = struct.Struct('<4s12sI4s')
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+
+INV_TX = 1
+INV_BLOCK = 2
+# Only in getdata: the block is wanted as a cmpctblock.
+INV_COMPACT_BLOCK = 4
+# inventory type, object hash
+INVENTORY_ITEM = struct.Struct('<I32s')
+HASH = struct.Struct('<32s')
+MAX_INVENTORY_ITEMS = 50_000
+# Block headers sent in reply to one getheaders.
+MAX_HEADERS = 2000
+HEADER_SIZE = 80
+MAX_LOCATOR = 101
+
+
+class ProtocolError(ValueError):
+    """Raised when a peer sends a malformed frame."""
+
+
+def checksum(payload: bytes) -> bytes:
+    return double_sha256(payload)[:4]
+
+
+def encode_message(command: str, payload: bytes = b'') -> bytes:
+    """
+    Frame a message: a fixed 24-byte header followed by the payload.
+    """
+    name = command.encode('ascii')
+    if len(name) > 12:
+        raise ValueError(f"command too long: {command}")
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ValueError("payload too large")
+    return MESSAGE_HEADER.pack(NETWORK_MAGIC, name, len(payload), checksum(payload)) + payload
+
+
+def decode_header(header: bytes):
+    """
+    Parse a message header. Returns (command, payload length, checksum).
+    """
+    magic, name, length, check = MESSAGE_HEADER.unpack(header)
+    if magic != NETWORK_MAGIC:
+        raise ProtocolError("bad network magic")
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"payload of {length} bytes exceeds the limit")
+    try:
+        command = name.rstrip(b'\0').decode('ascii')
+    except UnicodeDecodeError:
+        raise ProtocolError("bad command name") from None
+    return command, length, check
+
+
+async def read_message(reader):
+    """
+    Read one framed message from an asyncio StreamReader. Returns (command, payload).
+
+    Raises asyncio.IncompleteReadError when the peer disconnects and
+    ProtocolError when the frame is invalid.
+    """
+    command, length, check = decode_header(await reader.readexactly(MESSAGE_HEADER.size))
+    payload = await reader.readexactly(length) if length else b''
+    if checksum(payload) != check:
+        raise ProtocolError(f"bad checksum for {command}")
+    return command, payload
+
+
+def encode_inventory(items) -> bytes:
+    """
+    Payload of inv, getdata and notfound: a count and (type, 32-byte hash) pairs.
+    """
+    return encode_varint(len(items)) + b''.join(INVENTORY_ITEM.pack(kind, h) for kind, h in items)
+
+
+def decode_inventory(payload):
+    """
+    Parse an inventory payload into a list of (type, 32-byte hash).
+    """
+    view = memoryview(payload)
+    try:
+        count, offset = read_varint(view, 0)
+        if count > MAX_INVENTORY_ITEMS:
+            raise ProtocolError(f"inventory of {count} items exceeds the limit")
+        items = []
+        for _ in range(count):
+            item, offset = read_struct(INVENTORY_ITEM, view, offset)
+            items.append(item)
+        return items
+    except SerializationError as e:
+        raise ProtocolError(f"bad inventory: {e}") from None
+
+
+def encode_getheaders(locator, stop=bytes(32)) -> bytes:
+    """
+    Ask for the headers following the first locator hash the peer knows, up to
+    MAX_HEADERS or the stop hash (all zeros: no stop).
+    """
+    return encode_varint(len(locator)) + b''.join(locator) + stop
+
+
+def decode_getheaders(payload):
+    """Parse a getheaders payload into (locator hashes, stop hash)."""
+    view = memoryview(payload)
+    try:
+        count, offset = read_varint(view, 0)
+        if count > MAX_LOCATOR:
+            raise ProtocolError(f"locator of {count} hashes is too long")
+        hashes = []
+        for _ in range(count + 1):
+            (h,), offset = read_struct(HASH, view, offset)
+            hashes.append(h)
+        return hashes[:-1], hashes[-1]
+    except SerializationError as e:
+        raise ProtocolError(f"bad getheaders: {e}") from None
+
+
+def encode_headers(headers) -> bytes:
+    """Payload of headers: a count and serialized 80-byte block headers."""
+    return encode_varint(len(headers)) + b''.join(headers)
+
+
+def decode_headers(payload):
+    """Parse a headers payload into a list of 80-byte headers."""
+    view = memoryview(payload)
+    try:
+        count, offset = read_varint(view, 0)
+        if count > MAX_HEADERS:
+            raise ProtocolError(f"{count} headers exceed the limit")
+        end = offset + count * HEADER_SIZE
+        if end != len(view):
+            raise ProtocolError("headers payload has the wrong length")
+        return [bytes(view[start:start + HEADER_SIZE]) for start in range(offset, end, HEADER_SIZE)]
+    except SerializationError as e:
+        raise ProtocolError(f"bad headers: {e}") from None
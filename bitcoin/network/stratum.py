@@ -0,0 +1,552 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from bitcoin.core.blockchain import BLOCK_HEADER, BLOCK_VERSION, CBlock, NONCE
+from bitcoin.core.consensus import MAX_FUTURE_BLOCK_TIME, bits_to_target, target_to_bits
+from bitcoin.core.merkle import hash_pair
+from bitcoin.core.mining import TEMPLATE_REFRESH_INTERVAL, BlockTemplate, search_nonces
+from bitcoin.core.serialize import double_sha256, encode_varint
+from bitcoin.core.transaction import OUTPOINT, TX_CHANGE, CTransaction
+from bitcoin.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 3333
+# The extranonce fills the coinbase's 8-byte timestamp: 4 bytes set by the server per connection,
+# then 4 bytes the worker counts up once it has tried every nonce.
+EXTRANONCE1_SIZE = 4
+EXTRANONCE2_SIZE = 4
+TIMESTAMP = struct.Struct('<Q')
+# Default share target: a share every 65,536 hashes on average.
+SHARE_BITS = target_to_bits(1 << 240)
+# Jobs on the current tip whose shares are still accepted.
+MAX_JOBS = 8
+# Longest line a worker may send, and bytes queued for a worker before it is dropped.
+MAX_LINE = 64 * 1024
+MAX_WRITE_BUFFER = 1024 * 1024
+CONNECT_TIMEOUT = 10
+# Stratum error codes.
+ERROR_OTHER = 20
+ERROR_STALE = 21
+ERROR_DUPLICATE = 22
+ERROR_LOW_DIFFICULTY = 23
+ERROR_UNAUTHORIZED = 24
+SUBSCRIBE_ID = 1
+AUTHORIZE_ID = 2
+
+SHARES = metrics.counter('stratum_shares_total', "Shares submitted by workers, by outcome", labels=('result',))
+SHARES_ACCEPTED = SHARES.labels(result='accepted')
+SHARES_REJECTED = SHARES.labels(result='rejected')
+WORKER_BLOCKS = metrics.counter('stratum_blocks_total', "Blocks found by workers and added to the chain")
+
+
+def split_coinbase(coinbase):
+    """
+    The unsigned encoding of a coinbase cut around its 8-byte timestamp:
+    (coinb1, coinb2). Jobs use that field as the extranonce: consensus does not
+    check it, and changing it changes the coinbase txid, so every worker hashes
+    its own merkle root.
+    """
+    unsigned = coinbase.serialize_unsigned()
+    end = (len(unsigned) - TX_CHANGE.size - len(encode_varint(len(coinbase.inputs)))
+           - OUTPOINT.size * len(coinbase.inputs))
+    start = end - TIMESTAMP.size
+    if unsigned[start:end] != TIMESTAMP.pack(coinbase.timestamp):
+        raise ValueError("Unexpected coinbase encoding")
+    return unsigned[:start], unsigned[end:]
+
+
+def coinbase_root(coinb1, extranonce, coinb2, branch):
+    """Merkle root of a job with a given extranonce: the coinbase txid hashed up its merkle branch."""
+    node = double_sha256(coinb1 + extranonce + coinb2)
+    for sibling in branch:
+        node = hash_pair(node, sibling)
+    return node
+
+
+class Job:
+    """
+    Work for one block: the header fields, the coinbase around its extranonce
+    and the merkle branch of the coinbase. On the server it also keeps what is
+    needed to turn a winning share into the block.
+    """
+    def __init__(self, job_id, prev_hash, coinb1, coinb2, branch, version, bits, ntime, clean):
+        self.job_id = job_id
+        self.prev_hash = prev_hash
+        self.coinb1 = coinb1
+        self.coinb2 = coinb2
+        self.branch = branch
+        self.version = version
+        self.bits = bits
+        self.ntime = ntime
+        self.clean = clean
+        # Server side only.
+        self.height = None
+        self.coinbase = None
+        self.transactions = []
+        self.submitted = set()
+
+    @classmethod
+    def from_template(cls, job_id, template, ntime, clean):
+        coinb1, coinb2 = split_coinbase(template.coinbase)
+        job = cls(job_id, template.tip.hash, coinb1, coinb2, template.tree.proof(0),
+                  BLOCK_VERSION, template.bits, ntime, clean)
+        job.height = template.height
+        job.coinbase = (template.coinbase.receiver, template.coinbase.amount)
+        job.transactions = template.transactions[1:]
+        return job
+
+    def notify_params(self):
+        """Parameters of mining.notify, as Stratum sends them."""
+        return [self.job_id, self.prev_hash, self.coinb1.hex(), self.coinb2.hex(), [h.hex() for h in self.branch],
+                f"{self.version:08x}", f"{self.bits:08x}", f"{self.ntime:08x}", self.clean]
+
+    @classmethod
+    def from_notify(cls, params):
+        job_id, prev_hash, coinb1, coinb2, branch, version, bits, ntime, clean = params
+        return cls(job_id, prev_hash, bytes.fromhex(coinb1), bytes.fromhex(coinb2), [bytes.fromhex(h) for h in branch],
+                   int(version, 16), int(bits, 16), int(ntime, 16), clean)
+
+    def header_prefix(self, extranonce, ntime=None):
+        """The 76 header bytes before the nonce, for the given extranonce."""
+        root = coinbase_root(self.coinb1, extranonce, self.coinb2, self.branch)
+        return BLOCK_HEADER.pack(self.version, bytes.fromhex(self.prev_hash), root,
+                                 self.ntime if ntime is None else ntime, self.bits, 0)[:-NONCE.size]
+
+    def block(self, extranonce, ntime, nonce):
+        """The block a share of this job stands for (server side)."""
+        receiver, amount = self.coinbase
+        coinbase = CTransaction.coinbase(receiver, amount, self.height, int.from_bytes(extranonce, 'little'))
+        return CBlock(self.height, self.prev_hash, [coinbase] + self.transactions, ntime, nonce, self.bits,
+                      merkle_root=coinbase_root(self.coinb1, extranonce, self.coinb2, self.branch))
+
+
+class WorkerSession:
+    """One worker connected to the WorkServer."""
+    def __init__(self, server, reader, writer, extranonce1):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.extranonce1 = extranonce1
+        self.address = writer.get_extra_info('peername')
+        self.name = None
+        self.subscribed = False
+        self.share_target = None
+        self.accepted = 0
+        self.rejected = 0
+        self.blocks = 0
+        self.work = 0  # hashes the accepted shares stand for
+        self.connected_at = time.monotonic()
+        self.closed = False
+
+    def send(self, message):
+        if self.closed:
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            logger.warning("Dropping worker %s: not reading its jobs", self.address)
+            self.close()
+            return
+        self.writer.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    def notify(self, job, share_target):
+        if share_target != self.share_target:
+            self.share_target = share_target
+            self.send({'id': None, 'method': 'mining.set_target', 'params': [f"{share_target:064x}"]})
+        self.send({'id': None, 'method': 'mining.notify', 'params': job.notify_params()})
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+            self.server.remove_session(self)
+
+
+class WorkServer:
+    """
+    Stratum-style work server: miner processes on this host or others hash
+    against the node's block template, over newline-delimited JSON-RPC.
+
+    A worker subscribes (mining.subscribe) and gets its own extranonce1. Each
+    job (mining.notify) carries the header fields, the coinbase split around
+    its extranonce and the coinbase's merkle branch, so a worker makes its
+    merkle root with a few hashes, whatever the number of transactions, and
+    never sees the transactions. Workers submit the nonces that meet the share
+    target (mining.submit); the server checks them with one header hash and
+    turns those that also meet the block target into blocks. Shares measure
+    each worker's hash rate.
+
+    A new tip sends a job with clean_jobs set at once: workers drop their
+    current job, and shares for older tips are refused as stale. The template
+    is refreshed with new pool transactions every TEMPLATE_REFRESH_INTERVAL
+    seconds.
+    """
+    def __init__(self, blockchain, transaction_pool, mining_address, host='127.0.0.1', port=DEFAULT_PORT,
+                 share_bits=SHARE_BITS):
+        """
+        :param mining_address: The address the coinbase of every block pays.
+        :param share_bits: Compact target of a share; the block target is used if it is easier.
+        """
+        self.blockchain = blockchain
+        self.transaction_pool = transaction_pool
+        self.mining_address = mining_address
+        self.host = host
+        self.port = port
+        self.share_bits = share_bits
+        self.sessions = []
+        self.jobs = OrderedDict()  # job id -> Job, oldest first
+        self.template = None
+        self.share_target = None
+        self.blocks_found = 0
+        self.loop = None
+        self.server = None
+        self._thread = None
+        self._job_ids = itertools.count(1)
+        self._extranonces = itertools.count(int.from_bytes(os.urandom(EXTRANONCE1_SIZE), 'little'))
+        self._refresh_task = None
+        self.blockchain.subscribe(self.on_new_tip)
+
+    def start(self):
+        """Serve workers from an event loop thread of its own."""
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        logger.info("Work server listening at %s:%s", self.host, self.port)
+
+    async def _start(self):
+        self.server = await asyncio.start_server(self._accept, self.host, self.port, limit=MAX_LINE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.new_job(clean=True)
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    def stop(self):
+        if not self.loop:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+        self.blockchain.unsubscribe(self.on_new_tip)
+
+    async def _stop(self):
+        self._refresh_task.cancel()
+        self.server.close()
+        for session in list(self.sessions):
+            session.close()
+        await self.server.wait_closed()
+
+    def on_new_tip(self, block):
+        """Blockchain listener: send every worker a clean job on the new tip."""
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.new_job, True)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(TEMPLATE_REFRESH_INTERVAL)
+            if self.template is not None and len(self.transaction_pool) != self.template.pool_size:
+                self.template.update()
+                self.new_job(clean=False)
+
+    def new_job(self, clean):
+        """
+        Make a job from the current template and send it to every subscribed
+        worker. A clean job starts a new template on the tip and retires the
+        jobs of the previous one.
+        """
+        if clean or self.template is None or self.template.tip.hash != self.blockchain.get_last_block().hash:
+            self.template = BlockTemplate(self.blockchain, self.transaction_pool, self.mining_address)
+            self.jobs.clear()
+            clean = True
+        ntime = max(int(time.time()), self.template.min_timestamp)
+        job = Job.from_template(f"{next(self._job_ids):x}", self.template, ntime, clean)
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > MAX_JOBS:
+            self.jobs.popitem(last=False)
+        self.share_target = max(bits_to_target(self.share_bits), bits_to_target(self.template.bits))
+        for session in list(self.sessions):
+            if session.subscribed:
+                session.notify(job, self.share_target)
+        return job
+
+    async def _accept(self, reader, writer):
+        extranonce1 = (next(self._extranonces) % (1 << 8 * EXTRANONCE1_SIZE)).to_bytes(EXTRANONCE1_SIZE, 'little')
+        session = WorkerSession(self, reader, writer, extranonce1)
+        self.sessions.append(session)
+        try:
+            while not session.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    method, params, request_id = request['method'], request.get('params', []), request.get('id')
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Dropping worker %s: malformed request", session.address)
+                    break
+                result, error = await self._dispatch(session, method, params)
+                session.send({'id': request_id, 'result': result, 'error': error})
+                if method == 'mining.subscribe' and error is None:
+                    session.notify(next(reversed(self.jobs.values())), self.share_target)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            session.close()
+
+    def remove_session(self, session):
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+    async def _dispatch(self, session, method, params):
+        """Run one request. Returns (result, error), error being [code, message, None] or None."""
+        if method == 'mining.subscribe':
+            session.subscribed = True
+            return [[['mining.notify', session.extranonce1.hex()]], session.extranonce1.hex(), EXTRANONCE2_SIZE], None
+        if method == 'mining.authorize':
+            session.name = str(params[0]) if params else None
+            return True, None
+        if method == 'mining.submit':
+            try:
+                result, error = await self.submit(session, *params)
+            except (TypeError, ValueError):
+                session.rejected += 1
+                result, error = None, [ERROR_OTHER, "Malformed share", None]
+            (SHARES_ACCEPTED if error is None else SHARES_REJECTED).inc()
+            return result, error
+        return None, [ERROR_OTHER, f"Unknown method {method}", None]
+
+    async def submit(self, session, name, job_id, extranonce2, ntime, nonce):
+        """
+        Check a share: one header hash against the share target. A share that
+        also meets the block target is added to the chain as a block.
+        """
+        if session.name is None:
+            session.rejected += 1
+            return None, [ERROR_UNAUTHORIZED, "Unauthorized worker", None]
+        job = self.jobs.get(job_id)
+        if job is None:
+            session.rejected += 1
+            return None, [ERROR_STALE, "Job not found", None]
+        extranonce2 = bytes.fromhex(extranonce2)
+        ntime, nonce = int(ntime, 16), int(nonce, 16)
+        if len(extranonce2) != EXTRANONCE2_SIZE or not 0 <= nonce < 1 << 32:
+            raise ValueError("bad extranonce2 or nonce")
+        if not job.ntime <= ntime <= time.time() + MAX_FUTURE_BLOCK_TIME:
+            session.rejected += 1
+            return None, [ERROR_OTHER, "Header time out of range", None]
+        key = (session.extranonce1, extranonce2, ntime, nonce)
+        if key in job.submitted:
+            session.rejected += 1
+            return None, [ERROR_DUPLICATE, "Duplicate share", None]
+        extranonce = session.extranonce1 + extranonce2
+        digest = sha256(job.header_prefix(extranonce, ntime) + NONCE.pack(nonce)).digest()
+        value = int.from_bytes(digest, 'big')
+        if value > self.share_target:
+            session.rejected += 1
+            return None, [ERROR_LOW_DIFFICULTY, "Share above target", None]
+        job.submitted.add(key)
+        session.accepted += 1
+        session.work += (1 << 256) // (self.share_target + 1)
+        if value <= bits_to_target(job.bits):
+            block = job.block(extranonce, ntime, nonce)
+            if await asyncio.get_running_loop().run_in_executor(None, self._add_block, block, session):
+                session.blocks += 1
+        return True, None
+
+    def _add_block(self, block, session):
+        try:
+            self.blockchain.add_block(block)
+        except ValueError as e:
+            logger.warning("Rejected block %s from worker %s: %s", block.hash, session.name, e)
+            # Rebuild the template without the transactions that may have made the block invalid.
+            self.transaction_pool.remove_transactions(tx.txid for tx in block.transactions[1:])
+            if self.loop:
+                self.loop.call_soon_threadsafe(self.new_job, True)
+            return False
+        self.blocks_found += 1
+        WORKER_BLOCKS.inc()
+        self.transaction_pool.remove_block(block)
+        logger.info("Block mined by worker %s: %s", session.name, block.hash)
+        return True
+
+    def stats(self):
+        """Accepted shares, and the hash rate they stand for, of every connected worker."""
+        now = time.monotonic()
+        return [{'name': s.name, 'address': s.address, 'accepted': s.accepted, 'rejected': s.rejected,
+                 'blocks': s.blocks, 'hashrate': s.work / max(now - s.connected_at, 1e-9)} for s in self.sessions]
+
+
+class StratumWorker:
+    """
+    Reference worker for a WorkServer: one connection, hashing in the calling
+    thread while a reader thread takes the server's jobs.
+
+    The worker switches to a new job within one NONCE_BATCH of its arrival.
+    Once every nonce of an extranonce2 is tried it counts extranonce2 up,
+    which changes the coinbase and so the merkle root.
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, name='worker', on_job=None):
+        """
+        :param on_job: Optional callable receiving each Job when hashing on it starts.
+        """
+        self.host = host
+        self.port = port
+        self.name = name
+        self.on_job = on_job
+        self.extranonce1 = None
+        self.extranonce2_size = EXTRANONCE2_SIZE
+        self.share_target = None
+        self.job = None
+        self.generation = 0
+        self.hashes = 0
+        self.submitted = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.running = False
+        self.sock = None
+        self._ids = itertools.count(AUTHORIZE_ID + 1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._new_job = threading.Event()
+        self._subscribed = threading.Event()
+
+    def connect(self):
+        """Connect, subscribe and authorize. Raises ConnectionError if the server does not answer."""
+        self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.running = True
+        threading.Thread(target=self._read_loop, daemon=True).start()
+        self._send({'id': SUBSCRIBE_ID, 'method': 'mining.subscribe', 'params': ['bitcoinpy-worker']})
+        self._send({'id': AUTHORIZE_ID, 'method': 'mining.authorize', 'params': [self.name, '']})
+        if not self._subscribed.wait(CONNECT_TIMEOUT):
+            self.close()
+            raise ConnectionError("work server did not answer mining.subscribe")
+
+    def close(self):
+        self.running = False
+        self._new_job.set()
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+    def _send(self, message):
+        with self._send_lock:
+            self.sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    def _read_loop(self):
+        try:
+            for line in self.sock.makefile('rb'):
+                message = json.loads(line)
+                method = message.get('method')
+                if method == 'mining.notify':
+                    job = Job.from_notify(message['params'])
+                    with self._lock:
+                        self.job = job
+                        self.generation += 1
+                        self._new_job.set()
+                elif method == 'mining.set_target':
+                    self.share_target = int(message['params'][0], 16)
+                elif message.get('id') == SUBSCRIBE_ID:
+                    _, extranonce1, self.extranonce2_size = message['result']
+                    self.extranonce1 = bytes.fromhex(extranonce1)
+                    self._subscribed.set()
+                elif message.get('id') is not None and message['id'] > AUTHORIZE_ID:
+                    if message.get('result') is True:
+                        self.accepted += 1
+                    else:
+                        self.rejected += 1
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.running = False
+            self._new_job.set()
+
+    def submit(self, job, extranonce2, nonce):
+        self.submitted += 1
+        self._send({'id': next(self._ids), 'method': 'mining.submit',
+                    'params': [self.name, job.job_id, extranonce2.hex(), f"{job.ntime:08x}", f"{nonce:08x}"]})
+
+    def _count(self, hashes):
+        self.hashes += hashes
+
+    def run(self, duration=None):
+        """
+        Hash the server's jobs until the connection closes, or for duration seconds.
+        """
+        deadline = time.monotonic() + duration if duration is not None else None
+        while self.running and (deadline is None or time.monotonic() < deadline):
+            self._new_job.wait(0.1)
+            with self._lock:
+                job, generation = self.job, self.generation
+                self._new_job.clear()
+            if job is None or self.share_target is None:
+                continue
+            if self.on_job:
+                self.on_job(job)
+
+            def should_stop():
+                return (not self.running or self.generation != generation
+                        or (deadline is not None and time.monotonic() >= deadline))
+
+            extranonce2 = 0
+            while not should_stop():
+                suffix = extranonce2.to_bytes(self.extranonce2_size, 'little')
+                prefix = job.header_prefix(self.extranonce1 + suffix)
+                nonce = 0
+                while True:
+                    nonce = search_nonces(prefix, self.share_target, nonce, 1, should_stop, self._count)
+                    if nonce is None:
+                        break
+                    self.submit(job, suffix, nonce)
+                    nonce += 1
+                extranonce2 += 1
+
+
+def _run_worker(host, port, name):
+    worker = StratumWorker(host, port, name)
+    worker.connect()
+    print(f"{name}: connected to {host}:{port}")
+    started = time.monotonic()
+
+    def print_stats():
+        rate = worker.hashes / (time.monotonic() - started)
+        print(f"{name}: {rate:,.0f} H/s, {worker.accepted} shares accepted, {worker.rejected} rejected")
+        if worker.running:
+            threading.Timer(10, print_stats).start()
+
+    threading.Timer(10, print_stats).start()
+    worker.run()
+
+
+# Example Usage: mine for a node started with --work-server, from one or more processes.
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="Stratum worker for a BitcoinPY node")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host of the node's work server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port of the node's work server")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, one connection each")
+    parser.add_argument("--name", type=str, default=socket.gethostname(), help="Worker name sent to the server")
+    args = parser.parse_args()
+
+    processes = [multiprocessing.Process(target=_run_worker, args=(args.host, args.port, f"{args.name}.{i}"))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Workers shutting down...")
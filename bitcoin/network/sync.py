@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.consensus import next_bits
+from bitcoin.network.protocol import (
+    INV_BLOCK, MAX_HEADERS, MAX_LOCATOR, ProtocolError, decode_headers, encode_getheaders, encode_inventory,
+)
+
+logger = logging.getLogger(__name__)
+
+# Blocks past the last connected one that may be requested or buffered at once.
+DOWNLOAD_WINDOW = 1024
+# Blocks requested from one peer before waiting for it to deliver.
+BLOCKS_PER_PEER = 16
+# Seconds before a block requested from a silent peer is asked from another one.
+BLOCK_DOWNLOAD_TIMEOUT = 10
+HEADERS_TIMEOUT = 30
+
+
+def block_locator(blockchain):
+    """
+    Hashes of the tip, the ten blocks below it, then exponentially sparser
+    blocks back to genesis: a peer on a different branch still finds the fork
+    point in a single round trip.
+    """
+    hashes = []
+    height = len(blockchain.chain) - 1
+    step = 1
+    while height > 0 and len(hashes) < MAX_LOCATOR - 1:
+        hashes.append(bytes.fromhex(blockchain.hash_at(height)))
+        if len(hashes) >= 10:
+            step *= 2
+        height -= step
+    hashes.append(bytes.fromhex(blockchain.hash_at(0)))
+    return hashes
+
+
+class InitialBlockDownload:
+    """
+    Headers-first sync of a node that is behind its peers.
+
+    The header chain is fetched from one peer and checked first: every header
+    must link to the previous one and carry valid proof-of-work, which costs one
+    hash per block. The bodies are then requested from every peer at once,
+    BLOCKS_PER_PEER at a time, within a sliding window of DOWNLOAD_WINDOW blocks
+    past the tip. Each body is checked against its header as soon as it arrives,
+    in any order, and blocks are connected to the chain in order, verifying the
+    signatures of every ready block in one batch.
+    """
+    def __init__(self, node, window=DOWNLOAD_WINDOW, blocks_per_peer=BLOCKS_PER_PEER, max_peers=None):
+        """
+        :param node: The P2PNode whose peers serve the blocks.
+        :param window: Blocks past the tip that may be in flight or buffered.
+        :param blocks_per_peer: Requests outstanding per peer.
+        :param max_peers: Download from at most this many peers; all of them by default.
+        """
+        self.node = node
+        self.blockchain = node.blockchain
+        self.window = window
+        self.blocks_per_peer = blocks_per_peer
+        self.max_peers = max_peers
+        self.active = False
+        self.headers = []  # headers of the blocks to download, in chain order
+        self.base_height = 0  # height of headers[0]
+        self.base_parent = None  # index entry headers[0] extends
+        self.heights = {}  # header hash -> height, for the blocks still to download
+        self.requested = {}  # height -> (peer, time requested)
+        self.received = {}  # height -> block checked against its header
+        self.next_height = 0  # next block to connect
+        self._headers_peer = None
+        self._headers_reply = None
+        self._progress = asyncio.Event()
+
+    async def run(self, peer=None):
+        """
+        Sync headers from peer (the first connected one by default), then the
+        blocks from all peers. Returns the number of blocks connected.
+        """
+        peer = peer or next((p for p in self.node.peers if not p.closed), None)
+        if peer is None:
+            return 0
+        self.active = True
+        try:
+            await self.sync_headers(peer)
+            return await self.download_blocks()
+        finally:
+            self.active = False
+
+    async def sync_headers(self, peer):
+        """
+        Fetch the peer's headers past the last block both chains share. They
+        may fork off below our tip: the branch is downloaded as well, and
+        becomes active once it has more work than ours.
+        """
+        index = self.blockchain.index
+        last_hash = None
+        while True:
+            locator = [bytes.fromhex(last_hash)] if last_hash else block_locator(self.blockchain)
+            self._headers_peer = peer
+            self._headers_reply = asyncio.get_running_loop().create_future()
+            await peer.send('getheaders', encode_getheaders(locator))
+            try:
+                headers = await asyncio.wait_for(self._headers_reply, HEADERS_TIMEOUT)
+            finally:
+                self._headers_reply = None
+            for data in headers:
+                header, _ = CBlock.deserialize_header(data)
+                if not self.headers:
+                    if header.hash in index:
+                        # Already stored: start after it.
+                        last_hash = header.hash
+                        continue
+                    parent = index.get(header.prev_hash)
+                    if parent is None:
+                        raise ProtocolError(f"header {header.hash} does not connect to a known block")
+                    self.base_height = parent.height + 1
+                    self.base_parent = parent
+                    last_hash = header.prev_hash
+                header.index = self.base_height + len(self.headers)
+                if header.prev_hash != last_hash:
+                    raise ProtocolError(f"header {header.hash} does not extend the chain")
+                if header.bits != self.required_bits(header.index):
+                    raise ProtocolError(f"header {header.hash} has the wrong proof-of-work target")
+                if not header.is_valid(self.blockchain.params):
+                    raise ProtocolError(f"header {header.hash} has invalid proof-of-work")
+                self.headers.append(header)
+                self.heights[header.hash] = header.index
+                last_hash = header.hash
+            if len(headers) < MAX_HEADERS:
+                return
+
+    def _timestamp_at(self, height):
+        if height >= self.base_height:
+            return self.headers[height - self.base_height].timestamp
+        return self.blockchain.ancestor(self.base_parent, height).timestamp
+
+    def required_bits(self, height):
+        """The compact target of the header at height, from the headers before it and the stored chain."""
+        parent = self.headers[-1] if self.headers else self.base_parent
+        return next_bits(self.blockchain.params, height, parent.bits, parent.timestamp, self._timestamp_at)
+
+    def on_headers(self, peer, payload):
+        """Hand a headers message to the pending request. Returns False if none was waiting for it."""
+        if self._headers_reply is None or self._headers_reply.done() or peer is not self._headers_peer:
+            return False
+        try:
+            self._headers_reply.set_result(decode_headers(payload))
+        except ProtocolError as e:
+            self._headers_reply.set_exception(e)
+        return True
+
+    def wants(self, block_hash):
+        return self.active and block_hash in self.heights
+
+    def on_block(self, peer, block):
+        """
+        Check a downloaded block against its header. The block may arrive
+        before its parent: everything that does not need the chain state is
+        checked here, and it waits in the window until it can be connected.
+        """
+        height = self.heights.get(block.hash)
+        if height is None or height < self.next_height or height in self.received:
+            return
+        if self.requested.get(height, (None,))[0] is peer:
+            del self.requested[height]
+        if block.index != height or block.calculate_merkle_root() != block.merkle_root:
+            logger.warning("Peer %s sent an invalid block %s", peer.address, block.hash)
+            peer.close()
+            return
+        self.received[height] = block
+        self._progress.set()
+
+    def _download_peers(self):
+        peers = [peer for peer in self.node.peers if not peer.closed]
+        return peers[:self.max_peers] if self.max_peers else peers
+
+    def _schedule(self):
+        """Spread requests for the missing blocks of the window over the peers with free slots."""
+        now = time.monotonic()
+        for height, (peer, requested_at) in list(self.requested.items()):
+            if peer.closed or now - requested_at > BLOCK_DOWNLOAD_TIMEOUT:
+                del self.requested[height]
+
+        peers = self._download_peers()
+        if not peers:
+            raise ConnectionError("no peers left to download blocks from")
+        load = {peer: 0 for peer in peers}
+        for peer, _ in self.requested.values():
+            if peer in load:
+                load[peer] += 1
+        batches = {peer: [] for peer in peers}
+        end = min(self.next_height + self.window, self.base_height + len(self.headers))
+        for height in range(self.next_height, end):
+            if height in self.requested or height in self.received:
+                continue
+            peer = min(peers, key=load.__getitem__)
+            if load[peer] >= self.blocks_per_peer:
+                break
+            load[peer] += 1
+            self.requested[height] = (peer, now)
+            batches[peer].append((INV_BLOCK, bytes.fromhex(self.headers[height - self.base_height].hash)))
+        for peer, items in batches.items():
+            if items:
+                peer.send_nowait('getdata', encode_inventory(items))
+
+    def _connect(self, blocks):
+        # Verify the signatures of every ready block in one batch: add_block then finds them cached.
+        transactions = [tx for block in blocks for tx in block.transactions]
+        if not self.blockchain.verifier.verify_transactions(transactions):
+            raise ValueError("Invalid transaction signature")
+        for block in blocks:
+            self.blockchain.add_block(block)
+
+    async def download_blocks(self):
+        self.next_height = self.base_height
+        end = self.base_height + len(self.headers)
+        loop = asyncio.get_running_loop()
+        while self.next_height < end:
+            self._schedule()
+            ready = []
+            while self.next_height + len(ready) in self.received:
+                ready.append(self.received.pop(self.next_height + len(ready)))
+            if ready:
+                await loop.run_in_executor(None, self._connect, ready)
+                for block in ready:
+                    del self.heights[block.hash]
+                self.next_height += len(ready)
+                continue
+            self._progress.clear()
+            try:
+                await asyncio.wait_for(self._progress.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        return end - self.base_height
+
@@ -0,0 +1,456 @@
+import bisect
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets of latency histograms: 50 us to 10 s.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+DEFAULT_METRICS_PORT = 9332
+# Seconds between two samples of the profiler.
+PROFILE_INTERVAL = 0.005
+# Frames kept per sampled stack, innermost first.
+MAX_STACK_DEPTH = 64
+# Innermost frames of a thread waiting for work, e.g. an event loop with nothing to run: not sampled.
+IDLE_FRAMES = frozenset([('selectors.py', 'select')])
+
+
+class _Metric:
+    """
+    A named metric, optionally split by labels: labels(**values) returns the
+    child holding the value for one combination of label values.
+    """
+    kind = None
+
+    def __init__(self, name, help, label_names=(), **options):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._options = options
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **values):
+        """
+        The child for a combination of label values. Creating it takes a lock:
+        callers on hot paths should keep the children they use.
+        """
+        key = tuple(str(values[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, type(self)(self.name, self.help, **self._options))
+        return child
+
+    def samples(self):
+        """(label values, metric holding them) of every child, or of the metric itself when it has no labels."""
+        if not self.label_names:
+            return [((), self)]
+        return sorted(self._children.items())
+
+
+class Counter(_Metric):
+    """A value that only goes up: events, bytes, hashes."""
+    kind = 'counter'
+
+    def __init__(self, name, help, label_names=()):
+        super().__init__(name, help, label_names)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or read from a function when collected."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, label_names=(), function=None):
+        super().__init__(name, help, label_names, function=function)
+        self.function = function
+        self._value = 0
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, latencies by default, counted in fixed
+    buckets: observing costs a bisection and two additions whatever the
+    number of observations.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names, buckets=buckets)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one counts values above every bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the seconds its block took."""
+        return _Timer(self)
+
+    def quantile(self, q):
+        """
+        Estimate of the q-quantile: the upper bound of the bucket it falls in
+        (the largest bound for values past every bucket), or None before any
+        observation.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, by name. Asking for a metric that exists
+    returns it, so modules declare theirs at import time and every instance
+    (several nodes in one benchmark, say) adds to the same totals.
+    """
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **options)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), function=None):
+        """
+        Args:
+            function: Callable returning the value when collected, e.g. the size of a pool.
+                Registering it again replaces the previous one.
+        """
+        gauge = self._get(Gauge, name, help, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._metrics.values()))
+
+    def render(self):
+        """
+        Every metric in the Prometheus text exposition format, which scrapers
+        read and people can too.
+        """
+        lines = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, sample in metric.samples():
+                if metric.kind != 'histogram':
+                    lines.append(f"{metric.name}{_format_labels(metric.label_names, values)} {sample.value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(sample.buckets + ('+Inf',), sample.counts):
+                    cumulative += count
+                    labels = _format_labels(metric.label_names, values, [('le', bound)])
+                    lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.label_names, values)
+                lines.append(f"{metric.name}_sum{labels} {sample.sum}")
+                lines.append(f"{metric.name}_count{labels} {sample.count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        Every metric as plain values: a number per counter and gauge, and the
+        count, sum and estimated median and 99th percentile per histogram.
+        Labelled metrics map "name=value,..." to those.
+        """
+        result = {}
+        for metric in self:
+            entries = {}
+            for values, sample in metric.samples():
+                if metric.kind == 'histogram':
+                    value = {'count': sample.count, 'sum': sample.sum,
+                             'p50': sample.quantile(0.5), 'p99': sample.quantile(0.99)}
+                else:
+                    value = sample.value
+                entries[','.join(f"{n}={v}" for n, v in zip(metric.label_names, values))] = value
+            result[metric.name] = entries if metric.label_names else entries.get('')
+        return result
+
+
+# Process-wide registry every module declares its metrics in.
+metrics = MetricsRegistry()
+
+
+class _Section:
+    __slots__ = ('profiler', 'name', 'ident', 'previous')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.ident = threading.get_ident()
+        sections = self.profiler._sections
+        self.previous = sections.get(self.ident)
+        sections[self.ident] = self.name
+        return self
+
+    def __exit__(self, *exc):
+        sections = self.profiler._sections
+        if self.previous is None:
+            sections.pop(self.ident, None)
+        else:
+            sections[self.ident] = self.previous
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of the hot paths of the node. Code marks a hot path
+    with `with profiler.section(name):`; while the profiler runs, a thread
+    takes the stack of every thread inside a section every interval seconds
+    and counts it, unless the thread is idle (see IDLE_FRAMES). Sections cost
+    nothing but a shared no-op context manager while the profiler is stopped,
+    and nothing is traced between samples.
+
+    Stacks are counted in the collapsed format of flame graph tools: the
+    section name, then one "file:function" per frame, outermost first.
+    """
+    def __init__(self, interval=PROFILE_INTERVAL):
+        """
+        Args:
+            interval: Seconds between two samples.
+        """
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._sections = {}  # thread ident -> name of the section it is in
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def section(self, name):
+        """Context manager marking the code it runs as the hot path name."""
+        return _Section(self, name) if self._thread is not None else nullcontext()
+
+    def start(self, interval=None):
+        if self._thread is not None:
+            return
+        if interval is not None:
+            self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._sections.clear()
+
+    def reset(self):
+        self.stacks.clear()
+        self.samples = 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in list(self._sections.items()):
+                frame = frames.get(ident)
+                if frame is None or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        """The counted stacks, one "section;frame;...;frame count" line each, most frequent first."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=20):
+        """
+        The functions the samples were taken in most often.
+
+        Returns:
+            A list of (section, function, samples), most samples first.
+        """
+        functions = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            functions[(frames[0], frames[-1])] += count
+        return [(section, function, count) for (section, function), count in functions.most_common(limit)]
+
+
+# Process-wide profiler the hot paths report to; stopped unless started (main.py --profile).
+profiler = SamplingProfiler()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server.metrics_server
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            body, content_type = server.registry.render(), 'text/plain; version=0.0.4'
+        elif url.path == '/metrics.json':
+            body, content_type = json.dumps(server.registry.snapshot(), indent=1), 'application/json'
+        elif url.path == '/profile':
+            body, content_type = server.profiler.collapsed(), 'text/plain'
+        elif url.path == '/profile/top':
+            limit = parse_qs(url.query).get('limit', ['20'])[0]
+            if not limit.isdigit():
+                self.send_error(400, "limit must be a positive integer")
+                return
+            limit = max(int(limit), 1)
+            total = max(server.profiler.samples, 1)
+            body = ''.join(f"{count:8} {count / total:6.1%}  {section}  {function}\n"
+                           for section, function, count in server.profiler.top(limit))
+            content_type = 'text/plain'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint of the metrics and the profiler:
+      /metrics        Prometheus text format,
+      /metrics.json   snapshot() as JSON,
+      /profile        collapsed stacks of the profiler, for flame graph tools,
+      /profile/top    the functions sampled most often (?limit=N).
+    """
+    def __init__(self, registry=metrics, profiler=profiler, host='127.0.0.1', port=DEFAULT_METRICS_PORT):
+        """
+        Args:
+            port: Port to listen on; 0 picks a free one, stored in self.port once started.
+        """
+        self.registry = registry
+        self.profiler = profiler
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._server.metrics_server = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        logger.info("Metrics served at http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+
+# Example Usage
+if __name__ == "__main__":
+    from urllib.request import urlopen
+
+    requests_total = metrics.counter('demo_requests_total', "Requests handled, by outcome", labels=('outcome',))
+    latency = metrics.histogram('demo_request_seconds', "Time to handle a request")
+    metrics.gauge('demo_queue_length', "Requests waiting", function=lambda: 3)
+
+    profiler.start(interval=0.001)
+    ok = requests_total.labels(outcome='ok')
+    for i in range(200):
+        with profiler.section('demo'), latency.time():
+            sum(x * x for x in range(2000 + i))
+        ok.inc()
+    profiler.stop()
+
+    server = MetricsServer(port=0)
+    server.start()
+    with urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+        print(response.read().decode())
+    with urlopen(f"http://127.0.0.1:{server.port}/profile/top?limit=3") as response:
+        print(f"Hottest functions:\n{response.read().decode()}")
+    server.stop()
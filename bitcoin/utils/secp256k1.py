@@ -0,0 +1,141 @@
+import base64
+
+# Curve y^2 = x^3 + 7 over the field of P, generator G of prime order N.
+P = 2 ** 256 - 2 ** 32 - 977
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+# Bits of the scalar consumed per table lookup in point_multiply.
+WINDOW_BITS = 8
+# DER SubjectPublicKeyInfo of an uncompressed secp256k1 key, up to the 65-byte point.
+SPKI_PREFIX = bytes.fromhex('3056301006072a8648ce3d020106052b8104000a034200')
+
+# Jacobian coordinates (X, Y, Z) stand for the affine point (X / Z^2, Y / Z^3); Z = 0 is infinity.
+INFINITY = (0, 1, 0)
+
+_table = None
+
+
+def _double(X, Y, Z):
+    if Z == 0 or Y == 0:
+        return INFINITY
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    return X3, (M * (S - X3) - 8 * YY * YY) % P, 2 * Y * Z % P
+
+
+def _add_affine(X1, Y1, Z1, x2, y2):
+    """Jacobian point plus affine point, without any field inversion."""
+    if Z1 == 0:
+        return x2, y2, 1
+    Z1Z1 = Z1 * Z1 % P
+    H = (x2 * Z1Z1 - X1) % P
+    r = (y2 * Z1 * Z1Z1 - Y1) % P
+    if H == 0:
+        return _double(X1, Y1, Z1) if r == 0 else INFINITY
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (r * r - HHH - 2 * V) % P
+    return X3, (r * (V - X3) - Y1 * HHH) % P, Z1 * H % P
+
+
+def to_affine(points):
+    """
+    Convert Jacobian points to affine (x, y), None for infinity, with a single
+    field inversion for the whole list (Montgomery's trick).
+    """
+    products = []
+    acc = 1
+    for _, _, Z in points:
+        products.append(acc)
+        if Z:
+            acc = acc * Z % P
+    inverse = pow(acc, -1, P)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        if not Z:
+            continue
+        z_inv = inverse * products[i] % P
+        inverse = inverse * Z % P
+        z_inv2 = z_inv * z_inv % P
+        result[i] = (X * z_inv2 % P, Y * z_inv2 * z_inv % P)
+    return result
+
+
+def _generator_table():
+    """
+    table[j][m - 1] = m * 2^(WINDOW_BITS * j) * G in affine coordinates, so a
+    scalar multiplication is one table addition per window and no doubling.
+    Built on first use.
+    """
+    global _table
+    if _table is None:
+        size = (1 << WINDOW_BITS) - 1
+        rows = []
+        base = G
+        for _ in range((256 + WINDOW_BITS - 1) // WINDOW_BITS):
+            row = [(base[0], base[1], 1)]
+            for _ in range(size):
+                row.append(_add_affine(*row[-1], *base))
+            row = to_affine(row)
+            base = row.pop()  # 2^WINDOW_BITS * base: the base of the next window
+            rows.append(row)
+        _table = rows
+    return _table
+
+
+def _multiply_jacobian(k):
+    table = _generator_table()
+    mask = (1 << WINDOW_BITS) - 1
+    point = INFINITY
+    j = 0
+    while k:
+        m = k & mask
+        if m:
+            point = _add_affine(*point, *table[j][m - 1])
+        k >>= WINDOW_BITS
+        j += 1
+    return point
+
+
+def point_multiply(k):
+    """k * G as an affine point (x, y)."""
+    if not 0 < k < N:
+        raise ValueError("Scalar out of range")
+    return to_affine([_multiply_jacobian(k)])[0]
+
+
+def points_multiply(scalars):
+    """[k * G for k in scalars], sharing one field inversion between all of them."""
+    if not all(0 < k < N for k in scalars):
+        raise ValueError("Scalar out of range")
+    return to_affine([_multiply_jacobian(k) for k in scalars])
+
+
+def encode_point(point, compressed=True):
+    """SEC1 encoding: 33 bytes (parity prefix and x) or 65 bytes (0x04, x and y)."""
+    x, y = point
+    if compressed:
+        return bytes((2 + (y & 1),)) + x.to_bytes(32, 'big')
+    return b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+
+
+def pem_public_key(point):
+    """
+    PEM SubjectPublicKeyInfo of a point, byte for byte what the cryptography
+    library produces, so addresses match those of keys it generated.
+    """
+    encoded = base64.b64encode(SPKI_PREFIX + encode_point(point, compressed=False))
+    lines = [encoded[i:i + 64] for i in range(0, len(encoded), 64)]
+    return b'-----BEGIN PUBLIC KEY-----\n' + b'\n'.join(lines) + b'\n-----END PUBLIC KEY-----\n'
+
+
+# Example Usage
+if __name__ == "__main__":
+    point = point_multiply(2)
+    print(f"2G = ({point[0]:064x}, {point[1]:064x})")
+    print(pem_public_key(point).decode())
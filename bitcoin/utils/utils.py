@@ -1,7 +1,15 @@
+import base64
 import hashlib
-import base58
+import math
+import multiprocessing
 import os
+import struct
+import threading
 import requests
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
@@ -20,27 +28,178 @@ def double_sha256(data):
     """
     return sha256(sha256(data))
 
+BASE58_ALPHABET = b'123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# Every pair of Base58 digits, so encoding divides by 58^2 and emits two characters per step.
+_BASE58_PAIRS = [bytes((a, b)) for a in BASE58_ALPHABET for b in BASE58_ALPHABET]
+# Maps each character of the alphabet to its digit value.
+_BASE58_DIGITS = bytes.maketrans(BASE58_ALPHABET, bytes(range(58)))
+# Version byte of addresses (mainnet pay-to-public-key-hash).
+ADDRESS_VERSION = 0
+ADDRESS_SIZE = 25
+# DER SubjectPublicKeyInfo of an uncompressed secp256k1 key, up to the 65-byte point.
+_SPKI_PREFIX = bytes.fromhex('3056301006072a8648ce3d020106052b8104000a034200')
+
+
+def base58_encode(data):
+    """
+    Encode bytes in Base58, each leading zero byte as a '1'.
+    """
+    n = int.from_bytes(data, 'big')
+    pairs = _BASE58_PAIRS
+    digits = []
+    while n:
+        n, pair = divmod(n, 3364)
+        digits.append(pairs[pair])
+    digits.reverse()
+    zeros = len(data) - len(data.lstrip(b'\0'))
+    return (b'1' * zeros + b''.join(digits).lstrip(b'1')).decode('ascii')
+
+
+def base58_decode(text):
+    """
+    Decode a Base58 string.
+
+    Raises:
+        ValueError: If text contains a character outside the alphabet.
+    """
+    raw = text.encode('ascii') if isinstance(text, str) else text
+    if raw.translate(None, BASE58_ALPHABET):
+        raise ValueError("Invalid Base58 character")
+    n = 0
+    for digit in raw.translate(_BASE58_DIGITS):
+        n = n * 58 + digit
+    zeros = len(raw) - len(raw.lstrip(b'1'))
+    return b'\0' * zeros + n.to_bytes((n.bit_length() + 7) // 8, 'big')
+
+
+def base58check_encode(payload):
+    """
+    Base58 of payload followed by the first 4 bytes of its double SHA-256.
+    """
+    checksum = hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    return base58_encode(payload + checksum)
+
+
+def base58check_decode(text):
+    """
+    Decode a Base58Check string.
+
+    Returns:
+        The payload, without the checksum.
+
+    Raises:
+        ValueError: If text is not Base58 or the checksum does not match.
+    """
+    data = base58_decode(text)
+    payload, checksum = data[:-4], data[-4:]
+    if len(data) < 4 or hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("Invalid Base58Check checksum")
+    return payload
+
+
+def hash160(data):
+    """
+    RIPEMD-160 of the SHA-256 of data.
+    """
+    return hashlib.new('ripemd160', hashlib.sha256(data).digest()).digest()
+
+
 def generate_address(public_key):
     """
     Generate a Bitcoin-style address from a public key.
+
+    The key is hashed as given: the PEM keys of this chain give the addresses
+    transactions are checked against, and a compressed SEC1 key (see
+    compressed_public_key) gives its standard Bitcoin address.
+    """
+    return base58check_encode(b'\0' + hash160(public_key))
+
+
+def generate_addresses(public_keys):
+    """
+    Generate the addresses of many public keys, as generate_address.
+
+    Returns:
+        A list of addresses, in the order of public_keys.
+    """
+    sha256_ = hashlib.sha256
+    new = hashlib.new
+    encode = base58_encode
+    addresses = []
+    for public_key in public_keys:
+        versioned = b'\0' + new('ripemd160', sha256_(public_key).digest()).digest()
+        addresses.append(encode(versioned + sha256_(sha256_(versioned).digest()).digest()[:4]))
+    return addresses
+
+
+def decode_address(address):
+    """
+    The 20-byte public key hash of an address.
+
+    Raises:
+        ValueError: If address is not a valid address.
+    """
+    data = base58_decode(address)
+    if len(data) != ADDRESS_SIZE or data[0] != ADDRESS_VERSION:
+        raise ValueError(f"Invalid address: {address}")
+    if hashlib.sha256(hashlib.sha256(data[:21]).digest()).digest()[:4] != data[21:]:
+        raise ValueError(f"Invalid address checksum: {address}")
+    return data[1:21]
+
+
+def validate_addresses(addresses):
+    """
+    Check many addresses at once.
+
+    Returns:
+        A list of booleans, True for each valid address.
     """
-    # Ensure the public key is a bytes object
-    sha256_hash = hashlib.sha256(public_key).digest()  # No .encode(), public_key is already bytes
-    ripemd160 = hashlib.new('ripemd160')
-    ripemd160.update(sha256_hash)
-    public_key_hash = ripemd160.digest()
+    sha256_ = hashlib.sha256
+    alphabet = BASE58_ALPHABET
+    digits = _BASE58_DIGITS
+    valid = []
+    for address in addresses:
+        raw = address.encode('ascii', 'replace')
+        if len(raw) > 34 or raw.translate(None, alphabet):
+            valid.append(False)
+            continue
+        n = 0
+        for digit in raw.translate(digits):
+            n = n * 58 + digit
+        if n.bit_length() > 192:  # above the version byte 0
+            valid.append(False)
+            continue
+        data = n.to_bytes(ADDRESS_SIZE, 'big')
+        # Leading zero bytes are written as '1's, one each.
+        if len(raw) - len(raw.lstrip(b'1')) != ADDRESS_SIZE - len(data.lstrip(b'\0')):
+            valid.append(False)
+            continue
+        valid.append(sha256_(sha256_(data[:21]).digest()).digest()[:4] == data[21:])
+    return valid
 
-    # Add version byte (0x00 for mainnet)
-    versioned_key = b'\x00' + public_key_hash
 
-    # Calculate checksum
-    checksum = hashlib.sha256(hashlib.sha256(versioned_key).digest()).digest()[:4]
+def compressed_public_key(public_key):
+    """
+    The 33-byte compressed SEC1 encoding of a secp256k1 public key.
 
-    # Append checksum to the versioned key
-    full_key = versioned_key + checksum
+    Args:
+        public_key: PEM SubjectPublicKeyInfo, or an uncompressed (65-byte) or compressed SEC1 point.
+
+    Raises:
+        ValueError: If public_key is none of these.
+    """
+    if public_key[:1] == b'-':
+        body = b''.join(line for line in public_key.splitlines() if not line.startswith(b'-----'))
+        der = base64.b64decode(body)
+        if len(der) != len(_SPKI_PREFIX) + 65 or not der.startswith(_SPKI_PREFIX):
+            raise ValueError("Not a secp256k1 public key")
+        public_key = der[len(_SPKI_PREFIX):]
+    if len(public_key) == 33 and public_key[0] in (2, 3):
+        return bytes(public_key)
+    if len(public_key) == 65 and public_key[0] == 4:
+        return bytes((2 + (public_key[64] & 1),)) + public_key[1:33]
+    raise ValueError("Not a secp256k1 public key")
 
-    # Convert to Base58
-    return base58.b58encode(full_key).decode('utf-8')
 
 def generate_private_key():
     private_key = ec.generate_private_key(ec.SECP256K1())
@@ -70,18 +229,47 @@ def get_public_ip():
         print(f"Error fetching public IP: {e}")
         return "Unknown"
     
+def load_private_key(private_key):
+    """
+    Return an ECDSA private key object from either a key object or PEM bytes.
+    """
+    if isinstance(private_key, bytes):
+        return serialization.load_pem_private_key(private_key, password=None)
+    return private_key
+
+def load_public_key(public_key):
+    """
+    Return an ECDSA public key object from either a key object or PEM bytes.
+    """
+    if isinstance(public_key, bytes):
+        return _load_public_key_pem(public_key)
+    return public_key
+
+@lru_cache(maxsize=4096)
+def _load_public_key_pem(public_key_pem):
+    return serialization.load_pem_public_key(public_key_pem)
+
+def public_key_bytes(private_key):
+    """
+    PEM encoding of the public key belonging to a private key (object or PEM bytes).
+    """
+    return load_private_key(private_key).public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
 def sign_data(private_key, data):
     """
     Signs the given data using the private key.
 
     Args:
-        private_key: The ECDSA private key object.
+        private_key: The ECDSA private key object or its PEM bytes.
         data: The data to sign (string).
 
     Returns:
         The signature as a hex string.
     """
-    signature = private_key.sign(
+    signature = load_private_key(private_key).sign(
         data.encode('utf-8'),
         ec.ECDSA(hashes.SHA256())
     )
@@ -93,55 +281,388 @@ def verify_signature(public_key, data, signature):
     Verifies a signature using the public key.
 
     Args:
-        public_key: The ECDSA public key object.
+        public_key: The ECDSA public key object or its PEM bytes.
         data: The data that was signed (string).
         signature: The signature as a hex string.
 
     Returns:
-        True if the signature is valid, False otherwise.
+        True if the signature is valid, False otherwise (including malformed
+        keys and signatures).
     """
-    r, s = map(lambda x: int(x, 16), signature.split(':'))
-    signature_bytes = encode_dss_signature(r, s)
     try:
-        public_key.verify(
+        r, s = (int(x, 16) for x in signature.split(':'))
+        signature_bytes = encode_dss_signature(r, s)
+        load_public_key(public_key).verify(
             signature_bytes,
             data.encode('utf-8'),
             ec.ECDSA(hashes.SHA256())
         )
         return True
-    except Exception as e:
+    except (InvalidSignature, ValueError, TypeError, AttributeError):
         return False
 
-class BloomFilter:
+def process_context():
     """
-    A simple implementation of a Bloom filter for quick membership checks.
+    Multiprocessing context of the node's worker processes. They are spawned,
+    not forked: the node's threads may hold locks a forked child would inherit held.
     """
-    def __init__(self, size=1000):
-        self.size = size
-        self.bit_array = [0] * size
+    return multiprocessing.get_context("spawn")
+
+def process_pool(workers):
+    """
+    A ProcessPoolExecutor of up to workers processes started from process_context().
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+
+def _verify_chunk(items):
+    """
+    Verify a list of (public key PEM, data, signature) items; runs in a worker process.
+    """
+    return [verify_signature(public_key, data, signature) for public_key, data, signature in items]
+
+class SignatureCache:
+    """
+    Bounded LRU set of signatures already verified as valid.
+
+    Entries are keyed by (public key, signed message, signature); the message of a
+    transaction signature is its txid, so a transaction checked when it entered
+    the mempool is not checked again when it arrives in a block. Safe to use
+    from several threads: the pool, block validation and the network loop share it.
+    """
+    def __init__(self, max_size=100_000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
 
-    def _hashes(self, item):
+    @staticmethod
+    def _key(public_key, data, signature):
+        return hashlib.sha256(b'\0'.join((public_key, data.encode('utf-8'), signature.encode('utf-8')))).digest()
+
+    def contains(self, public_key, data, signature):
+        key = self._key(public_key, data, signature)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True
+            return False
+
+    def add(self, public_key, data, signature):
+        key = self._key(public_key, data, signature)
+        with self._lock:
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+# Process-wide cache shared by transaction checks and block verification.
+signature_cache = SignatureCache()
+
+class SignatureVerifier:
+    """
+    Verifies batches of (public key PEM, data, signature) items, fanning them out
+    across a process pool and skipping items already in the signature cache.
+    """
+    def __init__(self, workers=None, cache=None, chunk_size=64):
+        """
+        Args:
+            workers: Verifier processes; None uses every core, 1 verifies in the calling thread.
+            cache: SignatureCache to consult and fill; defaults to the process-wide one.
+            chunk_size: Items sent to a worker at a time.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache if cache is not None else signature_cache
+        self.chunk_size = chunk_size
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = process_pool(self.workers)
+        return self._executor
+
+    def verify_batch(self, items, stop_on_failure=True):
         """
-        Generate multiple hash indices for the given item.
+        Verify every item of a batch.
+
+        Args:
+            items: Sequence of (public key PEM, data, signature).
+            stop_on_failure: Stop at the first invalid signature, e.g. when checking one block.
+
+        Returns:
+            A list with True/False per item, or None for items left unchecked
+            after an earlier failure.
+        """
+        results = [None] * len(items)
+        pending = []
+        for i, (public_key, data, signature) in enumerate(items):
+            if self.cache.contains(public_key, data, signature):
+                results[i] = True
+            else:
+                pending.append(i)
+
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+        if self.workers == 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                if self._record(items, chunk, _verify_chunk([items[i] for i in chunk]), results) and stop_on_failure:
+                    break
+            return results
+
+        futures = {self._pool().submit(_verify_chunk, [items[i] for i in chunk]): chunk for chunk in chunks}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                failed = self._record(items, futures.pop(future), future.result(), results)
+                if failed and stop_on_failure:
+                    for other in futures:
+                        other.cancel()
+                    return results
+        return results
+
+    def _record(self, items, chunk, outcomes, results):
+        """Store a chunk's outcomes and cache the valid ones. Returns True if any failed."""
+        failed = False
+        for i, valid in zip(chunk, outcomes):
+            results[i] = valid
+            if valid:
+                self.cache.add(*items[i])
+            else:
+                failed = True
+        return failed
+
+    def verify_transactions(self, transactions, stop_on_failure=True):
+        """
+        Verify the signatures of transactions (coinbases are skipped).
+
+        Returns:
+            True if every signature is valid.
         """
-        hash1 = int(hashlib.sha256(item.encode('utf-8')).hexdigest(), 16) % self.size
-        hash2 = int(hashlib.md5(item.encode('utf-8')).hexdigest(), 16) % self.size
-        return hash1, hash2
+        items = []
+        for tx in transactions:
+            if tx.is_coinbase():
+                continue
+            item = (tx.public_key or b'', tx.signature_hash(), tx.signature or '')
+            # Cached entries were checked against their sender already; the txid commits to it.
+            if not self.cache.contains(*item) and generate_address(item[0]) != tx.sender:
+                return False
+            items.append(item)
+        return all(self.verify_batch(items, stop_on_failure))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+class LimitedSet:
+    """
+    Set that forgets its oldest entries beyond max_size.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return item in self._entries
+
+    def add(self, item):
+        self._entries[item] = None
+        self._entries.move_to_end(item)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+# size in bits, hashes per item, tweak, items added; followed by the bit array
+BLOOM_HEADER = struct.Struct('<IBIQ')
+
+
+class BloomFilter:
+    """
+    Bloom filter for quick membership checks, with false positives but no false negatives.
+
+    Bits are packed in a bytearray, and the filter is sized for a number of
+    items and a false-positive rate: about 9.6 bits per item at 1%. The k bit
+    positions of an item come from a single 128-bit BLAKE2b digest split into
+    two halves, by enhanced double hashing instead of k hash functions.
+    The digest is keyed with a tweak, so filters with different tweaks set
+    different bits for the same items.
+    """
+    def __init__(self, capacity=1000, fp_rate=0.01, tweak=0):
+        """
+        Args:
+            capacity: Items the filter is sized for.
+            fp_rate: False-positive rate once capacity items were added.
+            tweak: 32-bit key of the hash function.
+        """
+        if capacity < 1 or not 0 < fp_rate < 1:
+            raise ValueError("Bloom filter capacity must be positive and fp_rate between 0 and 1")
+        size = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self._setup((size + 7) // 8 * 8, max(1, round(size / capacity * math.log(2))), tweak)
+        self.bits = bytearray(self.size // 8)
+
+    def _setup(self, size, num_hashes, tweak):
+        self.size = size
+        self.num_hashes = num_hashes
+        self.tweak = tweak
+        self.count = 0
+        self._key = tweak.to_bytes(4, 'little')
+
+    def _indexes(self, item):
+        """The bit positions of an item (str or bytes)."""
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        digest = int.from_bytes(hashlib.blake2b(item, digest_size=16, key=self._key).digest(), 'little')
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64
+        size = self.size
+        indexes = []
+        for i in range(1, self.num_hashes + 1):
+            indexes.append(h1 % size)
+            # Enhanced double hashing: h1 + i * h2 + (i^3 - i) / 6. Items agreeing on h1 and h2 modulo the
+            # size share every bit, which puts a floor of about capacity / size^2 under the false-positive rate.
+            h1 += h2
+            h2 += i
+        return indexes
+
+    def __len__(self):
+        """Items added, counting repeated ones."""
+        return self.count
 
     def add(self, item):
         """
         Add an item to the Bloom filter.
         """
-        hash1, hash2 = self._hashes(item)
-        self.bit_array[hash1] = 1
-        self.bit_array[hash2] = 1
+        bits = self.bits
+        for index in self._indexes(item):
+            bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def add_many(self, items):
+        """
+        Add every item of an iterable.
+        """
+        bits = self.bits
+        indexes = self._indexes
+        added = 0
+        for item in items:
+            for index in indexes(item):
+                bits[index >> 3] |= 1 << (index & 7)
+            added += 1
+        self.count += added
 
     def contains(self, item):
         """
         Check if an item is possibly in the Bloom filter.
         """
-        hash1, hash2 = self._hashes(item)
-        return self.bit_array[hash1] and self.bit_array[hash2]
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        digest = int.from_bytes(hashlib.blake2b(item, digest_size=16, key=self._key).digest(), 'little')
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64
+        bits = self.bits
+        size = self.size
+        # _indexes inlined, stopping at the first clear bit: most lookups of absent items end after one or two.
+        for i in range(1, self.num_hashes + 1):
+            index = h1 % size
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+            h1 += h2
+            h2 += i
+        return True
+
+    __contains__ = contains
+
+    def contains_many(self, items):
+        """
+        Check several items at once.
+
+        Returns:
+            A list of booleans, one per item.
+        """
+        return [self.contains(item) for item in items]
+
+    def estimated_fp_rate(self):
+        """False-positive rate expected with the items added so far."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.size)) ** self.num_hashes
+
+    def clear(self):
+        self.bits[:] = bytes(len(self.bits))
+        self.count = 0
+
+    def serialize(self):
+        """
+        Encode the filter to send it to a peer.
+
+        Returns:
+            BLOOM_HEADER followed by the bit array.
+        """
+        return BLOOM_HEADER.pack(self.size, self.num_hashes, self.tweak, self.count) + self.bits
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        Decode a filter encoded by serialize().
+        """
+        if len(data) < BLOOM_HEADER.size:
+            raise ValueError("Bloom filter data too short")
+        size, num_hashes, tweak, count = BLOOM_HEADER.unpack_from(data)
+        if size == 0 or size % 8 or num_hashes == 0 or len(data) != BLOOM_HEADER.size + size // 8:
+            raise ValueError("Malformed Bloom filter data")
+        bloom = cls.__new__(cls)
+        bloom._setup(size, num_hashes, tweak)
+        bloom.count = count
+        bloom.bits = bytearray(data[BLOOM_HEADER.size:])
+        return bloom
+
+
+class RollingBloomFilter:
+    """
+    Bloom filter that forgets its oldest items, for an unbounded stream.
+
+    Two generations of capacity items each: once the newer one is full, the
+    older one is cleared and takes its place. The last capacity items added
+    are always remembered, and at most 2 * capacity. Drop-in for LimitedSet
+    where an occasional false positive is acceptable, in a fraction of the
+    memory.
+    """
+    def __init__(self, capacity=1000, fp_rate=0.000001, tweak=None):
+        """
+        Args:
+            capacity: Items always remembered.
+            fp_rate: False-positive rate over both generations.
+            tweak: Hash key; random by default, so peers cannot aim for false positives.
+        """
+        if tweak is None:
+            tweak = int.from_bytes(os.urandom(4), 'little')
+        self.capacity = capacity
+        # An item is a false positive if either generation matches it.
+        self._current = BloomFilter(capacity, fp_rate / 2, tweak)
+        self._previous = BloomFilter(capacity, fp_rate / 2, tweak)
+
+    def add(self, item):
+        if self._current.count >= self.capacity:
+            self._previous, self._current = self._current, self._previous
+            self._current.clear()
+        self._current.add(item)
+
+    def add_many(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return item in self._current or item in self._previous
+
+    contains = __contains__
+
+    def contains_many(self, items):
+        return [item in self for item in items]
+
+    def clear(self):
+        self._current.clear()
+        self._previous.clear()
+
 
 # Example Usage
 if __name__ == "__main__":
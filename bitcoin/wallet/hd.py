@@ -0,0 +1,170 @@
+import hashlib
+import hmac
+from bitcoin.utils.secp256k1 import N, encode_point, pem_public_key, point_multiply, points_multiply
+from bitcoin.utils.utils import generate_address, generate_addresses
+
+HARDENED = 0x80000000
+SEED_SIZE = 32
+# Unused addresses kept derived past the last used one, on each chain.
+DEFAULT_GAP_LIMIT = 20
+# Chains of an account: addresses handed out to payers, and addresses receiving change.
+EXTERNAL = 0
+CHANGE = 1
+# BIP44 account: m/44'/0'/0'
+ACCOUNT_PATH = (44 | HARDENED, 0 | HARDENED, 0 | HARDENED)
+
+
+class ExtendedPrivateKey:
+    """A BIP32 private key with its chain code, from which child keys are derived."""
+    __slots__ = ('key', 'chain_code', 'depth', 'index', '_public')
+
+    def __init__(self, key, chain_code, depth=0, index=0):
+        self.key = key
+        self.chain_code = chain_code
+        self.depth = depth
+        self.index = index
+        self._public = None
+
+    @classmethod
+    def from_seed(cls, seed):
+        digest = hmac.new(b"Bitcoin seed", seed, hashlib.sha512).digest()
+        key = int.from_bytes(digest[:32], 'big')
+        if not 0 < key < N:
+            raise ValueError("Seed does not give a valid master key")
+        return cls(key, digest[32:])
+
+    @property
+    def public_key(self):
+        """Compressed SEC1 public key, computed once."""
+        if self._public is None:
+            self._public = encode_point(point_multiply(self.key))
+        return self._public
+
+    def _child_scalar(self, index):
+        if index & HARDENED:
+            data = b'\0' + self.key.to_bytes(32, 'big') + index.to_bytes(4, 'big')
+        else:
+            data = self.public_key + index.to_bytes(4, 'big')
+        digest = hmac.new(self.chain_code, data, hashlib.sha512).digest()
+        tweak = int.from_bytes(digest[:32], 'big')
+        key = (tweak + self.key) % N
+        if tweak >= N or key == 0:
+            # Happens with probability below 2^-127; BIP32 skips such indexes.
+            raise ValueError(f"Index {index} does not give a valid child key")
+        return key, digest[32:]
+
+    def child(self, index):
+        key, chain_code = self._child_scalar(index)
+        return ExtendedPrivateKey(key, chain_code, self.depth + 1, index)
+
+    def child_keys(self, start, count):
+        """Private keys of the children start to start + count - 1, without building their extended keys."""
+        return [self._child_scalar(index)[0] for index in range(start, start + count)]
+
+    def derive(self, path):
+        """The descendant along path, a sequence of child indexes."""
+        node = self
+        for index in path:
+            node = node.child(index)
+        return node
+
+
+def address_of(point):
+    """The address of a public key point, as generated for keys from the cryptography library."""
+    return generate_address(pem_public_key(point))
+
+
+class HDKeyChain:
+    """
+    Keys and addresses derived from one seed along m/44'/0'/0'/chain/index.
+
+    The nodes of the two chains are derived once and kept, so the key of
+    address i costs one HMAC and its address one scalar multiplication, whatever
+    the depth of the path. Ranges of addresses are derived together, sharing
+    the field inversion of their public keys.
+
+    Each chain keeps gap_limit addresses derived past the last one handed out
+    or seen in use: a wallet restored from the seed watches that lookahead pool
+    and extends it as payments to it are found, until gap_limit addresses in a
+    row are unused. Addresses handed out before are not derived again: the
+    wallet file records them.
+    """
+    def __init__(self, seed, gap_limit=DEFAULT_GAP_LIMIT, issued=(0, 0)):
+        """
+        :param seed: Seed bytes the whole tree is derived from.
+        :param gap_limit: Unused addresses derived ahead on each chain.
+        :param issued: Addresses already handed out on the external and change chains.
+        """
+        account = ExtendedPrivateKey.from_seed(seed).derive(ACCOUNT_PATH)
+        self.chains = [account.child(EXTERNAL), account.child(CHANGE)]
+        self.gap_limit = gap_limit
+        self.issued = list(issued)
+        self.derived = list(issued)  # by chain: next index to derive
+        self.addresses = [{}, {}]  # by chain: index -> address, for the addresses derived here
+        self.paths = {}  # address -> (chain, index), for the addresses derived here
+        for chain in (EXTERNAL, CHANGE):
+            self.top_up(chain)
+
+    def derive_range(self, chain, start, count):
+        """Addresses of indexes start to start + count - 1 of a chain."""
+        points = points_multiply(self.chains[chain].child_keys(start, count))
+        return generate_addresses([pem_public_key(point) for point in points])
+
+    def top_up(self, chain):
+        """Derive addresses until gap_limit of them follow the issued ones. Returns the new addresses."""
+        start = self.derived[chain]
+        count = self.issued[chain] + self.gap_limit - start
+        if count <= 0:
+            return []
+        addresses = self.derive_range(chain, start, count)
+        for index, address in enumerate(addresses, start):
+            self.addresses[chain][index] = address
+            self.paths[address] = (chain, index)
+        self.derived[chain] = start + count
+        return addresses
+
+    def lookahead(self):
+        """Derived addresses not handed out yet, on both chains."""
+        return [self.addresses[chain][index] for chain in (EXTERNAL, CHANGE)
+                for index in range(self.issued[chain], self.derived[chain])]
+
+    def issue(self, count, chain=EXTERNAL):
+        """
+        Hand out the next count addresses of a chain. Returns them, as
+        (address, chain, index), and the addresses added to the lookahead pool.
+        """
+        start = self.issued[chain]
+        self.issued[chain] += count
+        added = self.top_up(chain)
+        issued = [(self.addresses[chain][index], chain, index) for index in range(start, start + count)]
+        return issued, added
+
+    def mark_used(self, address):
+        """
+        Record that address received a payment. If it was in the lookahead pool,
+        it and every address before it count as handed out. Returns them, as
+        (address, chain, index), and the addresses added to the pool.
+        """
+        path = self.paths.get(address)
+        if path is None or path[1] < self.issued[path[0]]:
+            return [], []
+        chain, index = path
+        return self.issue(index + 1 - self.issued[chain], chain)
+
+    def private_key(self, chain, index):
+        """The private key at index of a chain, as an integer."""
+        return self.chains[chain].child_keys(index, 1)[0]
+
+
+# Example Usage
+if __name__ == "__main__":
+    import os
+
+    keychain = HDKeyChain(os.urandom(SEED_SIZE), gap_limit=5)
+    issued, _ = keychain.issue(2)
+    print(f"Handed out: {[address for address, _, _ in issued]}")
+    print(f"Lookahead pool: {keychain.lookahead()}")
+
+    # A payment to the fourth external address hands it and the one before it out.
+    issued, added = keychain.mark_used(keychain.lookahead()[1])
+    print(f"Now handed out: {keychain.issued[EXTERNAL]}, pool extended by {len(added)} addresses")
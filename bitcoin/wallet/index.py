@@ -0,0 +1,377 @@
+import mmap
+import sqlite3
+import threading
+from collections import namedtuple
+from itertools import repeat
+from bitcoin.core.blockchain import CBlock
+from bitcoin.core.transaction import OUTPOINT
+from bitcoin.core.utxo import outpoint_key
+from bitcoin.utils.utils import process_pool
+
+# Blocks scanned by one worker task during a rescan.
+SCAN_CHUNK = 500
+# Above this many addresses, searching every raw block for each of them costs more than decoding it.
+MAX_FILTER_SEARCHES = 64
+
+# A transaction of the wallet, or of one address: satoshis it received and sent.
+WalletTransaction = namedtuple('WalletTransaction', 'txid height block_hash timestamp received sent')
+# An unspent output of the wallet.
+WalletOutput = namedtuple('WalletOutput', 'txid index address value height')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (outpoint BLOB PRIMARY KEY, address TEXT, value INTEGER, height INTEGER,
+                                    block_hash TEXT, spent_by TEXT, spent_block TEXT) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS outputs_block ON outputs (block_hash);
+CREATE INDEX IF NOT EXISTS outputs_spent_block ON outputs (spent_block);
+CREATE TABLE IF NOT EXISTS transactions (txid TEXT, address TEXT, block_hash TEXT, height INTEGER,
+                                         timestamp INTEGER, received INTEGER, sent INTEGER,
+                                         PRIMARY KEY (txid, address)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS transactions_block ON transactions (block_hash);
+CREATE INDEX IF NOT EXISTS transactions_address ON transactions (address, height);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+class AddressFilter:
+    """
+    The addresses of a wallet, and a quick test of whether a serialized block
+    may involve any of them.
+
+    Transactions store addresses as plain UTF-8, so a block that none of the
+    addresses occurs in, byte for byte, neither pays nor spends from the wallet
+    and is skipped without being decoded. Matches are confirmed on the decoded
+    transactions.
+    """
+    def __init__(self, addresses=()):
+        self.addresses = set()
+        self._needles = []
+        for address in addresses:
+            self.add(address)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.addresses
+
+    def add(self, address):
+        if address not in self.addresses:
+            self.addresses.add(address)
+            self._needles.append(address.encode('utf-8'))
+
+    def may_match(self, data, start=0, end=None):
+        """False only if no address occurs in data[start:end]; data is bytes or an mmap."""
+        if len(self._needles) > MAX_FILTER_SEARCHES:
+            return True
+        end = len(data) if end is None else end
+        return any(data.find(needle, start, end) != -1 for needle in self._needles)
+
+    def matches(self, tx):
+        """Whether tx pays one of the addresses or spends from one (its change goes back to the sender)."""
+        return tx.sender in self.addresses or tx.receiver in self.addresses
+
+
+def wallet_transactions(block, address_filter):
+    """The transactions of block involving the wallet, as (txid, sender, inputs, outputs, timestamp)."""
+    return [(tx.txid, tx.sender, tx.inputs, tx.outputs(), tx.timestamp)
+            for tx in block.transactions if address_filter.matches(tx)]
+
+
+def _scan_blocks(locations, address_filter):
+    """
+    Scan the blocks at locations, (height, hash, segment path, offset, length)
+    each, mapping the segment files itself so it can run in a worker process.
+    Returns (height, hash, wallet transactions) for the blocks that have any.
+    """
+    maps = {}
+    found = []
+    try:
+        for height, block_hash, path, start, length in locations:
+            mapping = maps.get(path)
+            if mapping is None or len(mapping) < start + length:
+                with open(path, 'rb') as f:
+                    mapping = maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if not address_filter.may_match(mapping, start, start + length):
+                continue
+            block, _ = CBlock.deserialize(mapping[start:start + length])
+            transactions = wallet_transactions(block, address_filter)
+            if transactions:
+                found.append((height, block_hash, transactions))
+    finally:
+        for mapping in maps.values():
+            mapping.close()
+    return found
+
+
+class WalletIndex:
+    """
+    The outputs and transaction history of a wallet's addresses, in a SQLite
+    database kept up to date block by block as the chain changes.
+
+    Balances are held in memory per address, so reading one costs the same
+    whatever the size of the chain or of the history. The index records the
+    last block it has seen and only scans the blocks after it. A scan skips
+    blocks that do not contain any of the wallet's addresses without decoding
+    them, and spreads ranges of blocks over worker processes.
+    """
+    def __init__(self, path='wallet_index.sqlite', addresses=(), workers=1):
+        """
+        :param path: SQLite database file.
+        :param addresses: Addresses of the wallet.
+        :param workers: Processes scanning ranges of blocks in parallel when catching up; 1 scans in-thread.
+        """
+        self.path = path
+        self.workers = workers
+        self.filter = AddressFilter(addresses)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        self.best_block = meta.get('best_block')
+        self.best_height = int(meta.get('best_height', -1))
+        self.balances = dict(self.db.execute(
+            "SELECT address, SUM(value) FROM outputs WHERE spent_by IS NULL GROUP BY address"))
+        self.total = sum(self.balances.values())
+        self.blockchain = None
+        self.scanning = False
+        # Blocks arrive on the miner and network threads while the wallet reads balances.
+        self.lock = threading.RLock()
+        # Called with each address paid in a block connected, returns further addresses to index.
+        self.on_address_used = None
+
+    def add_address(self, address):
+        """
+        Index a new address from now on. Blocks already scanned are not searched
+        for it again: call rescan() after importing a key with a history.
+        """
+        with self.lock:
+            self.filter.add(address)
+
+    def balance(self, address=None):
+        """Unspent satoshis of address, or of the whole wallet."""
+        with self.lock:
+            return self.total if address is None else self.balances.get(address, 0)
+
+    def history(self, address=None, limit=None):
+        """Transactions of address, or of the whole wallet, newest first, as WalletTransaction."""
+        limit = -1 if limit is None else limit
+        with self.lock:
+            if address is None:
+                rows = self.db.execute(
+                    "SELECT txid, height, block_hash, timestamp, SUM(received), SUM(sent) FROM transactions "
+                    "GROUP BY txid ORDER BY height DESC, timestamp DESC LIMIT ?", (limit,))
+            else:
+                rows = self.db.execute(
+                    "SELECT txid, height, block_hash, timestamp, received, sent FROM transactions "
+                    "WHERE address = ? ORDER BY height DESC, timestamp DESC LIMIT ?", (address, limit))
+            return [WalletTransaction(*row) for row in rows]
+
+    def unspent(self, address=None):
+        """Unspent outputs of address, or of the whole wallet, as WalletOutput."""
+        query = "SELECT outpoint, address, value, height FROM outputs WHERE spent_by IS NULL"
+        with self.lock:
+            if address is None:
+                rows = self.db.execute(query).fetchall()
+            else:
+                rows = self.db.execute(query + " AND address = ?", (address,)).fetchall()
+        outputs = []
+        for key, address, value, height in rows:
+            txid, index = OUTPOINT.unpack(key)
+            outputs.append(WalletOutput(txid.hex(), index, address, value, height))
+        return outputs
+
+    def _credit(self, address, value):
+        self.balances[address] = self.balances.get(address, 0) + value
+        self.total += value
+
+    def _connect(self, block_hash, height, transactions):
+        """Record the wallet transactions of a block extending the last one indexed. Not committed."""
+        db = self.db
+        for txid, sender, inputs, outputs, timestamp in transactions:
+            amounts = {}  # address -> [received, sent]
+            if sender in self.filter:
+                for input_txid, index in inputs:
+                    key = outpoint_key(input_txid, index)
+                    row = db.execute("SELECT address, value FROM outputs WHERE outpoint = ? AND spent_by IS NULL",
+                                     (key,)).fetchone()
+                    if row is None:
+                        # Not an output of the wallet: a coinbase marker, or a version 1 transaction.
+                        continue
+                    db.execute("UPDATE outputs SET spent_by = ?, spent_block = ? WHERE outpoint = ?",
+                               (txid, block_hash, key))
+                    self._credit(row[0], -row[1])
+                    amounts.setdefault(row[0], [0, 0])[1] += row[1]
+            for index, (address, value) in enumerate(outputs):
+                if address in self.filter:
+                    db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, NULL, NULL)",
+                               (outpoint_key(txid, index), address, value, height, block_hash))
+                    self._credit(address, value)
+                    amounts.setdefault(address, [0, 0])[0] += value
+                    if self.on_address_used is not None:
+                        for new_address in self.on_address_used(address):
+                            self.filter.add(new_address)
+            db.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           ((txid, address, block_hash, height, timestamp, received, sent)
+                            for address, (received, sent) in amounts.items()))
+        self.best_block = block_hash
+        self.best_height = height
+
+    def _disconnect(self, block_hash, parent_hash, height):
+        """Undo _connect for the last block indexed. Not committed."""
+        db = self.db
+        for address, value in db.execute(
+                "SELECT address, value FROM outputs WHERE block_hash = ? AND spent_by IS NULL", (block_hash,)).fetchall():
+            self._credit(address, -value)
+        for address, value in db.execute(
+                "SELECT address, value FROM outputs WHERE spent_block = ? AND block_hash != ?",
+                (block_hash, block_hash)).fetchall():
+            self._credit(address, value)
+        db.execute("DELETE FROM outputs WHERE block_hash = ?", (block_hash,))
+        db.execute("UPDATE outputs SET spent_by = NULL, spent_block = NULL WHERE spent_block = ?", (block_hash,))
+        db.execute("DELETE FROM transactions WHERE block_hash = ?", (block_hash,))
+        self.best_block = parent_hash
+        self.best_height = height - 1
+
+    def _commit(self):
+        """Write the last block indexed with the changes that led to it, in one transaction."""
+        self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                            (('best_block', self.best_block), ('best_height', str(self.best_height))))
+        self.db.commit()
+
+    def attach(self, blockchain):
+        """Catch up with the active chain of blockchain, then follow every block it connects or disconnects."""
+        self.blockchain = blockchain
+        blockchain.subscribe(self.on_block_added, self.on_block_removed)
+        self.sync()
+
+    def on_block_added(self, block):
+        with self.lock:
+            if self.scanning:
+                # The running scan catches up with this block.
+                return
+            if block.prev_hash == self.best_block:
+                transactions = wallet_transactions(block, self.filter)
+                self._connect(block.hash, block.index, transactions)
+                if transactions:
+                    self._commit()
+                # Blocks without wallet activity change nothing on disk; the last
+                # block is written with the next commit, and rescanned after a crash.
+                return
+        self.sync()
+
+    def on_block_removed(self, block):
+        with self.lock:
+            if not self.scanning and block.hash == self.best_block:
+                self._disconnect(block.hash, block.prev_hash, block.index)
+                self._commit()
+
+    def sync(self):
+        """
+        Bring the index up to the tip of the attached blockchain: disconnect the
+        blocks indexed on a branch that is no longer active, then scan every
+        block after the last one indexed. New blocks connected in the meantime
+        are picked up before it returns.
+        """
+        with self.lock:
+            if self.scanning:
+                return
+            self.scanning = True
+        try:
+            while True:
+                with self.lock:
+                    entries = self._blocks_to_scan()
+                    if not entries:
+                        self.scanning = False
+                        return
+                self._scan(entries)
+        except BaseException:
+            with self.lock:
+                self.scanning = False
+            raise
+
+    def _blocks_to_scan(self):
+        blockchain = self.blockchain
+        with blockchain.lock:
+            entry = blockchain.index.get(self.best_block) if self.best_block is not None else None
+            if self.best_block is not None and entry is None:
+                raise ValueError("The wallet index does not match the block store")
+            if entry is not None and blockchain.get_height(entry.hash) is None:
+                while blockchain.get_height(entry.hash) is None:
+                    self._disconnect(entry.hash, entry.parent.hash, entry.height)
+                    entry = entry.parent
+                self._commit()
+            return blockchain.main_chain[entry.height + 1 if entry is not None else 0:]
+
+    def _scan(self, entries):
+        """Index the given blocks of the active chain, which extend the last one indexed."""
+        store = self.blockchain.store
+        locations = [(entry.height, entry.hash, *store.locate(entry.position)) for entry in entries]
+        chunks = [locations[i:i + SCAN_CHUNK] for i in range(0, len(locations), SCAN_CHUNK)]
+        executor = None
+        if self.workers > 1 and len(chunks) > 1:
+            executor = process_pool(self.workers)
+            results = executor.map(_scan_blocks, chunks, repeat(self.filter))
+        else:
+            results = (_scan_blocks(chunk, self.filter) for chunk in chunks)
+        try:
+            # Chunks are applied in chain order, as the workers deliver them.
+            for chunk, found in zip(chunks, results):
+                with self.lock:
+                    for height, block_hash, transactions in found:
+                        self._connect(block_hash, height, transactions)
+                    self.best_height, self.best_block = chunk[-1][:2]
+                    self._commit()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def rescan(self):
+        """Drop everything indexed and scan the active chain again from the genesis block."""
+        with self.lock:
+            if self.scanning:
+                raise ValueError("A scan is already running")
+            self.db.execute("DELETE FROM outputs")
+            self.db.execute("DELETE FROM transactions")
+            self.best_block = None
+            self.best_height = -1
+            self.balances.clear()
+            self.total = 0
+            self._commit()
+        self.sync()
+
+    def close(self):
+        if self.blockchain is not None:
+            self.blockchain.unsubscribe(self.on_block_added)
+            self.blockchain = None
+        with self.lock:
+            if self.db is not None:
+                self._commit()
+                self.db.close()
+                self.db = None
+
+
+# Example Usage
+if __name__ == "__main__":
+    import tempfile
+    from bitcoin.core.blockchain import Blockchain
+    from bitcoin.core.consensus import REGTEST
+    from bitcoin.core.transaction import CTransaction
+
+    with tempfile.TemporaryDirectory() as tmp:
+        blockchain = Blockchain(data_dir=f"{tmp}/blocks", params=REGTEST)
+        index = WalletIndex(f"{tmp}/wallet_index.sqlite", addresses=["alice"])
+        index.attach(blockchain)
+
+        tip = blockchain.get_last_block()
+        coinbase = CTransaction.coinbase("alice", 50, 1, 1)
+        block = CBlock(1, tip.hash, [coinbase], 1, 0, REGTEST.genesis_bits)
+        while not block.is_valid(REGTEST):
+            block.nonce += 1
+            block.hash = block.calculate_hash()
+        blockchain.add_block(block)
+        print(f"Balance of alice: {index.balance('alice')} satoshis")
+        print(f"History: {index.history()}")
+
+        index.close()
+        blockchain.close()
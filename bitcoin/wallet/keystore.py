@@ -0,0 +1,333 @@
+import os
+import struct
+import zlib
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from bitcoin.utils.utils import generate_address, public_key_bytes
+from bitcoin.wallet.hd import DEFAULT_GAP_LIMIT, EXTERNAL, SEED_SIZE, HDKeyChain
+
+WALLET_MAGIC = b'BPYW'
+WALLET_VERSION = 2
+FLAG_ENCRYPTED = 1
+# magic, version, flags, scrypt salt, log2 of the scrypt cost, scrypt block size, scrypt parallelism,
+# passphrase check: nonce, KEY_CHECK encrypted under the passphrase, tag
+WALLET_HEADER = struct.Struct('<4sBB16sBBB44s')
+# Record types: an address and its private key, the HD seed, an address derived from the seed.
+RECORD_KEY = 0
+RECORD_SEED = 1
+RECORD_DERIVED = 2
+# type, address (NUL padded), payload, CRC-32 of the rest. The payload of a key or seed is 32
+# bytes, or a nonce followed by the encrypted bytes and their tag; a derived record holds DERIVED_PATH.
+RECORD = struct.Struct('<B36s32sI')
+ENCRYPTED_RECORD = struct.Struct('<B36s60sI')
+# chain, index
+DERIVED_PATH = struct.Struct('<BI')
+# Version 1 files: key records only, without the type.
+V1_RECORD = struct.Struct('<36s32sI')
+V1_ENCRYPTED_RECORD = struct.Struct('<36s60sI')
+KEY_CHECK = b'BitcoinPY wallet'
+NONCE_SIZE = 12
+SCRYPT_LOG_COST = 15
+SCRYPT_BLOCK_SIZE = 8
+SCRYPT_PARALLELISM = 1
+
+
+def private_key_from_bytes(raw):
+    """The secp256k1 private key object of a raw 32-byte big-endian scalar."""
+    return ec.derive_private_key(int.from_bytes(raw, 'big'), ec.SECP256K1())
+
+
+def private_key_to_bytes(private_key):
+    """The raw 32-byte big-endian scalar of a private key object."""
+    return private_key.private_numbers().private_value.to_bytes(32, 'big')
+
+
+def record_checksum(kind, address, payload):
+    return zlib.crc32(payload, zlib.crc32(address, kind))
+
+
+def derive_encryption_key(passphrase, salt, log_cost=SCRYPT_LOG_COST, block_size=SCRYPT_BLOCK_SIZE,
+                          parallelism=SCRYPT_PARALLELISM):
+    """The AES-256 key protecting the private keys, stretched from the passphrase with scrypt."""
+    kdf = Scrypt(salt=salt, length=32, n=2 ** log_cost, r=block_size, p=parallelism)
+    return kdf.derive(passphrase.encode('utf-8'))
+
+
+class KeyStore:
+    """
+    The private keys of a wallet, in an append-only file of fixed-size records.
+
+    A new key appends one record, and a batch of keys is written and fsynced
+    once, so saving costs the keys added rather than the whole wallet. Records
+    hold the address and the raw 32-byte private key. Opening the file only
+    reads the records: key objects and public keys are derived the first time
+    an address is used.
+
+    A wallet with an HD seed derives its new keys from it (HDKeyChain): their
+    records only hold the address and its derivation path, and the seed alone
+    is enough to restore them. The lookahead pool of the key chain is derived
+    when the file is opened.
+
+    With a passphrase, the private keys and the seed are encrypted with
+    AES-256-GCM under a key stretched from it by scrypt. Addresses stay
+    readable, so the wallet loads without decrypting anything.
+
+    Records carry a checksum. A record torn by a crash is dropped the next time
+    the file is opened.
+    """
+    def __init__(self, path='wallet.dat', passphrase=None, gap_limit=DEFAULT_GAP_LIMIT):
+        """
+        :param path: Wallet file, created if it does not exist.
+        :param passphrase: Encrypts the keys of a new wallet; required to open an encrypted one.
+        :param gap_limit: Unused addresses derived ahead of the last one used, once the wallet has a seed.
+        """
+        self.path = path
+        self.gap_limit = gap_limit
+        self.keychain = None
+        self._records = {}  # address -> raw or encrypted private key, None for derived addresses
+        self._derived = {}  # address -> (chain, index) of the addresses derived from the seed
+        self._keys = {}  # address -> {'private_key': key object, 'public_key': PEM}, derived on first use
+        if os.path.exists(path) and os.path.getsize(path):
+            self._load(passphrase)
+        else:
+            self._create(passphrase)
+        self._file = open(path, 'ab')
+
+    @staticmethod
+    def is_key_store(path):
+        """Whether path holds a wallet in this format, as opposed to an older pickled wallet."""
+        with open(path, 'rb') as f:
+            return f.read(len(WALLET_MAGIC)) == WALLET_MAGIC
+
+    def _create(self, passphrase):
+        salt = bytes(16)
+        check = bytes(NONCE_SIZE + len(KEY_CHECK) + 16)
+        flags = 0
+        self._cipher = None
+        if passphrase is not None:
+            flags = FLAG_ENCRYPTED
+            salt = os.urandom(16)
+            self._cipher = AESGCM(derive_encryption_key(passphrase, salt))
+            nonce = os.urandom(NONCE_SIZE)
+            check = nonce + self._cipher.encrypt(nonce, KEY_CHECK, None)
+        header = WALLET_HEADER.pack(WALLET_MAGIC, WALLET_VERSION, flags, salt, SCRYPT_LOG_COST, SCRYPT_BLOCK_SIZE,
+                                    SCRYPT_PARALLELISM, check)
+        self._write_file(header)
+        self.record = ENCRYPTED_RECORD if self._cipher else RECORD
+
+    def _write_file(self, data):
+        """Replace the wallet file with data, atomically."""
+        temporary = self.path + '.new'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def _load(self, passphrase):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) < WALLET_HEADER.size:
+            raise ValueError(f"{self.path} is not a wallet file")
+        magic, version, flags, salt, log_cost, block_size, parallelism, check = WALLET_HEADER.unpack_from(data)
+        if magic != WALLET_MAGIC:
+            raise ValueError(f"{self.path} is not a wallet file")
+        if version not in (1, WALLET_VERSION):
+            raise ValueError(f"Unsupported wallet version {version}")
+        self._cipher = None
+        if flags & FLAG_ENCRYPTED:
+            if passphrase is None:
+                raise ValueError("The wallet is encrypted: a passphrase is required")
+            self._cipher = AESGCM(derive_encryption_key(passphrase, salt, log_cost, block_size, parallelism))
+            try:
+                self._cipher.decrypt(check[:NONCE_SIZE], check[NONCE_SIZE:], None)
+            except InvalidTag:
+                raise ValueError("Wrong wallet passphrase") from None
+        self.record = ENCRYPTED_RECORD if self._cipher else RECORD
+
+        if version == 1:
+            # Add the record type and rewrite the file. The checksum of a key record is unchanged.
+            old = V1_ENCRYPTED_RECORD if self._cipher else V1_RECORD
+            body = memoryview(data)[WALLET_HEADER.size:]
+            body = body[:len(body) // old.size * old.size]
+            header = WALLET_HEADER.pack(magic, WALLET_VERSION, flags, salt, log_cost, block_size, parallelism, check)
+            data = header + b''.join(self.record.pack(RECORD_KEY, *fields) for fields in old.iter_unpack(body))
+            self._write_file(data)
+
+        seed = None
+        issued = [0, 0]
+        end = WALLET_HEADER.size
+        body = memoryview(data)[end:end + (len(data) - end) // self.record.size * self.record.size]
+        for kind, address, payload, checksum in self.record.iter_unpack(body):
+            if record_checksum(kind, address, payload) != checksum:
+                break
+            if kind == RECORD_KEY:
+                self._records[address.rstrip(b'\0').decode('ascii')] = payload
+            elif kind == RECORD_DERIVED:
+                name = address.rstrip(b'\0').decode('ascii')
+                chain, index = DERIVED_PATH.unpack_from(payload)
+                self._records[name] = None
+                self._derived[name] = (chain, index)
+                issued[chain] = max(issued[chain], index + 1)
+            elif kind == RECORD_SEED:
+                seed = self._decrypt(b'', payload)
+            else:
+                raise ValueError(f"Unknown wallet record type {kind}")
+            end += self.record.size
+        if end != len(data):
+            # Only the tail can be torn: records are appended strictly in order.
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        if seed is not None:
+            self.keychain = HDKeyChain(seed, self.gap_limit, issued)
+
+    @property
+    def payload_size(self):
+        return 60 if self._cipher is not None else 32
+
+    @property
+    def encrypted(self):
+        return self._cipher is not None
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        """Addresses, oldest first."""
+        return iter(self._records)
+
+    def __contains__(self, address):
+        return address in self._records
+
+    def keys(self):
+        return self._records.keys()
+
+    def __getitem__(self, address):
+        """{'private_key': key object, 'public_key': PEM public key} of address."""
+        entry = self._keys.get(address)
+        if entry is None:
+            path = self._derived.get(address)
+            if path is not None:
+                private_key = ec.derive_private_key(self.keychain.private_key(*path), ec.SECP256K1())
+            else:
+                private_key = private_key_from_bytes(self._decrypt(address.encode('ascii'), self._records[address]))
+            entry = self._keys[address] = {'private_key': private_key, 'public_key': public_key_bytes(private_key)}
+        return entry
+
+    def _encrypt(self, name, secret):
+        if self._cipher is None:
+            return secret
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._cipher.encrypt(nonce, secret, name)
+
+    def _decrypt(self, name, payload):
+        if self._cipher is None:
+            return payload
+        return self._cipher.decrypt(payload[:NONCE_SIZE], payload[NONCE_SIZE:], name)
+
+    def _append(self, records):
+        """Write (type, address bytes, payload) records in one write and one fsync."""
+        packed = []
+        for kind, name, payload in records:
+            if len(name) > 36:
+                raise ValueError(f"Address too long for the wallet file: {name.decode()}")
+            name = name.ljust(36, b'\0')
+            payload = payload.ljust(self.payload_size, b'\0')
+            packed.append(self.record.pack(kind, name, payload, record_checksum(kind, name, payload)))
+        self._file.write(b''.join(packed))
+        self.flush()
+
+    def add(self, private_keys):
+        """
+        Append private key objects in one write and one fsync. Returns their
+        addresses, in order.
+        """
+        records = []
+        added = []
+        for private_key in private_keys:
+            address = generate_address(public_key_bytes(private_key))
+            name = address.encode('ascii')
+            key = self._encrypt(name, private_key_to_bytes(private_key))
+            records.append((RECORD_KEY, name, key))
+            added.append((address, key))
+        self._append(records)
+        self._records.update(added)
+        return [address for address, _ in added]
+
+    def set_seed(self, seed):
+        """Derive every new key from seed from now on."""
+        if self.keychain is not None:
+            raise ValueError("The wallet already has a seed")
+        if len(seed) != SEED_SIZE:
+            raise ValueError(f"The seed must be {SEED_SIZE} bytes")
+        keychain = HDKeyChain(seed, self.gap_limit)
+        self._append([(RECORD_SEED, b'', self._encrypt(b'', seed))])
+        self.keychain = keychain
+
+    def _add_derived(self, issued):
+        self._append([(RECORD_DERIVED, address.encode('ascii'), DERIVED_PATH.pack(chain, index))
+                      for address, chain, index in issued])
+        for address, chain, index in issued:
+            self._records[address] = None
+            self._derived[address] = (chain, index)
+
+    def generate(self, count, chain=EXTERNAL):
+        """
+        Create count new keys, saved together: the next addresses of a chain
+        of the HD seed, or random keys if the wallet has none. Returns their
+        addresses.
+        """
+        if self.keychain is None:
+            return self.add(ec.generate_private_key(ec.SECP256K1()) for _ in range(count))
+        issued, _ = self.keychain.issue(count, chain)
+        self._add_derived(issued)
+        return [address for address, _, _ in issued]
+
+    def lookahead(self):
+        """Addresses derived from the seed ahead of those handed out, to watch for payments."""
+        return self.keychain.lookahead() if self.keychain is not None else []
+
+    def mark_used(self, address):
+        """
+        Note a payment to address. A payment into the lookahead pool saves the
+        addresses up to it as handed out. Returns the addresses added to the pool.
+        """
+        if self.keychain is None:
+            return []
+        issued, added = self.keychain.mark_used(address)
+        if issued:
+            self._add_derived(issued)
+        return added
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+# Example Usage
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = KeyStore(f"{tmp}/wallet.dat", passphrase="correct horse")
+        store.set_seed(os.urandom(SEED_SIZE))
+        addresses = store.generate(3)
+        store.close()
+        print(f"Created addresses: {addresses}")
+
+        store = KeyStore(f"{tmp}/wallet.dat", passphrase="correct horse")
+        print(f"Reopened {len(store)} keys, encrypted: {store.encrypted}, {len(store.lookahead())} in lookahead")
+        print(f"Public key of {addresses[0]}:\n{store[addresses[0]]['public_key'].decode()}")
+        try:
+            KeyStore(f"{tmp}/wallet.dat", passphrase="wrong")
+        except ValueError as e:
+            print(e)
+        store.close()
@@ -1,40 +1,103 @@
 import os
 import pickle
-from bitcoin.utils.utils import generate_private_key, generate_address, sign_data, verify_signature
+import shutil
+from bitcoin.utils.utils import load_private_key, sign_data, verify_signature
+from bitcoin.wallet.hd import CHANGE, EXTERNAL, SEED_SIZE
+from bitcoin.wallet.index import WalletIndex
+from bitcoin.wallet.keystore import KeyStore
 
 class Wallet:
-    def __init__(self, wallet_file="wallet.dat"):
+    def __init__(self, wallet_file="wallet.dat", passphrase=None, seed=None):
+        """
+        :param wallet_file: Key store file, created if it does not exist.
+        :param passphrase: Encrypts the keys of a new wallet; required to open an encrypted one.
+        :param seed: HD seed to restore the keys of a new wallet from; a random one is created otherwise.
+        """
         self.wallet_file = wallet_file
-        self.keys = self.load_wallet()
+        self.keys = self.load_wallet(passphrase)
+        if seed is not None:
+            self.keys.set_seed(seed)
+        self.index = None
+        self._pool_grew = False
 
     def save_wallet(self, filename=None):
-        """Save the wallet to a specified file."""
-        if filename is None:
-            filename = self.wallet_file
-        with open(filename, "wb") as f:
-            pickle.dump(self.keys, f)
-
-    def load_wallet(self):
-        """Load the wallet from a file."""
-        if os.path.exists(self.wallet_file):
+        """Make sure every key is on disk, and copy the wallet file to filename if one is given."""
+        self.keys.flush()
+        if filename is not None and os.path.abspath(filename) != os.path.abspath(self.wallet_file):
+            shutil.copyfile(self.wallet_file, filename)
+
+    def load_wallet(self, passphrase=None):
+        """Open the wallet file, converting a wallet pickled by older versions (kept as a .bak file)."""
+        if os.path.exists(self.wallet_file) and os.path.getsize(self.wallet_file) \
+                and not KeyStore.is_key_store(self.wallet_file):
             with open(self.wallet_file, "rb") as f:
-                return pickle.load(f)
-        return {}
+                legacy = pickle.load(f)
+            converted = self.wallet_file + ".new"
+            if os.path.exists(converted):
+                os.remove(converted)
+            store = KeyStore(converted, passphrase)
+            store.add(load_private_key(entry['private_key']) for entry in legacy.values())
+            store.close()
+            os.replace(self.wallet_file, self.wallet_file + ".bak")
+            os.replace(converted, self.wallet_file)
+        return KeyStore(self.wallet_file, passphrase)
 
     def create_new_key(self):
         """Generate a new keypair and save it to the wallet."""
-        private_key, public_key = generate_private_key()
-        address = generate_address(public_key)
-        self.keys[address] = {
-            'private_key': private_key,
-            'public_key': public_key
-        }
-        self.save_wallet()
-        return address
+        return self.create_new_keys(1)[0]
+
+    def create_new_keys(self, count, change=False):
+        """
+        Derive the next count addresses from the wallet's HD seed, saved with a
+        single write and fsync. A wallet without a seed, converted from an older
+        version, gets one first: its earlier keys stay as they are.
+        """
+        if self.keys.keychain is None:
+            self.keys.set_seed(os.urandom(SEED_SIZE))
+        addresses = self.keys.generate(count, CHANGE if change else EXTERNAL)
+        if self.index is not None:
+            for address in addresses + self.keys.lookahead():
+                self.index.add_address(address)
+        return addresses
+
+    def _address_used(self, address):
+        added = self.keys.mark_used(address)
+        if added:
+            self._pool_grew = True
+        return added
 
     def get_address_list(self):
         """Return a list of all addresses in the wallet."""
-        return list(self.keys.keys())
+        return list(self.keys)
+
+    def attach(self, blockchain, index_file="wallet_index.sqlite", workers=1):
+        """
+        Index the outputs and history of the wallet's addresses on blockchain,
+        catching up from the last block indexed, and follow its new blocks.
+        """
+        self.index = WalletIndex(index_file, self.get_address_list() + self.keys.lookahead(), workers=workers)
+        self.index.on_address_used = self._address_used
+        self._pool_grew = False
+        self.index.attach(blockchain)
+        # Blocks scanned before a payment extended the lookahead pool were not searched for the
+        # new addresses: this happens when restoring from the seed, until the pool stops growing.
+        while self._pool_grew:
+            self._pool_grew = False
+            self.index.rescan()
+        return self.index
+
+    def _require_index(self):
+        if self.index is None:
+            raise ValueError("Wallet is not attached to a blockchain.")
+        return self.index
+
+    def get_balance(self, address=None):
+        """Return the unspent satoshis of an address, or of the whole wallet."""
+        return self._require_index().balance(address)
+
+    def get_history(self, address=None, limit=None):
+        """Return the transactions of an address, or of the whole wallet, newest first."""
+        return self._require_index().history(address, limit)
 
     def sign_transaction(self, address, data):
         """Sign data using the private key associated with the address."""
@@ -47,6 +110,13 @@ class Wallet:
         """Verify the signature of a transaction."""
         return verify_signature(public_key, data, signature)
 
+    def close(self):
+        """Close the wallet file and the index, if attached."""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        self.keys.close()
+
 
 # Example usage
 if __name__ == "__main__":
@@ -1,57 +1,138 @@
 import argparse
+import logging
+import os
+import time
 from bitcoin.core.blockchain import Blockchain
+from bitcoin.core.consensus import MAINNET, REGTEST
 from bitcoin.wallet.wallet import Wallet
 from bitcoin.core.mining import Miner
+from bitcoin.core.transaction import TransactionPool
+from bitcoin.core.utxo import DEFAULT_CACHE_SIZE, UTXOSet
+from bitcoin.core.validation import format_report
 from bitcoin.network.p2p import P2PNode
+from bitcoin.network.stratum import WorkServer
+from bitcoin.utils.metrics import PROFILE_INTERVAL, MetricsServer, metrics, profiler
+from bitcoin.utils.utils import SignatureVerifier
+
+logger = logging.getLogger("bitcoin.node")
 
 def main():
     parser = argparse.ArgumentParser(description="Bitcoin Node")
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Host address to run the node")
     parser.add_argument("--port", type=int, default=8333, help="Port to run the node")
     parser.add_argument("--mine", action="store_true", help="Enable mining mode")
+    parser.add_argument("--mining-workers", type=int, default=1, help="Number of processes searching for proof-of-work")
+    parser.add_argument("--verify-workers", type=int, default=1, help="Number of processes verifying block signatures")
     parser.add_argument("--wallet", type=str, default=None, help="Path to the wallet file")
+    parser.add_argument("--utxo-cache", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Unspent outputs kept in memory before flushing to chainstate.sqlite")
+    parser.add_argument("--scan-workers", type=int, default=1,
+                        help="Number of processes scanning blocks when the wallet index catches up")
+    parser.add_argument("--work-server", type=int, default=None, metavar="PORT",
+                        help="Serve block templates to Stratum workers on this port")
+    parser.add_argument("--validation-report", action="store_true",
+                        help="Print the time every validation stage took for each block connected")
+    parser.add_argument("--regtest", action="store_true",
+                        help="Run a test chain in regtest/: easiest target, no difficulty retargeting")
+    parser.add_argument("--log-level", type=str, default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Least severe messages logged; DEBUG adds every message handled and block validated")
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                        help="Serve metrics at http://127.0.0.1:PORT/metrics (and the profile at /profile)")
+    parser.add_argument("--profile", type=float, nargs="?", const=PROFILE_INTERVAL, default=None, metavar="SECONDS",
+                        help="Sample the stacks of the hot paths every SECONDS; written to profile.txt on shutdown")
 
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.profile is not None:
+        profiler.start(args.profile)
 
-    # Initialize Blockchain
-    blockchain = Blockchain()
+    # Initialize Blockchain, checking every block against the unspent outputs
+    data_dir = "regtest" if args.regtest else "."
+    os.makedirs(data_dir, exist_ok=True)
+    utxo_set = UTXOSet(os.path.join(data_dir, "chainstate.sqlite"), cache_size=args.utxo_cache)
+    blockchain = Blockchain(data_dir=os.path.join(data_dir, "blocks"),
+                            verifier=SignatureVerifier(workers=args.verify_workers), utxo_set=utxo_set,
+                            params=REGTEST if args.regtest else MAINNET)
+    if args.validation_report:
+        def log_report(block):
+            # Blocks stored on a side branch earlier are connected by a reorganization without a new report.
+            report = blockchain.reports.get(block.hash)
+            if report is not None:
+                logger.info(format_report(report))
+        blockchain.subscribe(log_report)
 
-    # Initialize Wallet
+    # Initialize Wallet; its keys are encrypted when WALLET_PASSPHRASE is set
+    passphrase = os.environ.get("WALLET_PASSPHRASE")
     if args.wallet:
-        wallet = Wallet.load_wallet(args.wallet)
+        wallet = Wallet(args.wallet, passphrase=passphrase)
     else:
-        wallet = Wallet()
+        wallet = Wallet(passphrase=passphrase)
         wallet.save_wallet("wallet.dat")
-        print("New wallet created and saved to 'wallet.dat'.")
+        logger.info("New wallet created and saved to 'wallet.dat'.")
     
     # Ensure the wallet has at least one address
     if not wallet.get_address_list():
         new_address = wallet.create_new_key()
-        print(f"New mining address created: {new_address}")
+        logger.info("New mining address created: %s", new_address)
     else:
-        print(f"Using existing wallet addresses: {wallet.get_address_list()}")
+        logger.info("Using existing wallet addresses: %s", wallet.get_address_list())
+
+    # Index the wallet's outputs, scanning the blocks added since it last ran
+    wallet.attach(blockchain, index_file=os.path.join(data_dir, "wallet_index.sqlite"), workers=args.scan_workers)
+    logger.info("Wallet balance: %d satoshis", wallet.get_balance())
     
-    print(f"Starting Bitcoin Node at {args.host}:{args.port}...")
+    logger.info("Starting Bitcoin Node at %s:%s...", args.host, args.port)
 
 
-    # Start P2P Node
-    p2p_node = P2PNode(host=args.host, port=args.port, blockchain=blockchain)
+    # Start P2P Node, sharing the transaction pool with the miner
+    transaction_pool = TransactionPool(utxo_set=utxo_set)
+    p2p_node = P2PNode(host=args.host, port=args.port, blockchain=blockchain, transaction_pool=transaction_pool)
+
+    # State of this node, read when the metrics are collected
+    metrics.gauge('chain_height', "Height of the active chain's tip", function=lambda: len(blockchain.chain) - 1)
+    metrics.gauge('mempool_transactions', "Transactions in the pool", function=lambda: len(transaction_pool))
+    metrics.gauge('mempool_bytes', "Bytes of transaction data in the pool", function=lambda: transaction_pool.size)
+    metrics.gauge('p2p_peers', "Connected peers", function=lambda: len(p2p_node.peers))
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(port=args.metrics_port)
+        metrics_server.start()
 
     if args.mine:
-        print("Mining enabled. Starting miner...")
-        transaction_pool = []  # Initialize an empty transaction pool
+        logger.info("Mining enabled. The miner starts once the node has caught up with its peers")
         mining_address = wallet.get_address_list()[0]  # Use the first address in the wallet
-        miner = Miner(blockchain=blockchain, transaction_pool=transaction_pool, mining_address=mining_address)
+        miner = Miner(blockchain=blockchain, transaction_pool=transaction_pool, mining_address=mining_address,
+                      workers=args.mining_workers)
         p2p_node.set_miner(miner)
-        miner.start_mining()
+        metrics.gauge('mining_hashrate', "Hashes per second of the miner's current search",
+                      function=lambda: miner.hashrate)
+
+    if args.work_server is not None:
+        # External worker processes mine for the first wallet address as well
+        work_server = WorkServer(blockchain, transaction_pool, wallet.get_address_list()[0],
+                                 host=args.host, port=args.work_server)
+        work_server.start()
 
     try:
         p2p_node.start_node()
+        # The node runs on its own thread: keep the main thread alive
+        while True:
+            time.sleep(1)
     except KeyboardInterrupt:
-        print("Shutting down node...")
+        logger.info("Shutting down node...")
         if args.mine:
             miner.stop_mining()
+        if args.work_server is not None:
+            work_server.stop()
         p2p_node.stop_node()
+        if args.metrics_port is not None:
+            metrics_server.stop()
+        if args.profile is not None:
+            profiler.stop()
+            with open("profile.txt", "w") as f:
+                f.write(profiler.collapsed())
+            logger.info("Profile of %d samples written to profile.txt", profiler.samples)
+        wallet.close()
+        blockchain.close()
 
 if __name__ == "__main__":
     main()
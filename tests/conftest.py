@@ -0,0 +1,56 @@
+import pytest
+
+from bitcoin.core.blockchain import Blockchain, CBlock
+from bitcoin.core.consensus import BLOCK_REWARD, REGTEST, bits_to_target
+from bitcoin.core.mining import search_nonces
+from bitcoin.core.transaction import CTransaction
+from bitcoin.core.utxo import UTXOSet
+from bitcoin.utils.utils import generate_address, generate_private_key
+
+
+@pytest.fixture(scope="session")
+def key():
+    """A PEM private key and its address."""
+    private_key, public_key = generate_private_key()
+    return private_key, generate_address(public_key)
+
+
+@pytest.fixture
+def mine():
+    """mine(parent, transactions=(), miner="miner"): a regtest block on parent, its coinbase paying miner."""
+    def mine(parent, transactions=(), miner="miner"):
+        height = parent.index + 1
+        coinbase = CTransaction.coinbase(miner, BLOCK_REWARD, height, height)
+        block = CBlock(height, parent.hash, [coinbase, *transactions], parent.timestamp + 1, 0, REGTEST.genesis_bits)
+        block.nonce = search_nonces(block.header_prefix(), bits_to_target(block.bits), 0, 1, lambda: False)
+        block.hash = block.calculate_hash()
+        return block
+    return mine
+
+
+@pytest.fixture
+def spend(key):
+    """spend(coinbase, receiver, amount, fee): a signed transaction spending a coinbase paid to key."""
+    def spend(coinbase, receiver, amount, fee=0.001):
+        private_key, address = key
+        change = coinbase.amount - amount - fee
+        tx = CTransaction(address, receiver, amount, fee, coinbase.timestamp, inputs=[(coinbase.txid, 0)],
+                          change=round(change, 8))
+        tx.sign_transaction(private_key)
+        return tx
+    return spend
+
+
+@pytest.fixture
+def missing_spend(key, spend):
+    """A signed transaction spending an output no block created."""
+    return spend(CTransaction.coinbase(key[1], BLOCK_REWARD, 99, 99), "receiver", 30)
+
+
+@pytest.fixture
+def chain(tmp_path):
+    """A regtest Blockchain in a temporary directory, with a UTXO set."""
+    blockchain = Blockchain(data_dir=str(tmp_path / 'blocks'), params=REGTEST,
+                            utxo_set=UTXOSet(str(tmp_path / 'chainstate.sqlite')))
+    yield blockchain
+    blockchain.close()
@@ -0,0 +1,141 @@
+import pytest
+
+from bitcoin.core.blockchain import Blockchain
+from bitcoin.core.consensus import REGTEST, block_work
+from bitcoin.core.mining import BlockTemplate
+from bitcoin.core.transaction import CTransaction, TransactionPool
+from bitcoin.core.utxo import UTXOSet
+from bitcoin.network.p2p import P2PNode
+
+
+def active_hashes(chain):
+    return [chain.hash_at(height) for height in range(len(chain.main_chain))]
+
+
+@pytest.fixture
+def funded(chain, key, mine, spend):
+    """
+    genesis - b1 - b2 on the active chain: b1 pays its coinbase to key, and b2
+    spends it, paying "receiver".
+    """
+    _, address = key
+    b1 = mine(chain.get_last_block(), miner=address)
+    assert chain.add_block(b1)
+    payment = spend(b1.transactions[0], "receiver", 30)
+    b2 = mine(b1, [payment])
+    assert chain.add_block(b2)
+    return b1, b2, payment
+
+
+def test_extends_the_active_chain(chain, funded):
+    b1, b2, payment = funded
+    assert active_hashes(chain)[1:] == [b1.hash, b2.hash]
+    assert chain.tip.work == 3 * block_work(REGTEST.genesis_bits)
+    assert chain.utxo_set.get(b1.transactions[0].txid, 0) is None
+    assert chain.utxo_set.get(payment.txid, 0).address == "receiver"
+
+
+def test_equal_work_branch_does_not_reorganize(chain, funded, mine):
+    b1, b2, _ = funded
+    # First seen wins: a side branch as heavy as the active chain is stored, not activated.
+    assert chain.add_block(mine(b1, miner="side")) is False
+    assert chain.get_last_block().hash == b2.hash
+
+
+def test_reorganization_onto_heavier_branch_restores_spent_coins(chain, funded, mine):
+    b1, b2, payment = funded
+    removed = []
+    chain.subscribe(lambda block: None, removed.append)
+    c2 = mine(b1, miner="side")
+    c3 = mine(c2, miner="side")
+    assert chain.add_block(c2) is False
+    assert chain.add_block(c3) is True
+
+    assert active_hashes(chain)[1:] == [b1.hash, c2.hash, c3.hash]
+    assert chain.tip.work == 4 * block_work(REGTEST.genesis_bits)
+    assert [block.hash for block in removed] == [b2.hash]
+    # The payment of the disconnected b2 is undone: b1's coinbase is unspent again.
+    coin = chain.utxo_set.get(b1.transactions[0].txid, 0)
+    assert coin is not None and coin.value == b1.transactions[0].outputs()[0][1]
+    assert chain.utxo_set.get(payment.txid, 0) is None
+    assert chain.utxo_set.get(c3.transactions[0].txid, 0) is not None
+    assert chain.utxo_set.get(b2.transactions[0].txid, 0) is None
+
+
+def test_reorganization_back_to_the_first_branch(chain, funded, mine):
+    b1, b2, payment = funded
+    c2 = mine(b1, miner="side")
+    c3 = mine(c2, miner="side")
+    chain.add_block(c2)
+    chain.add_block(c3)
+    b3 = mine(b2)
+    b4 = mine(b3)
+    assert chain.add_block(b3) is False
+    assert chain.add_block(b4) is True
+
+    assert active_hashes(chain)[1:] == [b1.hash, b2.hash, b3.hash, b4.hash]
+    assert chain.utxo_set.get(b1.transactions[0].txid, 0) is None
+    assert chain.utxo_set.get(payment.txid, 0).address == "receiver"
+    assert chain.utxo_set.get(c3.transactions[0].txid, 0) is None
+
+
+def test_reorganization_evicts_pooled_spends_of_removed_outputs(chain, key, mine, spend):
+    pool = TransactionPool(utxo_set=chain.utxo_set)
+    chain.subscribe(pool.remove_block, lambda block: pool.revalidate())
+    genesis = chain.get_last_block()
+    b1 = mine(genesis, miner=key[1])
+    chain.add_block(b1)
+    payment = spend(b1.transactions[0], "receiver", 30)
+    assert pool.add_transaction(payment)
+
+    c1 = mine(genesis, miner="side")
+    c2 = mine(c1, miner="side")
+    chain.add_block(c1)
+    assert chain.add_block(c2) is True
+    # b1's coinbase is gone with b1: the payment spending it can no longer be mined.
+    assert payment.txid not in pool
+    assert not pool.spends
+    template = BlockTemplate(chain, pool, "miner")
+    assert template.transactions == [template.coinbase]
+    block = mine(c2, template.transactions[1:])
+    assert chain.add_block(block) is True
+
+
+def test_node_drops_pooled_spends_of_disconnected_blocks(chain, funded, key, mine):
+    b1, b2, payment = funded
+    private_key, address = key
+    node = P2PNode(blockchain=chain, transaction_pool=TransactionPool(utxo_set=chain.utxo_set))
+    # Spends the change b2's payment sent back to key.
+    change = CTransaction(address, "receiver", 5, 0.001, payment.timestamp, inputs=[(payment.txid, 1)],
+                          change=round(payment.change - 5 - 0.001, 8))
+    change.sign_transaction(private_key)
+    assert node.transaction_pool.add_transaction(change)
+
+    c2 = mine(b1, miner="side")
+    chain.add_block(c2)
+    assert chain.add_block(mine(c2, miner="side")) is True
+    # The payment is pending again; the transaction spending its change waits on it and is dropped.
+    assert list(node.transaction_pool.transactions) == [payment.txid]
+
+
+def test_reorganization_persists_across_restart(tmp_path, key, mine, spend):
+    def open_chain():
+        return Blockchain(data_dir=str(tmp_path / 'blocks'), params=REGTEST,
+                          utxo_set=UTXOSet(str(tmp_path / 'chainstate.sqlite')))
+
+    chain = open_chain()
+    b1 = mine(chain.get_last_block(), miner=key[1])
+    payment = spend(b1.transactions[0], "receiver", 30)
+    c2 = mine(b1, miner="side")
+    c3 = mine(c2, miner="side")
+    for block in (b1, mine(b1, [payment]), c2, c3):
+        chain.add_block(block)
+    chain.close()
+
+    chain = open_chain()
+    try:
+        assert chain.get_last_block().hash == c3.hash
+        assert chain.utxo_set.get(b1.transactions[0].txid, 0) is not None
+        assert chain.utxo_set.get(payment.txid, 0) is None
+    finally:
+        chain.close()
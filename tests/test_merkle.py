@@ -0,0 +1,67 @@
+from hashlib import sha256
+
+import pytest
+
+from bitcoin.core.merkle import EMPTY_ROOT, MerkleTree, hash_pair, merkle_root, verify_proof
+
+
+def make_leaves(count):
+    return [sha256(f"tx-{i}".encode('utf-8')).digest() for i in range(count)]
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 4, 5, 7, 8, 9, 33])
+def test_tree_root_matches_merkle_root(count):
+    leaves = make_leaves(count)
+    assert MerkleTree(leaves).root == merkle_root(leaves)
+
+
+def test_small_roots():
+    a, b, c = make_leaves(3)
+    assert merkle_root([]) == EMPTY_ROOT
+    assert merkle_root([a]) == a
+    assert merkle_root([a, b]) == hash_pair(a, b)
+    # The odd node at the end of a level is paired with itself.
+    assert merkle_root([a, b, c]) == hash_pair(hash_pair(a, b), hash_pair(c, c))
+
+
+def test_append_and_update_keep_the_root_in_step():
+    leaves = make_leaves(11)
+    tree = MerkleTree()
+    for count, leaf in enumerate(leaves, 1):
+        tree.append(leaf)
+        assert tree.root == merkle_root(leaves[:count])
+    replaced = list(leaves)
+    for index in (0, 5, 10):
+        replaced[index] = sha256(b"replaced-%d" % index).digest()
+        tree.update(index, replaced[index])
+        assert tree.root == merkle_root(replaced)
+
+
+@pytest.mark.parametrize("count", [1, 2, 5, 8, 13])
+def test_every_proof_verifies(count):
+    leaves = make_leaves(count)
+    tree = MerkleTree(leaves)
+    for index, leaf in enumerate(leaves):
+        assert verify_proof(leaf, index, tree.proof(index), tree.root)
+
+
+def test_tampered_proofs_are_rejected():
+    leaves = make_leaves(13)
+    tree = MerkleTree(leaves)
+    index = 6
+    proof = tree.proof(index)
+    for level in range(len(proof)):
+        tampered = list(proof)
+        tampered[level] = bytes([proof[level][0] ^ 1]) + proof[level][1:]
+        assert not verify_proof(leaves[index], index, tampered, tree.root)
+    # The right leaf at the wrong position, the wrong leaf, a truncated path, the wrong root.
+    assert not verify_proof(leaves[index], index + 1, proof, tree.root)
+    assert not verify_proof(leaves[index + 1], index, proof, tree.root)
+    assert not verify_proof(leaves[index], index, proof[:-1], tree.root)
+    assert not verify_proof(leaves[index], index, proof, merkle_root(leaves[:-1]))
+
+
+def test_proof_index_out_of_range():
+    tree = MerkleTree(make_leaves(4))
+    with pytest.raises(IndexError):
+        tree.proof(4)
@@ -0,0 +1,31 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from bitcoin.utils.metrics import MetricsRegistry, MetricsServer, SamplingProfiler
+
+
+@pytest.fixture
+def server():
+    metrics_server = MetricsServer(MetricsRegistry(), SamplingProfiler(), port=0)
+    metrics_server.start()
+    yield metrics_server
+    metrics_server.stop()
+
+
+def get(server, path):
+    with urlopen(f"http://127.0.0.1:{server.port}{path}", timeout=10) as response:
+        return response.status
+
+
+@pytest.mark.parametrize("limit", ["abc", "-1", "1.5"])
+def test_profile_top_rejects_a_bad_limit(server, limit):
+    with pytest.raises(HTTPError) as error:
+        get(server, f"/profile/top?limit={limit}")
+    assert error.value.code == 400
+
+
+@pytest.mark.parametrize("query", ["", "?limit=0", "?limit=5"])
+def test_profile_top(server, query):
+    assert get(server, f"/profile/top{query}") == 200
@@ -0,0 +1,26 @@
+import time
+
+from bitcoin.core.mining import Miner
+from bitcoin.core.transaction import TransactionPool
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_miner_survives_a_rejected_block(chain, missing_spend):
+    # Without a UTXO set the pool cannot tell the transaction spends an output that does not exist.
+    pool = TransactionPool()
+    pool.add_transaction(missing_spend)
+
+    miner = Miner(chain, pool, "miner")
+    miner.start_mining()
+    try:
+        wait_for(lambda: len(chain.main_chain) > 1)
+    finally:
+        miner.stop_mining()
+    assert missing_spend.txid not in pool
+    assert [tx.is_coinbase() for tx in chain.get_last_block().transactions] == [True]
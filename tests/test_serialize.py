@@ -0,0 +1,129 @@
+import pytest
+
+from bitcoin.core.blockchain import BLOCK_HEADER, CBlock
+from bitcoin.core.consensus import MAINNET
+from bitcoin.core.serialize import SerializationError, encode_bytes, encode_varint, read_bytes, read_varint
+from bitcoin.core.transaction import CTransaction
+from bitcoin.utils.utils import generate_address, generate_private_key
+
+RECEIVER = "1BoatSLRHtKNngkdXEeobR76b53LETtpyT"
+
+
+@pytest.fixture(scope="module")
+def signed_tx():
+    private_key, public_key = generate_private_key()
+    tx = CTransaction(generate_address(public_key), RECEIVER, 0.5, 0.0001, 1234567890,
+                      inputs=[("ab" * 32, 0), ("cd" * 32, 3)], change=1.25)
+    tx.sign_transaction(private_key)
+    return tx
+
+
+@pytest.fixture(scope="module")
+def block(signed_tx):
+    coinbase = CTransaction.coinbase(RECEIVER, 50.0001, 1, 1234567890)
+    return CBlock(1, "00" * 32, [coinbase, signed_tx], 1234567890, 42, MAINNET.genesis_bits)
+
+
+def assert_same_transaction(decoded, tx):
+    for field in ('version', 'sender', 'receiver', 'amount', 'fee', 'timestamp', 'inputs', 'change', 'signature',
+                  'public_key'):
+        assert getattr(decoded, field) == getattr(tx, field), field
+    assert decoded.txid == tx.txid
+
+
+def test_coinbase_round_trip():
+    coinbase = CTransaction.coinbase(RECEIVER, 50, 7, 1234567890)
+    data = coinbase.serialize()
+    decoded, end = CTransaction.deserialize(data)
+    assert end == len(data)
+    assert decoded.is_coinbase()
+    assert_same_transaction(decoded, coinbase)
+    assert decoded.serialize() == data
+
+
+def test_signed_transaction_round_trip(signed_tx):
+    data = signed_tx.serialize()
+    decoded, end = CTransaction.deserialize(data)
+    assert end == len(data)
+    assert_same_transaction(decoded, signed_tx)
+    assert decoded.serialize() == data
+    assert decoded.verify_signature()
+
+
+def test_block_round_trip(block):
+    data = block.serialize()
+    decoded, end = CBlock.deserialize(data)
+    assert end == len(data)
+    assert decoded.serialize() == data
+    assert decoded.hash == block.hash
+    assert decoded.index == block.index
+    assert decoded.merkle_root == block.merkle_root
+    assert decoded.calculate_merkle_root() == block.merkle_root
+    for decoded_tx, tx in zip(decoded.transactions, block.transactions):
+        assert_same_transaction(decoded_tx, tx)
+
+
+def test_header_round_trip(block):
+    header = block.serialize_header()
+    assert len(header) == BLOCK_HEADER.size
+    decoded, end = CBlock.deserialize_header(header, index=block.index)
+    assert end == BLOCK_HEADER.size
+    assert (decoded.hash, decoded.prev_hash, decoded.timestamp, decoded.bits, decoded.nonce) == \
+        (block.hash, block.prev_hash, block.timestamp, block.bits, block.nonce)
+
+
+def test_parse_from_memoryview_at_offset(block, signed_tx):
+    # Messages are parsed in place: a block behind other data in a larger buffer.
+    data = b"junk" + block.serialize() + signed_tx.serialize()
+    view = memoryview(data)
+    decoded, offset = CBlock.deserialize(view, 4)
+    assert decoded.hash == block.hash
+    tx, end = CTransaction.deserialize(view, offset)
+    assert end == len(data)
+    assert_same_transaction(tx, signed_tx)
+    # Nothing decoded keeps a reference to the buffer.
+    assert isinstance(tx.public_key, bytes)
+    view.release()
+
+
+def test_truncated_transaction(signed_tx):
+    data = signed_tx.serialize()
+    for end in range(len(data)):
+        with pytest.raises(SerializationError):
+            CTransaction.deserialize(data[:end])
+
+
+def test_truncated_block(block):
+    data = block.serialize()
+    for end in range(len(data)):
+        with pytest.raises(SerializationError):
+            CBlock.deserialize(memoryview(data)[:end])
+
+
+def test_unsupported_versions(block, signed_tx):
+    with pytest.raises(SerializationError):
+        CTransaction.deserialize(b"\x00" + signed_tx.serialize()[1:])
+    with pytest.raises(SerializationError):
+        CBlock.deserialize(b"\xff\xff\xff\xff" + block.serialize()[4:])
+
+
+def test_invalid_utf8(signed_tx):
+    data = signed_tx.serialize()
+    # The sender follows the 1-byte version; replace it with bytes that are not UTF-8.
+    sender_length = len(encode_bytes(signed_tx.sender.encode('utf-8')))
+    corrupted = data[:1] + encode_bytes(b"\xff\xfe") + data[1 + sender_length:]
+    with pytest.raises(SerializationError):
+        CTransaction.deserialize(corrupted)
+
+
+def test_length_past_the_end():
+    with pytest.raises(SerializationError):
+        read_bytes(memoryview(encode_varint(10) + b"short"), 0)
+    with pytest.raises(SerializationError):
+        read_varint(memoryview(b"\xfd\x01"), 0)
+
+
+@pytest.mark.parametrize("value", [0, 0xfc, 0xfd, 0xffff, 0x10000, 0xffffffff, 0x100000000])
+def test_varint_round_trip(value):
+    data = encode_varint(value)
+    assert read_varint(memoryview(data), 0) == (value, len(data))
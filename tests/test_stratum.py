@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+from bitcoin.core.transaction import TransactionPool
+from bitcoin.network.stratum import WorkServer
+
+
+def test_rejected_block_transactions_leave_the_template(chain, mine, missing_spend):
+    # Without a UTXO set the pool cannot tell the transaction spends an output that does not exist.
+    pool = TransactionPool()
+    pool.add_transaction(missing_spend)
+    server = WorkServer(chain, pool, "miner")
+    server.new_job(clean=True)
+    assert missing_spend in server.template.transactions
+
+    block = mine(chain.get_last_block(), server.template.transactions[1:])
+    assert server._add_block(block, SimpleNamespace(name="worker")) is False
+    assert missing_spend.txid not in pool
+    server.new_job(clean=True)
+    assert server.template.transactions == [server.template.coinbase]
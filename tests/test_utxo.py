@@ -0,0 +1,124 @@
+import pytest
+
+from bitcoin.core.blockchain import CBlock, genesis_block
+from bitcoin.core.consensus import BLOCK_REWARD, REGTEST
+from bitcoin.core.transaction import CTransaction, to_satoshis
+from bitcoin.core.utxo import UTXOSet
+
+
+@pytest.fixture
+def utxo(tmp_path):
+    utxo_set = UTXOSet(str(tmp_path / 'chainstate.sqlite'))
+    yield utxo_set
+    utxo_set.close()
+
+
+@pytest.fixture
+def blocks(key, mine, spend):
+    """b1 pays its coinbase to key; b2 spends it, paying "receiver" and the change back."""
+    b1 = mine(genesis_block(REGTEST), miner=key[1])
+    payment = spend(b1.transactions[0], "receiver", 30)
+    b2 = mine(b1, [payment])
+    return b1, b2, payment
+
+
+def coinbase_of(block):
+    return block.transactions[0].txid
+
+
+def block_paying(parent, reward, transactions):
+    # Proof-of-work is not the UTXO set's concern: the nonce is left at 0.
+    coinbase = CTransaction.coinbase("miner", reward, parent.index + 1, parent.index + 1)
+    return CBlock(parent.index + 1, parent.hash, [coinbase, *transactions], parent.timestamp + 1, 0,
+                  REGTEST.genesis_bits)
+
+
+def test_connect_spends_and_creates(utxo, blocks, key):
+    b1, b2, payment = blocks
+    utxo.connect_block(b1, 1)
+    assert utxo.get(coinbase_of(b1), 0).value == to_satoshis(BLOCK_REWARD)
+    utxo.connect_block(b2, 2)
+    assert utxo.get(coinbase_of(b1), 0) is None
+    assert utxo.get(payment.txid, 0).address == "receiver"
+    assert utxo.get(payment.txid, 1).address == key[1]
+    assert utxo.best_block == b2.hash
+
+
+@pytest.mark.parametrize("flush", [False, True])
+def test_disconnect_restores_spent_coins(utxo, blocks, flush):
+    b1, b2, payment = blocks
+    utxo.connect_block(b1, 1)
+    utxo.connect_block(b2, 2)
+    if flush:
+        # The undo data and the spends are now only in the database, not the cache.
+        utxo.flush()
+        utxo.cache.clear()
+        assert not utxo.undo
+    utxo.disconnect_block(b2)
+
+    coin = utxo.get(coinbase_of(b1), 0)
+    assert coin is not None and coin.value == to_satoshis(BLOCK_REWARD) and coin.height == 1 and coin.coinbase
+    assert utxo.get(payment.txid, 0) is None
+    assert utxo.get(payment.txid, 1) is None
+    assert utxo.get(coinbase_of(b2), 0) is None
+    assert utxo.best_block == b1.hash
+
+
+def test_disconnect_after_flush_persists(tmp_path, blocks):
+    b1, b2, payment = blocks
+    path = str(tmp_path / 'chainstate.sqlite')
+    utxo = UTXOSet(path)
+    utxo.connect_block(b1, 1)
+    utxo.connect_block(b2, 2)
+    utxo.flush()
+    utxo.disconnect_block(b2)
+    utxo.close()
+
+    reopened = UTXOSet(path)
+    try:
+        assert reopened.best_block == b1.hash
+        assert reopened.get(coinbase_of(b1), 0) is not None
+        assert reopened.get(payment.txid, 0) is None
+        # b2 can be connected again on top of the restored coins.
+        reopened.connect_block(b2, 2)
+        assert reopened.get(payment.txid, 0) is not None
+    finally:
+        reopened.close()
+
+
+def test_only_the_tip_can_be_disconnected(utxo, blocks):
+    b1, b2, _ = blocks
+    utxo.connect_block(b1, 1)
+    utxo.connect_block(b2, 2)
+    with pytest.raises(ValueError):
+        utxo.disconnect_block(b1)
+
+
+def test_invalid_spend_leaves_the_set_unchanged(utxo, blocks, mine, spend):
+    b1, b2, payment = blocks
+    utxo.connect_block(b1, 1)
+    utxo.connect_block(b2, 2)
+    # Spends b1's coinbase a second time.
+    double_spend = mine(b2, [spend(b1.transactions[0], "thief", 10)])
+    with pytest.raises(ValueError):
+        utxo.connect_block(double_spend, 3)
+    assert utxo.best_block == b2.hash
+    assert utxo.get(payment.txid, 0) is not None
+
+
+def test_coinbase_may_claim_reward_and_fees(utxo, blocks):
+    b1, _, payment = blocks
+    utxo.connect_block(b1, 1)
+    block = block_paying(b1, BLOCK_REWARD + payment.fee, [payment])
+    utxo.connect_block(block, 2)
+    assert utxo.get(coinbase_of(block), 0).value == to_satoshis(BLOCK_REWARD + payment.fee)
+
+
+def test_coinbase_paying_more_is_rejected(utxo, blocks):
+    b1, _, payment = blocks
+    utxo.connect_block(b1, 1)
+    block = block_paying(b1, BLOCK_REWARD + payment.fee + 0.00000001, [payment])
+    with pytest.raises(ValueError, match="Coinbase pays"):
+        utxo.connect_block(block, 2)
+    assert utxo.best_block == b1.hash
+    assert utxo.get(coinbase_of(b1), 0) is not None